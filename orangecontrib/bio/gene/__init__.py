@@ -2,6 +2,10 @@ from __future__ import absolute_import
 import sys
 import os
 import time
+import threading
+import uuid
+
+import numpy
 
 from ..utils import serverfiles
 
@@ -12,6 +16,10 @@ from .. import dicty as obiDicty
 from .. import biomart as obiBioMart
 
 from . import homology
+from .aliasindex import AliasIndex
+from .infoindex import GeneInfoIndex
+from .historyindex import GeneHistoryIndex
+from .joined import JoinedAliases
 
 #python3
 try:
@@ -52,14 +60,25 @@ class GeneInfo(object):
     def __init__(self, line):
         """ Construct the GeneInfo object from a line in the NCBI gene_info file
         """
-        line = line.split("\t")
-        for attr, value in zip(self.__slots__, line):
+        self._set(zip(self.__slots__, line.split("\t")))
+
+    def _set(self, values):
+        for attr, value in values:
             if value == "-":
                 value = None
             if attr in GeneInfo.NCBI_MULTIPLE_CARDINALITY_TAGS:
                 value = value.split("|") if value != None else []
             setattr(self, attr, value)
 
+    @classmethod
+    def from_columns(cls, columns, values):
+        """ Construct the GeneInfo object with only the given fields
+        (other fields are left unset).
+        """
+        info = cls.__new__(cls)
+        info._set(zip(columns, values))
+        return info
+
     def __repr__(self):
         def format(value):
             if not value:
@@ -68,7 +87,7 @@ class GeneInfo(object):
                 return "|".join(value)
             else:
                 return value
-        return "\t".join(format(getattr(self, slot)) for slot in self.__slots__)
+        return "\t".join(format(getattr(self, slot, None)) for slot in self.__slots__)
 
     def __str__(self):
         return repr(self)
@@ -82,6 +101,14 @@ class GeneHistory(object):
 
 
 class NCBIGeneInfo(dict):
+    """ A dictionary like object of NCBI gene info records (:obj:`GeneInfo`)
+    indexed by gene ids.
+
+    Records are kept in a persistent index (built on first use of
+    an organism's gene info file) and fetched on demand, so records
+    of many genes are best obtained with :obj:`get_infos` or
+    :obj:`infos`. Records added with item assignment are kept in memory.
+    """
     TAX_MAP = {
             "2104": "272634",  # Mycoplasma pneumoniae
             "4530": "39947",  # Oryza sativa
@@ -102,29 +129,92 @@ class NCBIGeneInfo(dict):
 
 
         fname = serverfiles.localpath_download("NCBI_geneinfo", "gene_info.%s.db" % self.taxid)
-        file = open(fname, "rt")
-        self.update(dict([(line.split("\t", 3)[1], line) for line in file.read().splitlines() if line.strip() and not line.startswith("#")]))
+        self._index = self.info_index(fname)
+
+        self._matcher = genematcher
+        self._matcher_targets = False
 
-        self.matcher = genematcher
-        if self.matcher == None:
+    @staticmethod
+    def info_index(fname):
+        """ Return the index of the gene info file (build it if the
+        file changed since the index was built).
+        """
+        st = os.stat(fname)
+        version = "%s_%s" % (st.st_mtime, st.st_size)
+        index = GeneInfoIndex(os.path.join(
+            buffer_path(), os.path.basename(fname) + ".sqlite"))
+        if not index.is_current(version):
+            index = GeneInfoIndex.build(index.filename, fname, version)
+        return index
+
+    @property
+    def matcher(self):
+        """ The gene matcher with gene ids as targets (the targets are
+        set on first use). """
+        if self._matcher is None:
             if self.taxid == '352472':
-                self.matcher = matcher([GMNCBI(self.taxid), GMDicty(), [GMNCBI(self.taxid), GMDicty()]])
+                self._matcher = matcher([GMNCBI(self.taxid), GMDicty(), [GMNCBI(self.taxid), GMDicty()]])
             else:
-                self.matcher = matcher([GMNCBI(self.taxid)])
+                self._matcher = matcher([GMNCBI(self.taxid)])
+        if not self._matcher_targets:
+            #if this is done with a gene matcher, pool target names
+            self._matcher.set_targets(self.keys())
+            self._matcher_targets = True
+        return self._matcher
+
+    @matcher.setter
+    def matcher(self, matcher):
+        self._matcher = matcher
+        self._matcher_targets = False
 
-        #if this is done with a gene matcher, pool target names
-        self.matcher.set_targets(self.keys())
-        
     def history(self):
         if getattr(self, "_history", None) is None:
             fname = serverfiles.localpath_download("NCBI_geneinfo", "gene_history.%s.db" % self.taxid)
             try:
-                self._history = dict([(line.split("\t")[2], GeneHistory(line)) for line in open(fname, "rb").read().splitlines()])
+                self._history = dict([(line.split("\t")[2], GeneHistory(line)) for line in open(fname, "rt").read().splitlines()])
                 
             except Exception as ex:
-                print >> sys.srderr, "Loading NCBI gene history failed.", ex
+                sys.stderr.write("Loading NCBI gene history failed. %s\n" % ex)
                 self._history = {}
         return self._history
+
+    def history_index(self):
+        """ Return the :obj:`GeneHistoryIndex` of the organism (it is
+        saved in the buffer folder and rebuilt when the history changes).
+        """
+        if getattr(self, "_history_index", None) is None:
+            fname = serverfiles.localpath_download("NCBI_geneinfo", "gene_history.%s.db" % self.taxid)
+            self._history_index = self.load_history_index(fname)
+        return self._history_index
+
+    @staticmethod
+    def load_history_index(fname):
+        """ Return the history index of a gene history file. """
+        st = os.stat(fname)
+        version = "%s_%s" % (st.st_mtime, st.st_size)
+        indexfn = os.path.join(buffer_path(), os.path.basename(fname) + ".npz")
+        index = GeneHistoryIndex.load(indexfn)
+        if index is None or index.version != version:
+            index = GeneHistoryIndex.from_file(fname, version)
+            index.save(indexfn)
+        return index
+
+    def resolve_ids(self, ids, chain=True):
+        """ Return current gene ids (strings) of a list of (possibly
+        discontinued) gene ids, or None for genes that were discontinued
+        without a replacement. Ids that are not integers are returned
+        unchanged. Chains of replacements are followed if `chain` is True.
+        """
+        ids = list(ids)
+        numeric = [ i for i, id in enumerate(ids)
+                    if str(id).strip().isdigit() ]
+        current = self.history_index().resolve(
+            numpy.array([ int(ids[i]) for i in numeric ], dtype=numpy.int64),
+            chain=chain)
+        res = list(ids)
+        for i, id in zip(numeric, current.tolist()):
+            res[i] = str(id) if id != GeneHistoryIndex.WITHDRAWN else None
+        return res
         
     @classmethod
     def organism_version(cls, name):
@@ -155,9 +245,16 @@ class NCBIGeneInfo(dict):
     def load(cls, file):
         """ A class method that loads gene info from file
         """
-        if type(file) in [str, unicode]:
-            file = open(file, "rb")
-        return cls((line.split("\t", 3)[1], line) for line in file.read().splitlines() if line.strip() and not line.startswith("#"))
+        if isinstance(file, basestring):
+            fname = file
+        else:
+            fname = file.name
+        info = cls.__new__(cls)
+        info.taxid = None
+        info._index = cls.info_index(fname)
+        info._matcher = None
+        info._matcher_targets = False
+        return info
         
     def get_info(self, gene_id, def_=None):
         """ Search and return the GeneInfo object for gene_id
@@ -175,9 +272,54 @@ class NCBIGeneInfo(dict):
         id = self.matcher.umatch(name)
         return self[id]
 
+    def get_infos(self, names, def_=None, columns=None):
+        """ Return a list of GeneInfo objects (or `def_` for unmatched
+        names) for a list of gene names, which are matched at once.
+        If `columns` are given, the objects only have these fields.
+        """
+        return self.infos(self.matcher.umatch_many(names), def_=def_,
+                          columns=columns)
+
+    def infos(self, ids, def_=None, columns=None):
+        """ Return a list of GeneInfo objects (or `def_` for unknown
+        ids) for a list of gene ids. If `columns` are given, the objects
+        only have these fields (and only these are decoded).
+        """
+        ids = list(ids)
+        local = dict((id, dict.__getitem__(self, id)) for id in ids
+                     if dict.__contains__(self, id))
+        columns = GeneInfo.NCBI_GENEINFO_TAGS if columns is None \
+                  else tuple(columns)
+        records = self._index.records(
+            [id for id in ids if id is not None and id not in local], columns)
+        res = []
+        for id in ids:
+            if id in local:
+                res.append(GeneInfo(local[id]))
+            elif id in records:
+                res.append(GeneInfo.from_columns(columns, records[id]))
+            else:
+                res.append(def_)
+        return res
+
+    def infos_by_symbol(self, symbols, columns=None):
+        """ Return a dictionary of lists of GeneInfo objects (as in
+        :obj:`infos`) of genes with the given official symbols.
+        """
+        columns = GeneInfo.NCBI_GENEINFO_TAGS if columns is None \
+                  else tuple(columns)
+        return dict((symbol, [GeneInfo.from_columns(columns, r) for r in rs])
+                    for symbol, rs in
+                    self._index.by_symbol(symbols, columns).items())
+
     def __getitem__(self, key):
 #        return self.get(gene_id, self.matcher[gene_id])
-        return GeneInfo(dict.__getitem__(self, key))
+        if dict.__contains__(self, key):
+            return GeneInfo(dict.__getitem__(self, key))
+        info = self.infos([key], def_=None)[0]
+        if info is None:
+            raise KeyError(key)
+        return info
 
     def __setitem__(self, key, value):
         if type(value) == str:
@@ -185,6 +327,24 @@ class NCBIGeneInfo(dict):
         else:
             dict.__setitem__(self, key, repr(value))
 
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self._index
+
+    def __len__(self):
+        local = [key for key in dict.keys(self) if key not in self._index]
+        return len(self._index) + len(local)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        keys = self._index.ids()
+        if dict.__len__(self):
+            keys = list(set(keys) | set(dict.keys(self)))
+        return keys
+
+    iterkeys = __iter__
+
     def get(self, key, def_=None):
         try:
             return self[key]
@@ -192,12 +352,15 @@ class NCBIGeneInfo(dict):
             return def_
 
     def itervalues(self):
-        for val in dict.itervalues(self):
-            yield GeneInfo(val)
+        for _, val in self.iteritems():
+            yield val
 
     def iteritems(self):
-        for key, val in zip(self.iterkeys(), self.itervalues()):
-            yield key, val
+        keys = self.keys()
+        for start in range(0, len(keys), 1000):
+            chunk = keys[start:start + 1000]
+            for key, val in zip(chunk, self.infos(chunk)):
+                yield key, val
 
     if sys.version_info < (3, ):
         def values(self):
@@ -207,10 +370,10 @@ class NCBIGeneInfo(dict):
             return list(self.iteritems())
     else:
         def values(self):
-            return map(GeneInfo, super().values())
+            return self.itervalues()
 
         def items(self):
-            return ((key, GeneInfo(value)) for key, value in super().items())
+            return self.iteritems()
 
     @staticmethod
     def get_geneinfo_from_ncbi(file, progressCallback=None):
@@ -351,7 +514,7 @@ Gene matcher.
 "Database" for each organism is a list of sets of gene aliases.
 """
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import os
 
 gene_matcher_path = None
@@ -472,6 +635,15 @@ class Matcher(object):
         mat = self.match(gene)
         return mat[0] if len(mat) == 1 else None
 
+    def match_many(self, genes):
+        """Return a list of matches (as in :obj:`match`) for each gene."""
+        return [ self.match(gene) for gene in genes ]
+
+    def umatch_many(self, genes):
+        """Return a unique match (as in :obj:`umatch`) or None for each gene."""
+        return [ mat[0] if len(mat) == 1 else None
+                 for mat in self.match_many(genes) ]
+
     def explain(self, gene):
         """ 
         Return gene matches with explanations as lists of tuples:
@@ -479,6 +651,56 @@ class Matcher(object):
         """
         notImplemented()
 
+class LRUCache(object):
+    """
+    A thread-safe mapping that keeps at most `maxsize` of the most
+    recently used items.
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def get_many(self, keys):
+        """ Return a dictionary of cached values of keys (keys that are
+        not cached are left out) and mark them as recently used. """
+        found = {}
+        with self._lock:
+            data = self._data
+            for key in keys:
+                try:
+                    value = data.pop(key)
+                except KeyError:
+                    continue
+                data[key] = value
+                found[key] = value
+        return found
+
+    def update(self, items):
+        """ Add (key, value) pairs, dropping the least recently used
+        items if the cache grows too large. """
+        with self._lock:
+            data = self._data
+            for key, value in items:
+                data.pop(key, None)
+                data[key] = value
+            while len(data) > self.maxsize:
+                data.popitem(last=False)
+
+#: Recent matches of genes, shared by all match objects.
+match_cache = LRUCache()
+
 def buffer_path():
     """ Returns buffer path from Orange's setting folder if not 
     defined differently (in gene_matcher_path). """
@@ -548,6 +770,14 @@ class MatcherAliases(Matcher):
             gene = gene.lower()
         return self.mdict[gene]
 
+    def to_ids_many(self, genes):
+        """ Return a list of ids of sets of aliases for each gene. """
+        return [ self.to_ids(gene) for gene in genes ]
+
+    def group(self, id):
+        """ Return the set of aliases with the given id. """
+        return self.aliases[id]
+
     def set_targets(self, targets):
         """
         A reverse dictionary is made according to each target's membership
@@ -555,8 +785,8 @@ class MatcherAliases(Matcher):
         """
         d = defaultdict(list)
         #d = id: [ targets ], where id is index of the set of aliases
-        for target in targets:
-            ids = self.to_ids(target)
+        targets = list(targets)
+        for target, ids in zip(targets, self.to_ids_many(targets)):
             if ids != None:
                 for id in ids:
                     d[id].append(target)
@@ -567,15 +797,58 @@ class MatcherAliases(Matcher):
     #this two functions are solely for backward compatibility
     def match(self, gene):
         return self.matcho.match(gene)
+    def match_many(self, genes):
+        return self.matcho.match_many(genes)
     def explain(self, gene):
         return self.matcho.explain(gene)
 
 class Match(object):
 
+    #: The cache of matches used by :obj:`match_many` (None disables caching).
+    cache = match_cache
+
     def umatch(self, gene):
         """Returns an unique (only one matching target) target or None"""
         mat = self.match(gene)
         return mat[0] if len(mat) == 1 else None
+
+    def _cache_token(self):
+        # match objects are not hashed by their contents, so each gets
+        # a unique token for the cache keys (unique also across processes,
+        # as match objects are pickled with their tokens)
+        token = getattr(self, "_token", None)
+        if token is None:
+            token = self._token = uuid.uuid4().hex
+        return token
+
+    def _match_many(self, genes):
+        """ Match genes without caching. """
+        return [ self.match(gene) for gene in genes ]
+
+    def match_many(self, genes):
+        """
+        Return a list of matches (as in :obj:`match`) for each gene.
+        Recent matches are kept in a cache shared by all match objects.
+        """
+        genes = list(genes)
+        if self.cache is None:
+            return [ list(m) for m in self._match_many(genes) ]
+        token = self._cache_token()
+        keys = [ (token, gene) for gene in genes ]
+        found = self.cache.get_many(keys)
+        missing = list(OrderedDict.fromkeys(
+            key for key in keys if key not in found))
+        if missing:
+            matched = self._match_many([ gene for _, gene in missing ])
+            new = [ (key, tuple(m)) for key, m in zip(missing, matched) ]
+            self.cache.update(new)
+            found.update(new)
+        return [ list(found[key]) for key in keys ]
+
+    def umatch_many(self, genes):
+        """ Return a unique match (as in :obj:`umatch`) or None for each gene. """
+        return [ mat[0] if len(mat) == 1 else None
+                 for mat in self.match_many(genes) ]
  
 class MatchAliases(Match):
 
@@ -583,21 +856,30 @@ class MatchAliases(Match):
         self.to_targets = to_targets
         self.parent = parent
 
+    def _targets(self, ids):
+        if len(ids) == 1:
+            for igid in ids:
+                return list(set(self.to_targets.get(igid, ())))
+        targets = set()
+        for igid in ids:
+            targets.update(self.to_targets.get(igid, ()))
+        return list(targets)
+
     def match(self, gene):
         """
         The `gene` is first mapped to ids of sets of aliases which contain
         it. Target genes from the same sets of aliases are returned
         as input's match.
         """
-        inputgeneids = self.parent.to_ids(gene)
         #return target genes with same ids
-        return list(set( \
-            reduce(lambda x,y: x+y, 
-                [ self.to_targets[igid] for igid in inputgeneids ], [])))
+        return self._targets(self.parent.to_ids(gene))
+
+    def _match_many(self, genes):
+        return [ self._targets(ids) for ids in self.parent.to_ids_many(genes) ]
 
     def explain(self, gene):
         inputgeneids = self.parent.to_ids(gene)
-        return [ (self.to_targets[igid], self.parent.aliases[igid]) for igid in inputgeneids ]
+        return [ (self.to_targets[igid], self.parent.group(igid)) for igid in inputgeneids ]
 
 class MatcherAliasesPickled(MatcherAliases):
     """
@@ -609,6 +891,11 @@ class MatcherAliasesPickled(MatcherAliases):
     Loading of gene aliases is done lazily: they are loaded when they are
     needed. Loading of aliases for components of joined matchers is often 
     unnecessary and is therefore avoided. 
+
+    Aliases are stored in a persistent index (:class:`AliasIndex`) in
+    the buffer folder, which is rebuilt when create_aliases_version
+    changes. Genes are matched by querying the index, so the aliases
+    need not be loaded at all.
     """
     
     def set_aliases(self, aliases):
@@ -636,6 +923,56 @@ class MatcherAliasesPickled(MatcherAliases):
     def set_targets(self, targets):
         return MatcherAliases.set_targets(self, targets)
 
+    def _index_filename(self):
+        fn = self.filename()
+        if fn is None or isinstance(fn, tuple):
+            return None
+        return os.path.join(buffer_path(),
+            fn + ("_ic" if self.ignore_case else "") + ".aliases.sqlite")
+
+    def alias_index(self):
+        """
+        Return the persistent alias index. It is built from
+        create_aliases if it does not exist or was built for a different
+        create_aliases_version. Return None if the aliases can not be
+        indexed (for matchers without a file name or for aliases read
+        from a given file).
+        """
+        if getattr(self, "_index", None) is None:
+            fn = self._index_filename()
+            if fn is None:
+                return None
+            ver = self.create_aliases_version()
+            index = AliasIndex(fn)
+            if not index.is_current(ver, self.ignore_case):
+                index.close()
+                index = AliasIndex.build(fn, self.create_aliases(), ver,
+                                         self.ignore_case)
+            self._index = index
+        return self._index
+
+    def to_ids(self, gene):
+        index = self.alias_index()
+        if index is None:
+            return MatcherAliases.to_ids(self, gene)
+        if self.ignore_case:
+            gene = gene.lower()
+        return index.ids(gene)
+
+    def to_ids_many(self, genes):
+        index = self.alias_index()
+        if index is None:
+            return MatcherAliases.to_ids_many(self, genes)
+        if self.ignore_case:
+            genes = [ gene.lower() for gene in genes ]
+        return index.ids_many(genes)
+
+    def group(self, id):
+        index = self.alias_index()
+        if index is None:
+            return MatcherAliases.group(self, id)
+        return index.group(id)
+
     def filename(self):
         """ Returns file name for saving aliases. """
         notImplemented()
@@ -650,20 +987,20 @@ class MatcherAliasesPickled(MatcherAliases):
 
     def load_aliases(self):
         fn = self.filename()
-        ver = self.create_aliases_version() #if version == None ignore it
-        if fn != None:
-            if isinstance(fn, tuple): #if you pass tuple, look directly
-               filename = fn[0]
-            else:
-               filename = os.path.join(buffer_path(), fn)
-            return auto_pickle(filename, ver, self.create_aliases)
+        if isinstance(fn, tuple): #if you pass tuple, look directly
+            ver = self.create_aliases_version() #if version == None ignore it
+            return auto_pickle(fn[0], ver, self.create_aliases)
+        index = self.alias_index()
+        if index is not None:
+            return index.groups()
         else:
-            #if either file version of version is None, do not pickle
+            #if the file name is None, do not store aliases
             return self.create_aliases()
 
     def __init__(self, ignore_case=True):
         self.aliases = []
         self.mdict = {}
+        self._index = None
         self.ignore_case = ignore_case
         self.filename() # test if valid filename can be built
 
@@ -768,9 +1105,12 @@ class MatcherAliasesNCBI(MatcherAliasesPickled):
 
     def create_aliases(self):
         ncbi = NCBIGeneInfo(self.organism, genematcher=GMDirect())
+        keys = ncbi.keys()
+        #fetch the used fields of all genes at once
+        infos = ncbi.infos(keys, columns=("symbol", "locus_tag", "synonyms"))
         out = []
-        for k in ncbi.keys():
-            out.append(set(filter(None, [k, ncbi[k].symbol, ncbi[k].locus_tag] + [ s for s in ncbi[k].synonyms ] )))
+        for k, info in zip(keys, infos):
+            out.append(set(filter(None, [k, info.symbol, info.locus_tag] + list(info.synonyms or []))))
         return out
 
     def filename(self):
@@ -844,7 +1184,13 @@ class MatcherAliasesPickledJoined(MatcherAliasesPickled):
     Creates a new matcher by joining gene aliases from different data sets.
     Sets of aliases are joined if they contain common genes.
 
-    The joined gene matcher can only be pickled if the source gene
+    Joined groups are kept as ids of groups of the source matchers
+    (:class:`JoinedAliases`) in the buffer folder, and genes are
+    matched through the sources' alias indices. The joined groups are
+    rebuilt when the version of any source changes; they can also be
+    built in advance with :obj:`build`.
+
+    The joined gene matcher can only be saved if the source gene
     matchers are picklable.
     """
 
@@ -858,8 +1204,61 @@ class MatcherAliasesPickledJoined(MatcherAliasesPickled):
         except:
             return None
 
+    def _joined_filename(self):
+        fn = self.filename()
+        if fn is None or isinstance(fn, tuple):
+            return None
+        return os.path.join(buffer_path(), fn + ".joined.npz")
+
+    def joined(self):
+        """
+        Return the joined groups (:class:`JoinedAliases`). They are
+        loaded from the buffer folder, or built (and saved) if they do
+        not exist or were built from different versions of the sources.
+        """
+        if getattr(self, "_joined", None) is None:
+            fn = self._joined_filename()
+            ver = str(self.create_aliases_version())
+            joined = JoinedAliases.load(fn) if fn is not None else None
+            if joined is None or joined.version != ver:
+                joined = JoinedAliases.build(
+                    [ mat.aliases for mat in self.matchers ],
+                    ignore_case=self.ignore_case, version=ver)
+                if fn is not None:
+                    joined.save(fn)
+            self._joined = joined
+        return self._joined
+
+    def build(self):
+        """ Build (and save) the joined groups and the alias indices
+        of the source matchers in advance. """
+        self._joined = None
+        return self.joined()
+
+    def alias_index(self):
+        # joined aliases are not indexed; sources' indices are used instead
+        return None
+
+    def to_ids(self, gene):
+        return self.to_ids_many([gene])[0]
+
+    def to_ids_many(self, genes):
+        genes = list(genes)
+        joined = self.joined()
+        res = [ set() for _ in genes ]
+        for k, mat in enumerate(self.matchers):
+            for ids, sids in zip(res, mat.to_ids_many(genes)):
+                if sids:
+                    ids.update(joined.joined_ids(k, sids))
+        return res
+
+    def group(self, id):
+        return self.joined().group(id, [ mat.group for mat in self.matchers ])
+
     def create_aliases(self):
-        return join_sets_l([ mat.aliases for mat in self.matchers ], lower=self.ignore_case)
+        sources = [ mat.aliases for mat in self.matchers ]
+        return [ set().union(*[ sources[k][i] for k, i in enumerate(row) if i >= 0 ])
+                 for row in self.joined().components.tolist() ]
 
     def create_aliases_version(self):
         try:
@@ -883,6 +1282,7 @@ class MatcherAliasesPickledJoined(MatcherAliasesPickled):
         ignore_case = list(allic)[0]
 
         MatcherAliasesPickled.__init__(self, ignore_case=ignore_case)
+        self._joined = None
         
 class MatcherSequence(Matcher):
     """
@@ -907,6 +1307,9 @@ class MatcherSequence(Matcher):
     def match(self, gene):
         return self.matcho.match(gene)
 
+    def match_many(self, genes):
+        return self.matcho.match_many(genes)
+
     def explain(self, gene):
         return self.matcho.explain(gene)
 
@@ -922,6 +1325,25 @@ class MatchSequence(Match):
                 return m
         return []
 
+    def _match_many(self, genes):
+        """ Each match object only matches genes still unmatched by
+        the previous ones. """
+        genes = list(genes)
+        res = [ [] for _ in genes ]
+        todo = list(range(len(genes)))
+        for match in self.ms:
+            if not todo:
+                break
+            rest = []
+            matched = match._match_many([ genes[i] for i in todo ])
+            for i, m in zip(todo, matched):
+                if m:
+                    res[i] = m
+                else:
+                    rest.append(i)
+            todo = rest
+        return res
+
     def explain(self, gene):
         for match in self.ms:
             m = match.match(gene)
@@ -948,6 +1370,8 @@ class MatcherDirect(Matcher):
     #this two functions are solely for backward compatibility
     def match(self, gene):
         return self.matcho.match(gene)
+    def match_many(self, genes):
+        return self.matcho.match_many(genes)
     def explain(self, gene):
         return self.matcho.explain(gene)
 
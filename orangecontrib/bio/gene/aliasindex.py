@@ -0,0 +1,163 @@
+"""
+A persistent index of gene aliases for gene matchers.
+
+The index maps gene aliases (in lower case for matchers that ignore
+case) to ids of the groups of aliases (sets of names of a gene) that
+contain them, and stores the groups themselves. Matchers query it
+directly, so the alias groups need not be loaded into memory and the
+mapping need not be rebuilt in every process.
+
+"""
+from __future__ import absolute_import
+
+import os
+import sqlite3
+import tempfile
+import threading
+
+#: Version of the index format (indices of other formats are rebuilt).
+FORMAT_VERSION = "1"
+
+_CHUNK = 500
+
+
+class AliasIndex(object):
+    """
+    An SQLite index of groups of gene aliases.
+
+    :param str filename: The index file.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._con = None
+        self._pid = None
+        self._lock = threading.RLock()
+
+    def _connection(self):
+        # connections are not shared with forked processes
+        if self._con is None or self._pid != os.getpid():
+            self._con = sqlite3.connect(self.filename, timeout=15,
+                                        check_same_thread=False)
+            self._pid = os.getpid()
+        return self._con
+
+    def close(self):
+        if self._con is not None:
+            self._con.close()
+            self._con = None
+
+    def _meta(self):
+        if not os.path.exists(self.filename):
+            return {}
+        try:
+            with self._lock:
+                return dict(self._connection().execute(
+                    "SELECT key, value FROM meta"))
+        except sqlite3.Error:
+            return {}
+
+    def is_current(self, version, ignore_case):
+        """
+        Is the index built (with the same `ignore_case`) from aliases of
+        the given version? If version is None, any built index is
+        current.
+        """
+        meta = self._meta()
+        return meta.get("format") == FORMAT_VERSION and \
+            meta.get("ignore_case") == str(bool(ignore_case)) and \
+            (version is None or meta.get("version") == str(version))
+
+    @classmethod
+    def build(cls, filename, groups, version, ignore_case):
+        """
+        Build an index of alias groups (an iterable of sets of aliases)
+        and return it. The index is written to a temporary file that
+        then replaces `filename`.
+        """
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename) or ".",
+                                       suffix=".tmp")
+        os.close(fd)
+        try:
+            con = sqlite3.connect(tmpname)
+            with con:
+                con.executescript("""
+                    CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+                    CREATE TABLE groups (
+                        gid INTEGER,
+                        alias TEXT,
+                        PRIMARY KEY (gid, alias)
+                    ) WITHOUT ROWID;
+                    CREATE TABLE aliases (
+                        alias TEXT,
+                        gid INTEGER,
+                        PRIMARY KEY (alias, gid)
+                    ) WITHOUT ROWID;
+                """)
+                members, keys = [], []
+                for gid, group in enumerate(groups):
+                    for alias in set(group):
+                        members.append((gid, alias))
+                        keys.append((alias.lower() if ignore_case else alias,
+                                     gid))
+                    if len(members) > 10000:
+                        cls._insert(con, members, keys)
+                        members, keys = [], []
+                cls._insert(con, members, keys)
+                con.executemany(
+                    "INSERT INTO meta VALUES (?, ?)",
+                    [("format", FORMAT_VERSION),
+                     ("ignore_case", str(bool(ignore_case))),
+                     ("version", str(version))])
+            con.close()
+            if os.path.exists(filename):
+                os.remove(filename)
+            os.rename(tmpname, filename)
+        except:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+            raise
+        return cls(filename)
+
+    @staticmethod
+    def _insert(con, members, keys):
+        con.executemany("INSERT INTO groups VALUES (?, ?)", members)
+        con.executemany("INSERT OR IGNORE INTO aliases VALUES (?, ?)", keys)
+
+    def ids(self, alias):
+        """Return a set of ids of groups containing the alias."""
+        with self._lock:
+            return set(r[0] for r in self._connection().execute(
+                "SELECT gid FROM aliases WHERE alias = ?", (alias,)))
+
+    def ids_many(self, aliases):
+        """Return a list of sets of group ids for aliases."""
+        aliases = list(aliases)
+        found = {}
+        unique = list(set(aliases))
+        with self._lock:
+            con = self._connection()
+            for start in range(0, len(unique), _CHUNK):
+                chunk = unique[start:start + _CHUNK]
+                for alias, gid in con.execute(
+                        "SELECT alias, gid FROM aliases WHERE alias IN (%s)" %
+                        ",".join("?" * len(chunk)), chunk):
+                    found.setdefault(alias, set()).add(gid)
+        return [set(found.get(a, ())) for a in aliases]
+
+    def group(self, gid):
+        """Return the set of aliases of a group."""
+        with self._lock:
+            return set(r[0] for r in self._connection().execute(
+                "SELECT alias FROM groups WHERE gid = ?", (gid,)))
+
+    def groups(self):
+        """Return a list of all groups of aliases (indexed by group ids)."""
+        out = []
+        with self._lock:
+            for gid, alias in self._connection().execute(
+                    "SELECT gid, alias FROM groups ORDER BY gid"):
+                while len(out) <= gid:
+                    out.append(set())
+                out[gid].add(alias)
+        return out
@@ -0,0 +1,134 @@
+"""
+A compact index of NCBI gene history.
+
+Ids of discontinued genes from a ``gene_history`` file are kept in a
+sorted integer array together with an array of ids of the genes that
+replaced them, so that obsolete ids of a whole table are resolved to
+current ids with a few vectorized binary searches (following chains of
+replacements). The arrays are saved to a file next to other gene
+matching indices and reloaded until the history file changes.
+
+"""
+from __future__ import absolute_import
+
+import io
+import os
+import tempfile
+
+import numpy
+
+#: Version of the index format (indices of other formats are rebuilt).
+FORMAT_VERSION = "1"
+
+#: The id of the replacement of genes that were discontinued without one.
+WITHDRAWN = -1
+
+#: The maximal length of followed chains of replacements.
+MAX_CHAIN = 100
+
+
+class GeneHistoryIndex(object):
+    """
+    Replacements of discontinued gene ids.
+
+    :param discontinued: Ids of discontinued genes.
+    :param current: Ids of genes that replaced them (or :obj:`WITHDRAWN`).
+    :param str version: Version of the source data.
+    """
+
+    WITHDRAWN = WITHDRAWN
+
+    def __init__(self, discontinued, current, version=None):
+        discontinued = numpy.asarray(discontinued, dtype=numpy.int64)
+        current = numpy.asarray(current, dtype=numpy.int64)
+        order = numpy.argsort(discontinued, kind="mergesort")
+        self.discontinued = discontinued[order]
+        self.current = current[order]
+        self.version = version
+
+    def __len__(self):
+        return len(self.discontinued)
+
+    @classmethod
+    def from_file(cls, filename, version=None):
+        """Read the index from a gene_history file."""
+        discontinued, current = [], []
+        with io.open(filename, "rt", encoding="utf-8",
+                     errors="replace") as f:
+            for line in f:
+                if line.startswith("#") or not line.strip():
+                    continue
+                fields = line.split("\t", 3)
+                if len(fields) < 3:
+                    continue
+                try:
+                    old = int(fields[2])
+                except ValueError:
+                    continue
+                discontinued.append(old)
+                current.append(int(fields[1]) if fields[1].strip().isdigit()
+                               else WITHDRAWN)
+        return cls(discontinued, current, version)
+
+    def save(self, filename):
+        """Save the index (the file is replaced atomically)."""
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename) or ".",
+                                       suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                numpy.savez(f, discontinued=self.discontinued,
+                            current=self.current,
+                            meta=numpy.array([FORMAT_VERSION,
+                                              str(self.version)]))
+            if os.path.exists(filename):
+                os.remove(filename)
+            os.rename(tmpname, filename)
+        except:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+            raise
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Load a saved index. Return None if there is no index or it
+        is in another format.
+        """
+        try:
+            with numpy.load(filename) as f:
+                fmt, version = [str(m) for m in f["meta"]]
+                if fmt != FORMAT_VERSION:
+                    return None
+                return cls(f["discontinued"], f["current"], version)
+        except (IOError, OSError, KeyError, ValueError):
+            return None
+
+    def replacements(self, ids):
+        """
+        Return the direct replacements of (integer) gene ids: the id of
+        the gene that replaced each discontinued id, :obj:`WITHDRAWN` for
+        genes discontinued without a replacement and the id itself for
+        ids that were not discontinued.
+        """
+        ids = numpy.asarray(ids, dtype=numpy.int64)
+        if not len(self.discontinued):
+            return ids.copy()
+        pos = numpy.searchsorted(self.discontinued, ids)
+        pos = numpy.minimum(pos, len(self.discontinued) - 1)
+        found = self.discontinued[pos] == ids
+        return numpy.where(found, self.current[pos], ids)
+
+    def resolve(self, ids, chain=True):
+        """
+        Return current ids of (integer) gene ids. Replacements of
+        discontinued genes are followed (up to :obj:`MAX_CHAIN` steps)
+        until a current gene is found if `chain` is True.
+        """
+        ids = self.replacements(ids)
+        if chain:
+            for _ in range(MAX_CHAIN - 1):
+                new = self.replacements(ids)
+                if numpy.array_equal(new, ids):
+                    break
+                ids = new
+        return ids
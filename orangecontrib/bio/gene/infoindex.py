@@ -0,0 +1,177 @@
+"""
+A persistent index of NCBI gene info records.
+
+Records of a ``gene_info`` file are stored in an SQLite table with a
+column for each field, indexed by gene ids and symbols. Records can
+then be fetched (in batches and only with the requested fields)
+without reading and parsing the whole file.
+
+"""
+from __future__ import absolute_import
+
+import io
+import os
+import sqlite3
+import tempfile
+import threading
+
+#: Version of the index format (indices of other formats are rebuilt).
+FORMAT_VERSION = "1"
+
+#: Fields of gene_info records (and columns of the index).
+COLUMNS = ("tax_id", "gene_id", "symbol", "locus_tag", "synonyms",
+           "dbXrefs", "chromosome", "map_location", "description", "type",
+           "symbol_from_nomenclature_authority",
+           "full_name_from_nomenclature_authority",
+           "nomenclature_status", "other_designations", "modification_date")
+
+_CHUNK = 500
+
+
+class GeneInfoIndex(object):
+    """
+    An SQLite index of gene info records.
+
+    :param str filename: The index file.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._con = None
+        self._pid = None
+        self._lock = threading.RLock()
+
+    def _connection(self):
+        # connections are not shared with forked processes
+        if self._con is None or self._pid != os.getpid():
+            self._con = sqlite3.connect(self.filename, timeout=15,
+                                        check_same_thread=False)
+            self._pid = os.getpid()
+        return self._con
+
+    def close(self):
+        if self._con is not None:
+            self._con.close()
+            self._con = None
+
+    def _meta(self):
+        if not os.path.exists(self.filename):
+            return {}
+        try:
+            with self._lock:
+                return dict(self._connection().execute(
+                    "SELECT key, value FROM meta"))
+        except sqlite3.Error:
+            return {}
+
+    def is_current(self, version):
+        """
+        Is the index built from a gene info file of the given version?
+        """
+        meta = self._meta()
+        return meta.get("format") == FORMAT_VERSION and \
+            meta.get("version") == str(version)
+
+    @classmethod
+    def build(cls, filename, source, version):
+        """
+        Build an index of records in a gene_info file `source` and return
+        it. The index is written to a temporary file that then replaces
+        `filename`.
+        """
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename) or ".",
+                                       suffix=".tmp")
+        os.close(fd)
+        try:
+            con = sqlite3.connect(tmpname)
+            with con:
+                con.executescript("""
+                    CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+                    CREATE TABLE genes (
+                        %s,
+                        PRIMARY KEY (gene_id)
+                    ) WITHOUT ROWID;
+                """ % ", ".join("%s TEXT" % c for c in COLUMNS))
+                insert = "INSERT OR REPLACE INTO genes VALUES (%s)" % \
+                    ",".join("?" * len(COLUMNS))
+                rows = []
+                with io.open(source, "rt", encoding="utf-8",
+                             errors="replace") as f:
+                    for line in f:
+                        line = line.rstrip("\r\n")
+                        if not line.strip() or line.startswith("#"):
+                            continue
+                        fields = line.split("\t")[:len(COLUMNS)]
+                        fields += [u"-"] * (len(COLUMNS) - len(fields))
+                        rows.append(fields)
+                        if len(rows) > 10000:
+                            con.executemany(insert, rows)
+                            rows = []
+                con.executemany(insert, rows)
+                con.execute("CREATE INDEX genes_symbol ON genes (symbol)")
+                con.executemany(
+                    "INSERT INTO meta VALUES (?, ?)",
+                    [("format", FORMAT_VERSION), ("version", str(version))])
+            con.close()
+            if os.path.exists(filename):
+                os.remove(filename)
+            os.rename(tmpname, filename)
+        except:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+            raise
+        return cls(filename)
+
+    def __len__(self):
+        with self._lock:
+            return self._connection().execute(
+                "SELECT count(*) FROM genes").fetchone()[0]
+
+    def __contains__(self, gene_id):
+        with self._lock:
+            return self._connection().execute(
+                "SELECT 1 FROM genes WHERE gene_id = ?",
+                (gene_id,)).fetchone() is not None
+
+    def ids(self):
+        """Return a list of all gene ids."""
+        with self._lock:
+            return [r[0] for r in self._connection().execute(
+                "SELECT gene_id FROM genes")]
+
+    def _select(self, key, values, columns):
+        columns = COLUMNS if columns is None else tuple(columns)
+        unknown = set(columns) - set(COLUMNS)
+        if unknown:
+            raise ValueError("Unknown columns: %s" % ", ".join(sorted(unknown)))
+        values = list(set(values))
+        with self._lock:
+            con = self._connection()
+            for start in range(0, len(values), _CHUNK):
+                chunk = values[start:start + _CHUNK]
+                for row in con.execute(
+                        "SELECT %s FROM genes WHERE %s IN (%s)" %
+                        (", ".join((key,) + columns), key,
+                         ",".join("?" * len(chunk))), chunk):
+                    yield row[0], row[1:]
+
+    def records(self, ids, columns=None):
+        """
+        Return a dictionary of records (tuples of raw field values in
+        the order of `columns`) of genes with the given ids. Ids not
+        in the index are left out.
+
+        :param list ids: Gene ids.
+        :param list columns: Fields to return (default: all).
+        """
+        return dict(self._select("gene_id", ids, columns))
+
+    def by_symbol(self, symbols, columns=None):
+        """
+        Return a dictionary of lists of records (as in :obj:`records`)
+        of genes with the given symbols.
+        """
+        res = {}
+        for symbol, record in self._select("symbol", symbols, columns):
+            res.setdefault(symbol, []).append(record)
+        return res
@@ -0,0 +1,165 @@
+"""
+Joined groups of gene aliases in a compact integer form.
+
+Joined gene matchers combine groups of aliases of several sources (as
+:func:`join_sets_l` does): a joined group is the union of at most one
+group of each source, and groups are joined if they share an alias.
+Here a joined group is stored only as the ids of its component groups
+(ids of groups in the sources' alias indices), with a map from the
+groups of each source to the joined groups that contain them. Joined
+aliases are thus never stored, and genes are matched by mapping their
+ids in the sources to ids of joined groups.
+
+"""
+from __future__ import absolute_import
+
+import os
+import tempfile
+
+import numpy
+
+#: Version of the format (files of other formats are rebuilt).
+FORMAT_VERSION = "1"
+
+
+def _key(ignore_case):
+    return (lambda alias: alias.lower()) if ignore_case else (lambda alias: alias)
+
+
+class JoinedAliases(object):
+    """
+    Joined groups of aliases of several sources.
+
+    :param components: An (joined groups x sources) integer array of
+        ids of component groups (-1 for sources without one).
+    :param list source_sizes: The numbers of groups of the sources.
+    :param str version: Version of the source data.
+    """
+
+    def __init__(self, components, source_sizes, version=None):
+        self.components = numpy.asarray(components, dtype=numpy.int32) \
+            .reshape(-1, len(source_sizes))
+        self.source_sizes = list(source_sizes)
+        self.version = version
+        self._maps = [self._source_map(k) for k in range(len(source_sizes))]
+
+    def __len__(self):
+        return len(self.components)
+
+    def _source_map(self, k):
+        # (indptr, indices) of joined groups containing each group of a source
+        col = self.components[:, k]
+        present = numpy.flatnonzero(col >= 0)
+        order = numpy.argsort(col[present], kind="mergesort")
+        indices = present[order].astype(numpy.int32)
+        counts = numpy.bincount(col[present], minlength=self.source_sizes[k])
+        indptr = numpy.zeros(self.source_sizes[k] + 1, dtype=numpy.int64)
+        numpy.cumsum(counts, out=indptr[1:])
+        return indptr, indices
+
+    @classmethod
+    def build(cls, sources, ignore_case=True, version=None):
+        """
+        Join groups of aliases of several sources (lists of sets of
+        aliases, indexed by group ids) and return the result.
+        """
+        key = _key(ignore_case)
+        # joined groups (tuples of component ids) and joined groups of
+        # each alias (in the normalized form)
+        joined = []
+        alias_map = {}
+        for k, groups in enumerate(sources):
+            source_map = {}
+            for i, group in enumerate(groups):
+                for alias in group:
+                    source_map.setdefault(key(alias), set()).add(i)
+            if k == 0:
+                joined = [(i,) for i in range(len(groups))]
+                alias_map = source_map
+                continue
+
+            new = []
+            old_to_new = {}
+            group_to_new = {}
+            for i, group in enumerate(groups):
+                cross = set()
+                for alias in group:
+                    cross.update(alias_map.get(key(alias), ()))
+                for j in cross:
+                    old_to_new.setdefault(j, []).append(len(new))
+                    group_to_new.setdefault(i, []).append(len(new))
+                    new.append(joined[j] + (i,))
+            for j in range(len(joined)):
+                if j not in old_to_new:
+                    old_to_new[j] = [len(new)]
+                    new.append(joined[j] + (-1,))
+            for i in range(len(groups)):
+                if i not in group_to_new:
+                    group_to_new[i] = [len(new)]
+                    new.append((-1,) * k + (i,))
+
+            new_map = {}
+            for alias, js in alias_map.items():
+                new_map[alias] = set(n for j in js for n in old_to_new[j])
+            for alias, ids in source_map.items():
+                new_map.setdefault(alias, set()).update(
+                    n for i in ids for n in group_to_new[i])
+            joined, alias_map = new, new_map
+
+        sizes = [len(groups) for groups in sources]
+        return cls(numpy.array(joined, dtype=numpy.int32).reshape(-1, len(sizes)),
+                   sizes, version)
+
+    def save(self, filename):
+        """Save the joined groups (the file is replaced atomically)."""
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename) or ".",
+                                       suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                numpy.savez(f, components=self.components,
+                            source_sizes=numpy.array(self.source_sizes),
+                            meta=numpy.array([FORMAT_VERSION,
+                                              str(self.version)]))
+            if os.path.exists(filename):
+                os.remove(filename)
+            os.rename(tmpname, filename)
+        except:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+            raise
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Load saved joined groups. Return None if there are none or they
+        are in another format.
+        """
+        try:
+            with numpy.load(filename) as f:
+                fmt, version = [str(m) for m in f["meta"]]
+                if fmt != FORMAT_VERSION:
+                    return None
+                return cls(f["components"], f["source_sizes"].tolist(),
+                           version)
+        except (IOError, OSError, KeyError, ValueError):
+            return None
+
+    def joined_ids(self, k, ids):
+        """Return a set of ids of joined groups containing groups `ids`
+        of the `k`-th source."""
+        indptr, indices = self._maps[k]
+        res = set()
+        for i in ids:
+            res.update(indices[indptr[i]:indptr[i + 1]].tolist())
+        return res
+
+    def group(self, id, source_groups):
+        """
+        Return the aliases of a joined group. `source_groups` is a list
+        of functions returning the aliases of groups of each source.
+        """
+        res = set()
+        for k, i in enumerate(self.components[id].tolist()):
+            if i >= 0:
+                res |= set(source_groups[k](i))
+        return res
@@ -7,10 +7,13 @@ except:
 
 from urllib.request import urlopen
     
-import os, tempfile, sys
+import os, tempfile, sys, gzip
+import sqlite3
 from collections import defaultdict
 import datetime
 
+import numpy
+
 from ..utils.serverfiles import localpath_download, listfiles
 from ..utils import serverfiles
 
@@ -37,6 +40,8 @@ try:
 except:
     pass  #not yet available in Orange3
 
+from . import store as gsstore
+
 sfdomain = "gene_sets"
 
 def nth(l,n):
@@ -205,6 +210,89 @@ def loadGMT(contents, name):
 
     return GeneSets(handleNELines(contents, hline))
 
+def _lines(f):
+    for line in f:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        yield line.rstrip("\r\n")
+
+def _gmt_rows(lines):
+    for line in lines:
+        if line.strip():
+            yield [ tab.strip() for tab in line.split("\t") ]
+
+def _gmx_rows(lines):
+    """ Gene sets are in columns: names in the first row, descriptions
+    in the second and genes in the following rows. """
+    rows = _gmt_rows(lines)
+    try:
+        names = next(rows)
+        descriptions = next(rows)
+    except StopIteration:
+        return
+    genes = [ [] for _ in names ]
+    for row in rows:
+        for col, gene in zip(genes, row):
+            if gene:
+                col.append(gene)
+    for name, description, col in zip(names, descriptions, genes):
+        yield [ name, description ] + col
+
+def iter_gmt(source, name=None, min_size=None, max_size=None, format=None):
+    """
+    Read gene sets from a GMT (a gene set per line) or GMX (a gene set
+    per column) file and yield them one by one as :class:`GeneSet`.
+    Lines are read incrementally and gene names that appear in
+    multiple gene sets share a single string.
+
+    :param source: A file name (gzip compressed if it ends with ".gz")
+        or a file object.
+    :param str name: Name of the collection (the gene sets get the
+        hierarchy ("Custom", name)). Defaults to the file name.
+    :param int min_size: Skip gene sets with fewer genes.
+    :param int max_size: Skip gene sets with more genes.
+    :param str format: "gmt" or "gmx"; by default GMX for files
+        ending with .gmx (or .gmx.gz) and GMT otherwise.
+    """
+    fname = source if isinstance(source, basestring) else getattr(source, "name", "")
+    if name is None:
+        name = fname
+    if format is None:
+        stem = fname[:-3] if fname.lower().endswith(".gz") else fname
+        format = "gmx" if stem.lower().endswith(".gmx") else "gmt"
+
+    if isinstance(source, basestring):
+        opener = gzip.open if source.lower().endswith(".gz") else open
+        f = opener(source, "rb")
+    else:
+        f = source
+
+    symbols = {}
+    try:
+        rows = (_gmx_rows if format == "gmx" else _gmt_rows)(_lines(f))
+        for row in rows:
+            genes = set(symbols.setdefault(g, g) for g in row[2:] if g)
+            if (min_size is not None and len(genes) < min_size) or \
+                    (max_size is not None and len(genes) > max_size):
+                continue
+            groups = linkre.match(row[1] if len(row) > 1 else "").groups()
+            yield GeneSet(id=row[0], description=groups[0], link=groups[1],
+                          hierarchy=("Custom", name), genes=genes)
+    finally:
+        if f is not source:
+            f.close()
+
+def load_gmt(source, name=None, min_size=None, max_size=None, format=None):
+    """
+    Return gene sets from a GMT or GMX file as :class:`GeneSets`. See
+    :obj:`iter_gmt` for a description of the parameters.
+    """
+    out = GeneSets()
+    for gs in iter_gmt(source, name=name, min_size=min_size,
+                       max_size=max_size, format=format):
+        out.add(gs)
+    return out
+
 def getGenesetsStats(genesets):
     num_sets = len(genesets)
     unique_genes = len(set([gene for geneset in genesets for gene in geneset.genes]))
@@ -251,11 +339,22 @@ def filename_parse(fn):
 def is_genesets_file(fn):
     return fn.startswith("gs_") and fn.endswith(".pck")
 
+_listings = {}
+
+def _cached_listing(fname, read):
+    """ Return read(fname), cached until the modification time of fname
+    (a file or a directory) changes. """
+    mtime = os.stat(fname).st_mtime
+    cached = _listings.get(fname)
+    if cached is None or cached[0] != mtime:
+        cached = _listings[fname] = (mtime, read(fname))
+    return cached[1]
+
 def list_local():
     """ Returns available gene sets from the local repository:
     a list of (hierarchy, organism, on_local) """
     pth = local_path()
-    gs_files = filter(is_genesets_file, os.listdir(pth))
+    gs_files = _cached_listing(pth, lambda pth: list(filter(is_genesets_file, os.listdir(pth))))
     return [ filename_parse(fn) + (True,) for fn in gs_files ]
 
 def remove_local(gene_set):
@@ -273,7 +372,7 @@ def modification_date(file):
 
 def list_serverfiles_from_flist(flist):
     gs_files = filter(is_genesets_file, flist)
-    localfiles = os.listdir(serverfiles.localpath(sfdomain))
+    localfiles = _cached_listing(serverfiles.localpath(sfdomain), os.listdir)
     localfiles = set(filter(is_genesets_file, localfiles))
     return [ filename_parse(fn) + \
         ((True,) if fn in localfiles else (False,)) for fn in set(gs_files) | localfiles ]
@@ -288,10 +387,7 @@ def list_serverfiles_conn(serverfiles=None):
 
 def list_serverfiles():
     fname = serverfiles.localpath_download(sfdomain, "index.pck")
-    if six.PY3:
-        flist = pickle.load(open(fname, 'rb'), encoding="latin1")
-    else:
-        flist = pickle.load(open(fname, 'rb'))
+    flist = _cached_listing(fname, gsstore._load_pickle)
     return list_serverfiles_from_flist(flist)
 
 def list_all(org=None, local=None):
@@ -392,34 +488,55 @@ def build_hierarchy_dict(files):
             hierd[(hier[:i], org)].append(ind)
     return hierd
 
-def load_local(hierarchy, organism):
+def load_local(hierarchy, organism, min_size=None, max_size=None):
     return load_fn(hierarchy, organism, list_local, 
-        lambda h,o: os.path.join(local_path(), filename(h, o)))
+        lambda h,o: os.path.join(local_path(), filename(h, o)),
+        min_size=min_size, max_size=max_size)
 
-def load_serverfiles(hierarchy, organism):
+def load_serverfiles(hierarchy, organism, min_size=None, max_size=None):
     return load_fn(hierarchy, organism, list_serverfiles, 
-        lambda h,o: serverfiles.localpath_download(sfdomain, filename(h, o)))
+        lambda h,o: serverfiles.localpath_download(sfdomain, filename(h, o)),
+        min_size=min_size, max_size=max_size)
 
-def load_fn(hierarchy, organism, fnlist, fnget):
+def load_fn(hierarchy, organism, fnlist, fnget, min_size=None, max_size=None):
+    """
+    Load gene sets of the hierarchy (and its subhierarchies) from files
+    listed by fnlist. The files are imported into an indexed store
+    (:mod:`.store`) in their directory on first use, so later loads
+    read only the selected gene sets.
+    """
     files = list(map(lambda x: x[:2], fnlist()))
     hierd = build_hierarchy_dict(files)
-    out = GeneSets()
     matches = hierd[(hierarchy, organism)]
     if not matches:
         exstr = "No gene sets for " + str(hierarchy) + \
                 " (org " + str(organism) + ")"
         raise NoGenesetsException(exstr)
-    for (h, o) in [ files[i] for i in hierd[(hierarchy, organism)]]:
-        fname = fnget(h, o)
-        if six.PY3:
-            out.update(pickle.load(open(fname, 'rb'), encoding="latin1"))
-        else:
-            out.update(pickle.load(open(fname, 'rb')))
-    return out
-
-def load(hierarchy, organism):
+    fnames = [ fnget(h, o) for (h, o) in [ files[i] for i in matches ] ]
+    try:
+        stores = defaultdict(list)
+        for fname in fnames:
+            stores[os.path.dirname(os.path.abspath(fname))].append(fname)
+        out = GeneSets()
+        for directory, paths in stores.items():
+            st = gsstore.store(directory)
+            for fname in paths:
+                st.sync_file(fname)
+            out.update(st.load(paths=paths, min_size=min_size, max_size=max_size))
+        return out
+    except (sqlite3.Error, OSError, IOError):
+        #the store is not writable: read the files
+        out = GeneSets()
+        for fname in fnames:
+            out.update(gs for gs in gsstore._load_pickle(fname)
+                       if (min_size is None or len(gs.genes) >= min_size) and
+                          (max_size is None or len(gs.genes) <= max_size))
+        return out
+
+def load(hierarchy, organism, min_size=None, max_size=None):
     """ First try to load from the local registered folder. If the file
-    is not available, load it from the server files. """
+    is not available, load it from the server files. Only gene sets
+    with at least min_size and at most max_size genes are loaded. """
     if organism != None:
         try:
             int(organism) #already a taxid
@@ -433,9 +550,9 @@ def load(hierarchy, organism):
                 raise NoGenesetsException(exstr)
 
     try:
-        return load_local(hierarchy, strornone(organism))
+        return load_local(hierarchy, strornone(organism), min_size, max_size)
     except NoGenesetsException:
-        return load_serverfiles(hierarchy, strornone(organism))
+        return load_serverfiles(hierarchy, strornone(organism), min_size, max_size)
 
 def collections(*args):
     """
@@ -458,10 +575,13 @@ def collections(*args):
                 new = load(*collection)
                 result.update(new)
             else:
-                if collection.lower()[-4:] == ".gmt": #format from webpage
-                    result.update(loadGMT(open(collection,"rt").read(), collection))
+                fname = collection.lower()
+                if fname.endswith(".gz"):
+                    fname = fname[:-3]
+                if fname[-4:] in (".gmt", ".gmx"): #format from webpage
+                    result.update(load_gmt(collection))
                 else:
-                    raise Exception("collection() accepts files in .gmt format only.")
+                    raise Exception("collection() accepts files in .gmt or .gmx format only.")
 
     return result
 
@@ -637,6 +757,22 @@ class GeneSets(set):
     def __repr__(self):
         return "GeneSets(" + set.__repr__(self) + ")"
 
+    def __reduce__(self):
+        #do not pickle the cached gene index
+        state = dict(self.__dict__)
+        state.pop("_gene_index", None)
+        return self.__class__, (list(self),), state or None
+
+    def gene_index(self):
+        """ Return an inverted index of genes to gene sets
+        (:class:`GeneSetsIndex`). It is built on the first call and
+        rebuilt when gene sets are added or removed. """
+        key = frozenset(map(id, self))
+        cached = getattr(self, "_gene_index", None)
+        if cached is None or cached[0] != key:
+            cached = self._gene_index = (key, GeneSetsIndex(self))
+        return cached[1]
+
     def common_org(self):
         """ Return a common organism. """
         if len(self) == 0:
@@ -674,6 +810,56 @@ class GeneSets(set):
             hd[gs.hierarchy].add(gs)
         return hd.values()
 
+class GeneSetsIndex(object):
+    """ An inverted index of genes to gene sets that contain them
+    (see :obj:`GeneSets.gene_index`). The gene sets of each gene are
+    stored as a range of a single array of gene set positions.
+    """
+
+    def __init__(self, genesets):
+        self.genesets = list(genesets)
+        genes = defaultdict(list)
+        for i, gs in enumerate(self.genesets):
+            for g in gs.genes:
+                genes[g].append(i)
+        self.genes = dict((g, i) for i, g in enumerate(genes))
+        lists = list(genes.values())
+        self.indptr = numpy.cumsum([0] + [ len(l) for l in lists ])
+        self.indices = numpy.fromiter((i for l in lists for i in l), dtype=int,
+                                      count=self.indptr[-1])
+
+    def _positions(self, gene):
+        row = self.genes.get(gene)
+        if row is None:
+            return self.indices[:0]
+        return self.indices[self.indptr[row]:self.indptr[row+1]]
+
+    def __getitem__(self, gene):
+        """ Return a list of gene sets containing the gene. """
+        return [ self.genesets[i] for i in self._positions(gene) ]
+
+    def containing(self, genes):
+        """ Return a dictionary of gene sets containing each of the genes
+        (genes without gene sets are left out). """
+        return dict((g, self[g]) for g in set(genes) if g in self.genes)
+
+    def overlap_counts(self, genes):
+        """ Return an array of the number of genes each gene set (in the
+        order of :obj:`genesets`) shares with genes. """
+        rows = numpy.array(sorted(set(self.genes[g] for g in genes if g in self.genes)),
+                           dtype=int)
+        starts, lens = self.indptr[rows], self.indptr[rows+1] - self.indptr[rows]
+        #concatenated ranges of positions of the rows
+        offsets = numpy.arange(lens.sum()) - numpy.repeat(numpy.cumsum(lens) - lens, lens)
+        positions = self.indices[numpy.repeat(starts, lens) + offsets]
+        return numpy.bincount(positions, minlength=len(self.genesets))
+
+    def overlaps(self, genes):
+        """ Return a dictionary of gene sets and the number of genes
+        they share with genes (gene sets without any are left out). """
+        counts = self.overlap_counts(genes)
+        return dict((self.genesets[i], int(counts[i])) for i in numpy.flatnonzero(counts))
+
 
 if __name__ == "__main__":
     rsf = serverfiles.ServerFiles(username=sys.argv[1], password=sys.argv[2])
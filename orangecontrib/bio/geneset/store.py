@@ -0,0 +1,367 @@
+"""
+An indexed on-disk store of gene sets.
+
+Gene set files (pickled :class:`GeneSets`, one per hierarchy and organism)
+are imported once into an SQLite database with a table of gene sets, a
+string table of genes and a table of (gene set, gene) memberships. Gene
+sets of a hierarchy (or of some files), of limited sizes, or with given
+ids can then be loaded without unpickling whole collections. The
+membership table is also indexed by genes, so gene sets containing
+given genes are found without loading any.
+
+"""
+from __future__ import absolute_import
+
+import os
+import sqlite3
+import threading
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import six
+
+FILENAME = "gene_sets.sqlite"
+
+#: Version of the database schema; stores with other versions are rebuilt.
+SCHEMA_VERSION = 1
+
+# Numbers of genes, and of gene set ids or paths, bound to a query at a
+# time (older SQLite builds allow at most 999 arguments).
+_CHUNK = 500
+_CHUNK_WHERE = 200
+
+
+def hierarchy_key(hierarchy):
+    """
+    Return a string key of a hierarchy (a tuple) such that keys of
+    subhierarchies start with the key of the hierarchy.
+    """
+    if hierarchy is None:
+        return None
+    return "".join(h + "\x1f" for h in hierarchy)
+
+
+def hierarchy_from_key(key):
+    if key is None:
+        return None
+    return tuple(key.split("\x1f")[:-1])
+
+
+def _chunks(values, size):
+    """
+    Return a list of chunks of `values` (a single empty chunk if there
+    are no values, and [None] for None).
+    """
+    if values is None:
+        return [None]
+    values = list(values)
+    return [values[i:i + size] for i in range(0, len(values), size)] or [[]]
+
+
+def _load_pickle(filename):
+    with open(filename, "rb") as f:
+        if six.PY3:
+            return pickle.load(f, encoding="latin1")
+        else:
+            return pickle.load(f)
+
+
+class GeneSetStore(object):
+    """
+    An SQLite store of gene sets.
+
+    :param str filename: Database file name (created if it does not exist).
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        # the connection is shared by threads (guarded by the lock)
+        self._con = sqlite3.connect(filename, timeout=15,
+                                    check_same_thread=False)
+        self._lock = threading.RLock()
+        self._create()
+
+    def _create(self):
+        with self._lock, self._con:
+            version = self._con.execute("PRAGMA user_version").fetchone()[0]
+            if version != SCHEMA_VERSION:
+                for table in ["members", "genesets", "genes", "files"]:
+                    self._con.execute("DROP TABLE IF EXISTS %s" % table)
+                self._con.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+
+            self._con.executescript("""
+                CREATE TABLE IF NOT EXISTS files (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT UNIQUE,
+                    mtime REAL,
+                    size INTEGER
+                );
+                CREATE TABLE IF NOT EXISTS genesets (
+                    id INTEGER PRIMARY KEY,
+                    file INTEGER,
+                    gsid TEXT,
+                    name TEXT,
+                    description TEXT,
+                    link TEXT,
+                    organism TEXT,
+                    hierarchy TEXT,
+                    size INTEGER
+                );
+                CREATE INDEX IF NOT EXISTS genesets_file ON genesets (file);
+                CREATE INDEX IF NOT EXISTS genesets_gsid ON genesets (gsid);
+                CREATE INDEX IF NOT EXISTS genesets_hierarchy
+                    ON genesets (hierarchy, organism);
+                CREATE TABLE IF NOT EXISTS genes (
+                    id INTEGER PRIMARY KEY,
+                    symbol TEXT UNIQUE
+                );
+                CREATE TABLE IF NOT EXISTS members (
+                    geneset INTEGER,
+                    gene INTEGER,
+                    PRIMARY KEY (geneset, gene)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS members_gene ON members (gene);
+            """)
+
+    def close(self):
+        self._con.close()
+
+    def _gene_ids(self, genes):
+        """Return ids of gene symbols (adding new ones to the string table)."""
+        con = self._con
+        con.executemany("INSERT OR IGNORE INTO genes (symbol) VALUES (?)",
+                        ((g,) for g in genes))
+        ids = {}
+        genes = list(genes)
+        for chunk in _chunks(genes, _CHUNK):
+            cur = con.execute(
+                "SELECT symbol, id FROM genes WHERE symbol IN (%s)" %
+                ",".join("?" * len(chunk)), chunk)
+            ids.update(cur)
+        return ids
+
+    def add(self, genesets, path=None, mtime=None, size=None):
+        """
+        Add gene sets to the store. If `path` is given, gene sets
+        previously added from the same path are replaced.
+
+        :param GeneSets genesets: Gene sets.
+        :param str path: The file the gene sets were loaded from.
+        """
+        with self._lock, self._con:
+            con = self._con
+            file_id = None
+            if path is not None:
+                self._remove(path)
+                file_id = con.execute(
+                    "INSERT INTO files (path, mtime, size) VALUES (?, ?, ?)",
+                    (path, mtime, size)).lastrowid
+
+            genesets = list(genesets)
+            ids = self._gene_ids(set(g for gs in genesets for g in gs.genes))
+            for gs in genesets:
+                set_id = con.execute(
+                    "INSERT INTO genesets (file, gsid, name, description, "
+                    "link, organism, hierarchy, size) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (file_id, gs.id, gs.name,
+                     getattr(gs, "description", None),
+                     getattr(gs, "link", None), gs.organism,
+                     hierarchy_key(gs.hierarchy), len(gs.genes))).lastrowid
+                con.executemany(
+                    "INSERT INTO members (geneset, gene) VALUES (?, ?)",
+                    ((set_id, ids[g]) for g in gs.genes))
+
+    def _remove(self, path):
+        con = self._con
+        row = con.execute("SELECT id FROM files WHERE path = ?",
+                          (path,)).fetchone()
+        if row is not None:
+            con.execute("DELETE FROM members WHERE geneset IN "
+                        "(SELECT id FROM genesets WHERE file = ?)", row)
+            con.execute("DELETE FROM genesets WHERE file = ?", row)
+            con.execute("DELETE FROM files WHERE id = ?", row)
+
+    def remove(self, path):
+        """Remove gene sets that were added from `path`."""
+        with self._lock, self._con:
+            self._remove(path)
+
+    def sync_file(self, path):
+        """
+        Import a pickled :class:`GeneSets` file unless it is already
+        imported and unchanged (the same modification time and size).
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self._lock:
+            row = self._con.execute(
+                "SELECT mtime, size FROM files WHERE path = ?",
+                (path,)).fetchone()
+            if row is None or tuple(row) != (st.st_mtime, st.st_size):
+                self.add(_load_pickle(path), path=path, mtime=st.st_mtime,
+                         size=st.st_size)
+
+    def _where(self, hierarchy=None, organism=None, paths=None,
+               min_size=None, max_size=None, ids=None):
+        conds, args = [], []
+        if hierarchy is not None:
+            key = hierarchy_key(hierarchy)
+            conds.append("substr(s.hierarchy, 1, ?) = ?")
+            args += [len(key), key]
+        if organism is not None:
+            conds.append("s.organism = ?")
+            args.append(organism)
+        if paths is not None:
+            conds.append("s.file IN (SELECT id FROM files WHERE path IN (%s))"
+                         % ",".join("?" * len(paths)))
+            args += paths
+        if min_size is not None:
+            conds.append("s.size >= ?")
+            args.append(min_size)
+        if max_size is not None:
+            conds.append("s.size <= ?")
+            args.append(max_size)
+        if ids is not None:
+            conds.append("s.gsid IN (%s)" % ",".join("?" * len(ids)))
+            args += ids
+        return " AND ".join(conds) or "1", args
+
+    def _wheres(self, paths=None, ids=None, **kwargs):
+        """
+        Yield conditions (and their arguments) for chunks of paths and
+        ids, which together select the gene sets that match the
+        conditions (the number of arguments of a query is limited).
+        """
+        # chunks must not share values (or gene sets would repeat)
+        if paths is not None:
+            paths = list(set(os.path.abspath(p) for p in paths))
+        if ids is not None:
+            ids = list(set(ids))
+        for paths_chunk in _chunks(paths, _CHUNK_WHERE):
+            for ids_chunk in _chunks(ids, _CHUNK_WHERE):
+                yield self._where(paths=paths_chunk, ids=ids_chunk, **kwargs)
+
+    def ids(self, **kwargs):
+        """
+        Return ids of gene sets that match the conditions (see
+        :obj:`load`) without loading their genes.
+        """
+        res = []
+        with self._lock:
+            for where, args in self._wheres(**kwargs):
+                res.extend(self._con.execute(
+                    "SELECT s.id, s.gsid FROM genesets s WHERE %s" % where,
+                    args))
+        return [gsid for _, gsid in sorted(res)]
+
+    def hierarchies(self):
+        """Return a list of (hierarchy, organism, number of gene sets)."""
+        with self._lock:
+            return [(hierarchy_from_key(h), o, n) for h, o, n in
+                    self._con.execute(
+                        "SELECT hierarchy, organism, count(*) FROM genesets "
+                        "GROUP BY hierarchy, organism")]
+
+    def load(self, hierarchy=None, organism=None, paths=None,
+             min_size=None, max_size=None, ids=None):
+        """
+        Return gene sets that match all the given conditions as
+        :class:`GeneSets`.
+
+        :param tuple hierarchy: Gene sets of this hierarchy (and its
+            subhierarchies).
+        :param str organism: Organism tax id.
+        :param list paths: Gene sets imported from these files.
+        :param int min_size: Minimal number of genes.
+        :param int max_size: Maximal number of genes.
+        :param list ids: Gene set ids.
+        """
+        from . import GeneSet, GeneSets
+        wheres = self._wheres(hierarchy=hierarchy, organism=organism,
+                              paths=paths, min_size=min_size,
+                              max_size=max_size, ids=ids)
+        sets = []
+        genes = {}
+        symbols = {}
+        with self._lock:
+            con = self._con
+            for where, args in wheres:
+                chunk = con.execute(
+                    "SELECT s.id, s.gsid, s.name, s.description, s.link, "
+                    "s.organism, s.hierarchy FROM genesets s WHERE %s" % where,
+                    args).fetchall()
+                sets.extend(chunk)
+                genes.update((row[0], []) for row in chunk)
+                for set_id, gene_id, symbol in con.execute(
+                        "SELECT m.geneset, m.gene, g.symbol "
+                        "FROM genesets s JOIN members m ON m.geneset = s.id "
+                        "JOIN genes g ON g.id = m.gene WHERE %s" % where, args):
+                    # share the strings of genes in multiple sets
+                    genes[set_id].append(symbols.setdefault(gene_id, symbol))
+
+        out = GeneSets()
+        hierarchies = {}
+        for set_id, gsid, name, description, link, organism, hkey in sets:
+            if hkey not in hierarchies:
+                hierarchies[hkey] = hierarchy_from_key(hkey)
+            out.add(GeneSet(id=gsid, name=name, genes=genes[set_id],
+                            description=description, link=link,
+                            organism=organism,
+                            hierarchy=hierarchies[hkey]))
+        return out
+
+    def _members_of(self, genes, **kwargs):
+        """Yield (gene, gene set id) of the genes for gene sets that
+        match the conditions (see :obj:`load`)."""
+        wheres = list(self._wheres(**kwargs))
+        genes = list(set(genes))
+        with self._lock:
+            for chunk in _chunks(genes, _CHUNK):
+                for where, args in wheres:
+                    for row in self._con.execute(
+                            "SELECT g.symbol, s.gsid FROM genes g "
+                            "JOIN members m ON m.gene = g.id "
+                            "JOIN genesets s ON s.id = m.geneset "
+                            "WHERE g.symbol IN (%s) AND %s" %
+                            (",".join("?" * len(chunk)), where),
+                            chunk + args):
+                        yield row
+
+    def containing(self, genes, **kwargs):
+        """
+        Return a dictionary of ids of gene sets containing each of the
+        genes (genes without gene sets are left out). Gene sets can be
+        limited with the conditions of :obj:`load`.
+        """
+        res = {}
+        for gene, gsid in self._members_of(genes, **kwargs):
+            res.setdefault(gene, []).append(gsid)
+        return res
+
+    def overlaps(self, genes, **kwargs):
+        """
+        Return a dictionary of gene set ids and the number of genes
+        they share with `genes` (gene sets without any are left out).
+        Gene sets can be limited with the conditions of :obj:`load`.
+        """
+        res = {}
+        for _, gsid in self._members_of(genes, **kwargs):
+            res[gsid] = res.get(gsid, 0) + 1
+        return res
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def store(directory):
+    """Return the (shared) :class:`GeneSetStore` in `directory`."""
+    directory = os.path.abspath(directory)
+    with _stores_lock:
+        if directory not in _stores:
+            _stores[directory] = GeneSetStore(os.path.join(directory, FILENAME))
+        return _stores[directory]
@@ -2,10 +2,12 @@ from __future__ import absolute_import
 
 import random
 import math
-from collections import defaultdict
+import hashlib
+from collections import defaultdict, OrderedDict
 
 import scipy.stats
 import scipy.special
+import scipy.sparse
 import numpy
 import Orange
 
@@ -17,6 +19,7 @@ except ImportError:
 import Orange.utils
 
 from .. import utils
+from ..utils import enrichment, parallel
 obiExpression = utils.expression
 
 def corgs_activity_score(ex, corg):
@@ -128,14 +131,14 @@ class GeneSetTrans(object):
         the gene set with specified indices.
         """
         nm, name_ind = mat_ni(instance.domain, self.matcher)
-        genes = [ nm.umatch(gene) for gene in geneset ]
+        genes = nm.umatch_many(geneset)
         if takegenes:
             genes = [ genes[i] for i in takegenes ]
         return nm, name_ind, genes
 
     def _match_data(self, data, geneset, odic=False):
         nm, name_ind = mat_ni(data.domain, self.matcher)
-        genes = [ nm.umatch(gene) for gene in geneset ]
+        genes = nm.umatch_many(geneset)
         if odic:
             to_geneset = dict(zip(genes, geneset))
         takegenes = [ i for i,a in enumerate(genes) if a != None ]
@@ -145,7 +148,7 @@ class GeneSetTrans(object):
         else:
             return nm, name_ind, genes, takegenes
 
-    def __init__(self, matcher=None, gene_sets=None, min_size=3, max_size=1000, min_part=0.1, class_values=None, cv=False):
+    def __init__(self, matcher=None, gene_sets=None, min_size=3, max_size=1000, min_part=0.1, class_values=None, cv=False, n_jobs=1):
         self.matcher = matcher
         self.gene_sets = gene_sets
         self.min_size = min_size
@@ -154,6 +157,54 @@ class GeneSetTrans(object):
         self.class_values = class_values
         self._cache = {}
         self.cv = cv
+        #number of (forked) worker processes for fitting per gene set models;
+        #outside the main thread (e.g. in widgets) the models are fit serially
+        self.n_jobs = n_jobs
+
+    def _set_columns(self, domain, gene_sets):
+        """
+        Return a list of attribute indices of matched genes for each gene
+        set (a gene matched by multiple names from the gene set is
+        repeated).
+        """
+        nm, name_ind = mat_ni(domain, self.matcher)
+        columns = []
+        for gs in gene_sets:
+            genes = nm.umatch_many(gs.genes)
+            columns.append([ name_ind[g] for g in genes if g != None ])
+        return columns
+
+    def _membership(self, domain, gene_sets):
+        """
+        Return a sparse (attributes x gene sets) matrix with the number
+        of matches of each attribute in each gene set.
+        """
+        columns = self._set_columns(domain, gene_sets)
+        indptr = numpy.cumsum([0] + [ len(c) for c in columns ])
+        indices = numpy.array(sum(columns, []), dtype=int)
+        M = scipy.sparse.csc_matrix(
+            (numpy.ones(len(indices)), indices, indptr),
+            shape=(len(domain.attributes), len(columns)))
+        M.sum_duplicates()
+        return M
+
+    def _transform_matrix(self, learn, data, gene_sets):
+        """
+        Return the values of features (built on learn) for all instances
+        of data as an array (instances x gene sets) or None if they need
+        to be computed for each instance separately.
+        """
+        return None
+
+    def _transformed(self, domain, learn, data, gene_sets):
+        """ Return data transformed into domain (with features built on learn). """
+        X = self._transform_matrix(learn, data, gene_sets)
+        if X is None:
+            return Orange.data.Table(domain, data)
+        rows = X.tolist()
+        if domain.class_var:
+            rows = [ row + [ex.get_class().native()] for row, ex in zip(rows, data) ]
+        return Orange.data.Table(domain, rows)
 
     def __call__(self, data, weight_id=None):
 
@@ -170,7 +221,7 @@ class GeneSetTrans(object):
 
         #build a data set with cross validation
         if self.cv == False:
-            return Orange.data.Table(newdomain, data)
+            return self._transformed(newdomain, data, data, gene_sets)
         else:
             # The domain has the transformer that is build on all samples,
             # while the transformed data table uses cross-validation
@@ -186,7 +237,7 @@ class GeneSetTrans(object):
                 test = data.select(cvi, f)
                 lf = self.build_features(learn, gene_sets)
                 transd = Orange.data.Domain(lf, data.domain.class_var)
-                trans_test = Orange.data.Table(transd, test)
+                trans_test = self._transformed(transd, learn, test, gene_sets)
                 for ex, pos in \
                     zip(trans_test, [ i for i,n in enumerate(cvi) if n == f ]):
                     data_cv[pos] = ex.native(0)
@@ -350,8 +401,8 @@ class Assess(GeneSetTrans):
         from .. import gsea as obiGsea
         if key not in self.example_buffer:
             ex_atts = [ at.name for at in ex.domain.attributes ]
-            new_atts = [ name_ind[nm.umatch(an)] if nm.umatch(an) != None else (None if self.ignore_unmatchable_context else i)
-                for i,an in enumerate(ex_atts) ]
+            new_atts = [ name_ind[m] if m != None else (None if self.ignore_unmatchable_context else i)
+                for i,m in enumerate(nm.umatch_many(ex_atts)) ]
 
             #new_atts: indices of genes in original data for that sample 
             #POSSIBLE REVERSE IMPLEMENTATION (slightly different
@@ -473,7 +524,7 @@ def select_genesets(nm, gene_sets, min_size=3, max_size=1000, min_part=0.1):
 
     def ok_sizes(gs):
         """compares sizes of genesets to limitations"""
-        transl = filter(lambda x: x != None, [ nm.umatch(gene) for gene in gs.genes ])
+        transl = [ g for g in nm.umatch_many(gs.genes) if g != None ]
         if len(transl) >= min_size \
             and len(transl) <= max_size \
             and float(len(transl))/len(gs.genes) >= min_part:
@@ -482,6 +533,11 @@ def select_genesets(nm, gene_sets, min_size=3, max_size=1000, min_part=0.1):
 
     return filter(ok_sizes, gene_sets) 
 
+def data_matrix(data):
+    """ Return attribute values of data as an array (NaN for unknown values). """
+    X = data.toNumpyMA("a")[0]
+    return numpy.ma.filled(X.astype(float), numpy.nan)
+
 def vou(ex, gn, indices):
     """ returns the value or "?" for the given gene name gn"""
     if gn not in indices:
@@ -519,6 +575,13 @@ class SetSig(GeneSetTrans):
         at.get_value_from = t
         return at
 
+    def _transform_matrix(self, learn, data, gene_sets):
+        from .. import gsea as obiGsea
+        L, labels = obiGsea.expressionMatrix(learn)
+        M = self._membership(learn.domain, gene_sets)
+        return enrichment.set_correlation_scores(L, labels, data_matrix(data), M,
+            exclude_same=self.check_same, no_unknowns=self.no_unknowns)
+
 class ParametrizedTransformation(GeneSetTrans):
 
     def _get_par(self, datao):
@@ -527,18 +590,33 @@ class ParametrizedTransformation(GeneSetTrans):
         
     def _use_par(self, ex, constructt):
         pass
-    
-    def build_feature(self, data, gs):
-
-        at = Orange.feature.Continuous(name=str(gs))
 
-        geneset = list(gs.genes)
+    def _gene_domain(self, data, geneset):
         nm, name_ind, genes, takegenes = self._match_data(data, geneset)
         domain = Orange.data.Domain([data.domain.attributes[name_ind[gene]] for gene in genes], data.domain.class_var)
+        return domain, [ geneset[i] for i in takegenes ]
+
+    def _fit(self, data, gs):
+        """ Fit the model for a gene set. The result (parameters and matched
+        genes) is sent from the worker processes, so it has to be picklable. """
+        domain, takegenes = self._gene_domain(data, list(gs.genes))
         datao = Orange.data.Table(domain, data)
-        takegenes = [ geneset[i] for i in takegenes ]
+        return self._get_par(datao), takegenes
+
+    def build_features(self, data, gene_sets):
+        fits = parallel.parallel_map(lambda gs: self._fit(data, gs),
+                                     gene_sets, n_jobs=self.n_jobs)
+        return [ self._feature(data, gs, fit) for gs, fit in zip(gene_sets, fits) ]
+
+    def build_feature(self, data, gs):
+        return self._feature(data, gs, self._fit(data, gs))
+
+    def _feature(self, data, gs, fit):
 
-        constructt = self._get_par(datao)
+        at = Orange.feature.Continuous(name=str(gs))
+
+        constructt, takegenes = fit
+        domain, _ = self._gene_domain(data, takegenes)
 
         def t(ex, w, constructt=constructt, takegenes=takegenes, domain=domain):
             nm2, name_ind2, genes2 = self._match_instance(ex, takegenes)
@@ -627,6 +705,13 @@ class SimpleFun(GeneSetTrans):
         at.get_value_from = t
         return at
 
+    def _transform_matrix(self, learn, data, gene_sets):
+        fn = { numpy.mean: enrichment.set_means,
+               numpy.median: enrichment.set_medians }.get(self.fn)
+        if fn is None:
+            return None
+        return fn(data_matrix(data), self._membership(data.domain, gene_sets))
+
 class Mean(SimpleFun):
 
     def __init__(self, **kwargs):
@@ -687,6 +772,78 @@ class GSA(GeneSetTrans):
 
         return attributes
 
+class ClassStatistics(object):
+    """
+    Per-gene statistics of a data set with two classes, computed for all
+    genes at once: t-scores (as :obj:`MA_t_test`) and class-conditional
+    means and standard deviations (as :obj:`estimate_gaussian_per_class`
+    with common_if_extreme=True).
+    """
+
+    def __init__(self, data):
+        from .. import gsea as obiGsea
+        self.X, self.y = obiGsea.expressionMatrix(data)
+        self.tscores = enrichment.ranking_statistics(self.X, self.y, "t",
+                                                     keep_undefined=True)[0]
+        self.gaussians = enrichment.class_gaussians(self.X, self.y)
+        self._normalization = {}
+
+    def gaussian(self, i):
+        """ Return (mi1, st1, mi2, st2) of attribute i (None if unknown). """
+        return tuple(None if numpy.isnan(v) else float(v) for v in self.gaussians[i])
+
+    def activity_tscores(self, inds):
+        """ Return t-scores of CORGs activity scores of all prefixes of
+        attributes inds. """
+        return enrichment.activity_tscores(self.X, self.y, inds)
+
+    def llr_normalization(self, i):
+        """ Return the mean and standard deviation of log ratios of
+        attribute i on the data set. """
+        if i not in self._normalization:
+            mi1, st1, mi2, st2 = self.gaussian(i)
+            if None in (mi1, st1, mi2, st2) or st1 == 0 or st2 == 0:
+                r = numpy.zeros(len(self.X))
+            else:
+                v = self.X[:, i]
+                r = (mi2 - v)**2 / (2.0*st2**2) - (v - mi1)**2 / (2.0*st1**2) \
+                    + math.log(st2) - math.log(st1)
+                r = numpy.where(numpy.isnan(v), 0., r)
+            self._normalization[i] = (mean(r.tolist()), std(r.tolist()))
+        return self._normalization[i]
+
+class StatisticsCache(object):
+    """
+    Cache of :obj:`ClassStatistics` of data sets. Data sets are
+    identified by their contents, so a cache shared between
+    transformations (CORGs, LLR) or repeated transformations on the
+    same data (or the same cross-validation folds) computes them once.
+    """
+
+    def __init__(self, maxsize=10):
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+
+    def key(self, data):
+        X, y = data.toNumpyMA("A/C")
+        h = hashlib.sha1()
+        for a in [X.filled(numpy.nan), y.filled(-1)]:
+            h.update(numpy.ascontiguousarray(a, dtype=float).tobytes())
+        h.update(repr([a.name for a in data.domain.attributes] +
+                      list(data.domain.class_var.values)).encode("utf-8"))
+        return h.hexdigest()
+
+    def __call__(self, data):
+        key = self.key(data)
+        if key in self._cache:
+            stats = self._cache.pop(key)
+        else:
+            stats = ClassStatistics(data)
+            while len(self._cache) >= self.maxsize:
+                self._cache.popitem(last=False)
+        self._cache[key] = stats
+        return stats
+
 def tscorec(data, at, cache=None):
     """ Cached attribute  tscore calculation """
     if cache != None and at in cache: return cache[at]
@@ -697,39 +854,22 @@ def tscorec(data, at, cache=None):
 def nth(l, n):
     return [a[n] for a in l]
 
-def compute_corg(data, inds, tscorecache):
+def compute_corg(data, inds, tscorecache=None, statistics=None):
     """
     Compute CORG for this geneset specified with gene inds
     in the example table. Output is the list of gene inds
-    in CORG.
+    in CORG. Statistics (:obj:`ClassStatistics`) of data are
+    computed if not given. t-scores in tscorecache (a dictionary,
+    as used by :obj:`tscorec`) are used instead of computed ones,
+    and the missing ones are added to it.
 
     """
-    #order member genes by their t-scores: decreasing, if av(t-score) >= 0,
-    #else increasing
-    tscores = [ tscorec(data, at, tscorecache) for at in inds ]
-    sortedinds = nth(sorted(zip(inds,tscores), key=lambda x: x[1], \
-        reverse=numpy.mean(tscores) >= 0), 0)
-
-    def S(corg):
-        """ Activity score separation - S(G) in 
-        the article """
-        asv = Orange.feature.Continuous(name='AS')
-        asv.getValueFrom = lambda ex,rw: Orange.data.Value(asv, corgs_activity_score(ex, corg))
-        data2 = Orange.data.Table(Orange.data.Domain([asv], data.domain.classVar), data)
-        return abs(tscorec(data2, 0)) #FIXME absolute - nothing in the article abs()
-            
-    #greedily find CORGS procing the best separation
-    g = S(sortedinds[:1])
-    bg = 1
-    for a in range(2, len(sortedinds)+1):
-        tg = S(sortedinds[:a])
-        if tg > g: #improvement
-            g = tg
-            bg = a
-        else:
-            break
-        
-    return sortedinds[:bg]
+    if statistics is None:
+        statistics = ClassStatistics(data)
+    tscores = [ float(statistics.tscores[at]) for at in inds ]
+    if tscorecache is not None:
+        tscores = [ tscorecache.setdefault(at, t) for at, t in zip(inds, tscores) ]
+    return enrichment.corg_genes(statistics.X, statistics.y, inds, tscores)
 
 class CORGs(ParametrizedTransformation):
     """
@@ -737,20 +877,28 @@ class CORGs(ParametrizedTransformation):
     (mean=0, stdev=1) for all samples.
     """
 
-    def build_features(self, *args, **kwargs):
-        self.tscorecache = {} #reset a cache
-        return super(CORGs, self).build_features(*args, **kwargs)
+    def __init__(self, **kwargs):
+        #a StatisticsCache can be shared with other transformations
+        self.cache = kwargs.pop("cache", None) or StatisticsCache()
+        super(CORGs, self).__init__(**kwargs)
 
-    def build_feature(self, data, gs):
+    def build_features(self, data, *args, **kwargs):
+        self._statistics = self.cache(data)
+        return super(CORGs, self).build_features(data, *args, **kwargs)
 
-        at = Orange.feature.Continuous(name=str(gs))
+    def _fit(self, data, gs):
         geneset = list(gs.genes)
 
         nm, name_ind, genes, takegenes, to_geneset = self._match_data(data, geneset, odic=True)
-        indices = compute_corg(data, [ name_ind[g] for g in genes ], self.tscorecache)
+        indices = compute_corg(data, [ name_ind[g] for g in genes ],
+            statistics=self._statistics)
 
         ind_names = dict( (a,b) for b,a in name_ind.items() )
-        selected_genes = sorted(set([to_geneset[ind_names[i]] for i in indices]))
+        return sorted(set([to_geneset[ind_names[i]] for i in indices]))
+
+    def _feature(self, data, gs, selected_genes):
+
+        at = Orange.feature.Continuous(name=str(gs))
     
         def t(ex, w, corg=selected_genes): #copy od the data
             nm2, name_ind2, genes2 = self._match_instance(ex, corg, None)
@@ -760,20 +908,19 @@ class CORGs(ParametrizedTransformation):
         at.get_value_from = t
         return at
 
-def compute_llr(data, inds, cache):
+def compute_llr(data, inds, cache=None, statistics=None):
     """
-    Compute CORG for this geneset specified with gene inds
-    in the example table. Output is the list of gene inds
-    in CORG.
+    Return class-conditional gaussian parameters (mi1, st1, mi2, st2)
+    of genes inds in the example table. Statistics
+    (:obj:`ClassStatistics`) of data are computed if not given.
+    Parameters in cache (a dictionary of attribute indices) are used
+    instead of computed ones, and the missing ones are added to it.
     """
-    def gaussianc(data, at, cache=None):
-        """ Cached attribute  tscore calculation """
-        if cache != None and at in cache: return cache[at]
-        ma = estimate_gaussian_per_class(data, at, common_if_extreme=True)
-        if cache != None: cache[at] = ma
-        return ma
-
-    gf = [ gaussianc(data, at, cache) for at in inds ]
+    if statistics is None:
+        statistics = ClassStatistics(data)
+    gf = [ statistics.gaussian(at) for at in inds ]
+    if cache is not None:
+        gf = [ cache.setdefault(at, g) for at, g in zip(inds, gf) ]
     return gf
 
 """ To avoid scipy overhead """
@@ -801,30 +948,41 @@ class LLR(ParametrizedTransformation):
 
     def __init__(self, **kwargs):
         self.normalize = kwargs.pop("normalize", True) #normalize final results
+        #a StatisticsCache can be shared with other transformations
+        self.cache = kwargs.pop("cache", None) or StatisticsCache()
         super(LLR, self).__init__(**kwargs)
 
-    def build_features(self, *args, **kwargs):
-        self._gauss_cache = {} #caching of gaussian estimates
+    def build_features(self, data, *args, **kwargs):
+        self._statistics = self.cache(data)
         self._normalizec = {}
-        return super(LLR, self).build_features(*args, **kwargs)
-
-    def build_feature(self, data, gs):
+        return super(LLR, self).build_features(data, *args, **kwargs)
 
-        at = Orange.feature.Continuous(name=str(gs))
+    def _fit(self, data, gs):
         geneset = list(gs.genes)
 
         nm, name_ind, genes, takegenes, to_geneset = self._match_data(data, geneset, odic=True)
 
         gsi = [ name_ind[g] for g in genes ]
-        gausse = compute_llr(data, gsi, self._gauss_cache)
+        gausse = compute_llr(data, gsi, statistics=self._statistics)
         genes_gs = [ to_geneset[g] for g in genes ]
 
+        normalizec = {}
         if self.normalize: # per (3) in the paper
-            #compute log ratios for all samples and genes from this gene set
-            for i, gene_gs, g in zip(gsi, genes_gs, gausse):
+            #log ratios for all samples and genes from this gene set
+            for i, gene_gs in zip(gsi, genes_gs):
                 if gene_gs not in self._normalizec: #skip if computed already
-                    r = [ _llrlogratio(ex[i].value, *g) for ex in data ]
-                    self._normalizec[gene_gs] = (mean(r), std(r))
+                    normalizec[gene_gs] = self._normalizec[gene_gs] = \
+                        self._statistics.llr_normalization(i)
+
+        return gausse, genes_gs, normalizec
+
+    def _feature(self, data, gs, fit):
+
+        at = Orange.feature.Continuous(name=str(gs))
+        gausse, genes_gs, normalizec = fit
+        #normalization computed by workers
+        for gene_gs, nc in normalizec.items():
+            self._normalizec.setdefault(gene_gs, nc)
 
         def t(ex, w, genes_gs=genes_gs, gausse=gausse, normalizec=self._normalizec):
             nm2, name_ind2, genes2 = self._match_instance(ex, genes_gs, None)
@@ -944,10 +1102,15 @@ class SPCA(ParametrizedTransformation):
 
         return a
 
+def _shuffled_locations(n, rand):
+    """ Return new locations of n shuffled items. """
+    locations = list(range(n))
+    rand.shuffle(locations)
+    return locations
+
 def _shuffleClass(data, rand):
     """ Destructive! """
-    locations = range(len(data))
-    rand.shuffle(locations)
+    locations = _shuffled_locations(len(data), rand)
     attribute = -1
     l = [None]*len(data)
     for i in range(len(data)):
@@ -965,23 +1128,35 @@ class SPCA_ttperm(SPCA):
         super(SPCA_ttperm, self).__init__(**kwargs)
 
     def build_features(self, data, *args, **kwargs):
-        joined = []
+        from .. import gsea as obiGsea
+        X, y = obiGsea.expressionMatrix(data)
         rand = random.Random(0)
-        nat = len(data.domain.attributes)
-
-        datap = Orange.data.Table(data.domain, data)
+        nat = X.shape[1]
 
+        #the same permutations (cumulative shuffles of classes) and
+        #attribute samples as shuffling the classes of the data table
+        labels = numpy.empty((self.perm, len(y)), dtype=y.dtype)
+        samples = []
         for p in range(self.perm):
-            _shuffleClass(datap, rand)
+            labels[p, _shuffled_locations(len(y), rand)] = y
+            y = labels[p]
             if self.sperm is not None:
-                ti = rand.sample(xrange(nat), self.sperm)
+                samples.append(rand.sample(range(nat), self.sperm))
             else:
-                ti = range(nat)
-            joined.extend([ obiExpression.MA_t_test()(i, datap) 
-                for i in ti ])
-
-        joined = map(abs, joined)
-        joined.sort(reverse=True)
+                samples.append(range(nat))
+
+        def tscores(block):
+            #t-scores of sampled attributes of a block of permutations
+            cols = numpy.unique(numpy.concatenate([ samples[p] for p in block ]))
+            ts = enrichment.ranking_statistics(X[:, cols], labels[block], "t",
+                                               keep_undefined=True)
+            ts[numpy.isnan(ts)] = 0.
+            return [ ts[i, numpy.searchsorted(cols, samples[p])] for i, p in enumerate(block) ]
+
+        blocks = [ list(range(p, min(p + 20, self.perm))) for p in range(0, self.perm, 20) ]
+        results = parallel.parallel_map(tscores, blocks, n_jobs=self.n_jobs)
+        joined = numpy.abs(numpy.concatenate(sum(results, [])))
+        joined = numpy.sort(joined)[::-1]
 
         t = joined[int(self.pval*len(joined))]
 
@@ -11,6 +11,7 @@ import tarfile
 import gzip
 import re
 import sys
+import json
 import six
 
 try:
@@ -31,6 +32,9 @@ from gzip import GzipFile
 from collections import defaultdict
 from operator import attrgetter
 
+import numpy
+import scipy.sparse
+
 from orangecontrib.bio.utils import progress_bar_milestones
 
 try:
@@ -45,13 +49,33 @@ except NameError:
     basestring = str
     intern = sys.intern
 
+try:
+    _isin = numpy.isin
+except AttributeError:
+    # numpy < 1.13
+    _isin = numpy.in1d
+
 from orangecontrib.bio.utils import serverfiles
 from orangecontrib.bio.utils import stats
+from orangecontrib.bio.utils import parallel
 
 from orangecontrib.bio import gene as obiGene, taxonomy as obiTaxonomy
 
 default_database_path = os.path.join(serverfiles.localpath(), "GO")
 
+
+def snapshot_buffer_path():
+    """
+    Return the directory where compiled annotation snapshots are stored.
+    """
+    path = os.path.join(environ.buffer_dir, "go_snapshots")
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            pass
+    return path
+
 _CVS_REVISION_RE = re.compile(r"^(rev)?(\d+\.\d+)+$")
 
 evidenceTypes = {
@@ -297,6 +321,7 @@ class Ontology(object):
         self.alias_mapper = {}
         self.reverse_alias_mapper = defaultdict(set)
         self.header = ""
+        self._closure = None
 
         if filename is not None:
             self.parse_file(filename, progress_callback)
@@ -387,6 +412,17 @@ class Ontology(object):
                 pass
             if progress_callback and i in milestones:
                 progress_callback(90.0 + 10.0 * i / len(self.terms))
+        self._closure = None
+
+    @property
+    def closure(self):
+        """
+        An :class:`OntologyClosure` index of all the ancestor/descendant
+        relations in the ontology (built on first access).
+        """
+        if self._closure is None:
+            self._closure = OntologyClosure(self)
+        return self._closure
 
     def defined_slims_subsets(self):
         """
@@ -435,17 +471,26 @@ class Ontology(object):
         :param str term: Term ID.
 
         """
-        queue = set([term])
+        closure = self.closure
+        slim_ids = closure.indices(t for t in self.slims_subset
+                                   if t in self)
+        start = closure.index(term)
+        if start in slim_ids:
+            return set([term])
+        # Only the parents leading to a slim term need to be visited.
+        candidates = set(closure.ancestor_ids(start)) & set(slim_ids)
+        queue = set([start])
         visited = set()
         slims = set()
         while queue:
-            term = queue.pop()
-            visited.add(term)
-            if term in self.slims_subset:
-                slims.add(term)
+            i = queue.pop()
+            visited.add(i)
+            if i in candidates:
+                slims.add(closure.terms[i])
             else:
-                queue.update(set(tid for _, tid in self[term].related) -
-                             visited)
+                queue.update(p for p in closure.parent_ids(i)
+                             if p not in visited and
+                             candidates.intersection(closure.ancestor_ids(p)))
         return slims
 
     def extract_super_graph(self, terms):
@@ -456,13 +501,10 @@ class Ontology(object):
 
         """
         terms = [terms] if isinstance(terms, basestring) else terms
-        visited = set()
-        queue = set(terms)
-        while queue:
-            term = queue.pop()
-            visited.add(term)
-            queue.update(set(tid for _, tid in self[term].related) -
-                         visited)
+        closure = self.closure
+        visited = set(terms)
+        visited.update(closure.terms_for(
+            closure.ancestor_ids_many(closure.indices(terms))))
         return visited
 
     def extract_sub_graph(self, terms):
@@ -473,13 +515,10 @@ class Ontology(object):
 
         """
         terms = [terms] if type(terms) == str else terms
-        visited = set()
-        queue = set(terms)
-        while queue:
-            term = queue.pop()
-            visited.add(term)
-            queue.update(set(tid for _, tid in self[term].related_to) -
-                         visited)
+        closure = self.closure
+        visited = set(terms)
+        visited.update(closure.terms_for(
+            closure.descendant_ids_many(closure.indices(terms))))
         return visited
 
     def term_depth(self, term, cache_={}):
@@ -567,6 +606,223 @@ class Ontology(object):
     DownloadOntologyAtRev = download_ontology_at_rev
 
 
+class OntologyClosure(object):
+    """
+    A transitive closure index of the term relations (`is_a` and
+    `relationship` tags) in an :class:`Ontology`.
+
+    Terms are assigned integer ids (their position in the sorted list of
+    term ids) and the direct parents, all ancestors and all descendants of
+    each term are stored as CSR (`indptr`, `indices`) integer arrays. The
+    closures include the term itself.
+
+    :param Ontology ontology: The ontology to index.
+
+    """
+    def __init__(self, ontology):
+        #: Sorted term ids (the integer term id is the position in this list).
+        self.terms = sorted(ontology.terms)
+        self.term_index = dict((t, i) for i, t in enumerate(self.terms))
+        self.alias_mapper = ontology.alias_mapper
+
+        parents = []
+        for term in self.terms:
+            ids = set()
+            for _, parent in ontology.terms[term].related:
+                parent = self.alias_mapper.get(parent, parent)
+                if parent in self.term_index:
+                    ids.add(self.term_index[parent])
+            parents.append(sorted(ids))
+
+        self.parents_indptr, self.parents_indices = _to_csr(parents)
+        ancestors = _closure(parents)
+        self.ancestors_indptr, self.ancestors_indices = _to_csr(ancestors)
+        self.descendants_indptr, self.descendants_indices = \
+            _transpose_csr(self.ancestors_indptr, self.ancestors_indices,
+                           len(self.terms))
+
+    def __len__(self):
+        return len(self.terms)
+
+    def index(self, term):
+        """
+        Return the integer id of `term` (alternative ids are resolved).
+        Raise KeyError if not in the ontology.
+        """
+        try:
+            return self.term_index[term]
+        except KeyError:
+            return self.term_index[self.alias_mapper[term]]
+
+    def indices(self, terms):
+        """
+        Return an integer id array for a sequence of `terms`.
+        """
+        return numpy.array([self.index(t) for t in terms], dtype=numpy.intp)
+
+    def terms_for(self, ids):
+        """
+        Return a list of term ids (strings) for integer `ids`.
+        """
+        return [self.terms[i] for i in ids]
+
+    def parent_ids(self, i):
+        """
+        Return the integer ids of direct parents of term with integer id `i`.
+        """
+        return self.parents_indices[self.parents_indptr[i]:
+                                    self.parents_indptr[i + 1]]
+
+    def ancestor_ids(self, i):
+        """
+        Return the sorted integer ids of all ancestors (including itself) of
+        the term with integer id `i`.
+        """
+        return self.ancestors_indices[self.ancestors_indptr[i]:
+                                      self.ancestors_indptr[i + 1]]
+
+    def descendant_ids(self, i):
+        """
+        Return the sorted integer ids of all descendants (including itself)
+        of the term with integer id `i`.
+        """
+        return self.descendants_indices[self.descendants_indptr[i]:
+                                        self.descendants_indptr[i + 1]]
+
+    def ancestor_ids_many(self, ids):
+        """
+        Return the sorted union of ancestors of all terms in integer `ids`.
+        """
+        return _union_csr(self.ancestors_indptr, self.ancestors_indices, ids)
+
+    def descendant_ids_many(self, ids):
+        """
+        Return the sorted union of descendants of all terms in integer `ids`.
+        """
+        return _union_csr(self.descendants_indptr, self.descendants_indices,
+                          ids)
+
+    def ancestors(self, term):
+        """
+        Return a set of all super terms of `term` (including itself).
+        """
+        return set(self.terms_for(self.ancestor_ids(self.index(term))))
+
+    def descendants(self, term):
+        """
+        Return a set of all sub terms of `term` (including itself).
+        """
+        return set(self.terms_for(self.descendant_ids(self.index(term))))
+
+    def is_ancestor(self, ancestor, term):
+        """
+        Is `ancestor` a super term of `term` (or the `term` itself).
+        """
+        anc = self.ancestor_ids(self.index(term))
+        i = self.index(ancestor)
+        pos = numpy.searchsorted(anc, i)
+        return bool(pos < len(anc) and anc[pos] == i)
+
+    def ancestors_matrix(self, ids=None):
+        """
+        Return a boolean sparse (CSR) matrix with rows for terms in integer
+        `ids` (default all terms) and columns for all terms, marking their
+        ancestors.
+        """
+        return _csr_matrix(self.ancestors_indptr, self.ancestors_indices,
+                           len(self.terms), ids)
+
+    def descendants_matrix(self, ids=None):
+        """
+        Return a boolean sparse (CSR) matrix with rows for terms in integer
+        `ids` (default all terms) and columns for all terms, marking their
+        descendants.
+        """
+        return _csr_matrix(self.descendants_indptr, self.descendants_indices,
+                           len(self.terms), ids)
+
+
+def _to_csr(lists):
+    indptr = numpy.zeros(len(lists) + 1, dtype=numpy.intp)
+    indptr[1:] = numpy.cumsum([len(l) for l in lists])
+    if lists and indptr[-1]:
+        indices = numpy.concatenate(
+            [numpy.asarray(l, dtype=numpy.int32) for l in lists])
+    else:
+        indices = numpy.zeros(0, dtype=numpy.int32)
+    return indptr, indices
+
+
+def _transpose_csr(indptr, indices, n):
+    rows = numpy.repeat(numpy.arange(len(indptr) - 1, dtype=numpy.int32),
+                        numpy.diff(indptr))
+    # stable sort by column keeps the rows (the new indices) sorted
+    order = numpy.argsort(indices, kind="mergesort")
+    t_indptr = numpy.zeros(n + 1, dtype=numpy.intp)
+    t_indptr[1:] = numpy.cumsum(numpy.bincount(indices, minlength=n))
+    return t_indptr, rows[order]
+
+
+def _union_csr(indptr, indices, ids):
+    ids = numpy.asarray(ids, dtype=numpy.intp)
+    if not len(ids):
+        return numpy.zeros(0, dtype=indices.dtype)
+    return numpy.unique(numpy.concatenate(
+        [indices[indptr[i]: indptr[i + 1]] for i in ids]))
+
+
+def _csr_matrix(indptr, indices, n, ids=None):
+    matrix = scipy.sparse.csr_matrix(
+        (numpy.ones(len(indices), dtype=bool), indices, indptr),
+        shape=(len(indptr) - 1, n))
+    if ids is not None:
+        matrix = matrix[numpy.asarray(ids, dtype=numpy.intp)]
+    return matrix
+
+
+def _closure(parents):
+    """
+    Return a list of sorted ancestor lists (including self) given a list of
+    direct parent lists of a DAG (nodes in cycles are resolved with a
+    breadth first search).
+    """
+    n = len(parents)
+    children = [[] for _ in range(n)]
+    pending = [len(p) for p in parents]
+    for i, ps in enumerate(parents):
+        for p in ps:
+            children[p].append(i)
+
+    ancestors = [None] * n
+    queue = [i for i in range(n) if not pending[i]]
+    while queue:
+        i = queue.pop()
+        anc = set([i])
+        for p in parents[i]:
+            anc.update(ancestors[p])
+        ancestors[i] = anc
+        for c in children[i]:
+            pending[c] -= 1
+            if not pending[c]:
+                queue.append(c)
+
+    for i in range(n):
+        if ancestors[i] is None:
+            visited = set()
+            queue = [i]
+            while queue:
+                j = queue.pop()
+                if j in visited:
+                    continue
+                visited.add(j)
+                if ancestors[j] is not None:
+                    visited.update(ancestors[j])
+                else:
+                    queue.extend(parents[j])
+            ancestors[i] = visited
+    return [sorted(a) for a in ancestors]
+
+
 from collections import namedtuple
 
 _AnnotationRecordBase = namedtuple(
@@ -620,6 +876,404 @@ class AnnotationRecord(_AnnotationRecordBase):
         return list(map(intern, self.DB_Object_Synonym.split("|")))
 
 
+class GeneTermMatrix(object):
+    """
+    A sparse gene x term incidence matrix of :class:`Annotations` with the
+    annotations already propagated up the ontology (a gene annotated to
+    a term is also annotated to all of its super terms).
+
+    Enrichment counts for all terms are then computed with a single sparse
+    matrix-vector product per gene set.
+
+    :param Annotations annotations: Annotations.
+    :param Ontology ontology: The ontology used for propagation.
+    :param set evidence_codes:
+        Evidence codes to consider (default all).
+    :param set aspects: Aspects to consider (default all).
+
+    """
+    def __init__(self, annotations, ontology, evidence_codes=None,
+                 aspects=None):
+        evidence_codes = set(evidence_codes or evidenceDict.keys())
+        aspects = set(aspects or ["P", "C", "F"])
+
+        if isinstance(annotations.annotations, AnnotationsSnapshot):
+            genes, rows, direct, cols = _snapshot_incidence(
+                annotations.annotations, evidence_codes, aspects)
+        else:
+            genes, rows, direct, cols = _records_incidence(
+                annotations.annotations, evidence_codes, aspects)
+
+        #: Gene names (DB_Object_Symbol) indexing the matrix rows.
+        self.genes = genes
+        self.gene_index = dict((g, i) for i, g in enumerate(self.genes))
+
+        #: Term ids indexing the matrix columns.
+        self.terms = ontology.closure.terms
+        self.term_index = ontology.closure.term_index
+
+        self.alias_mapper = ontology.alias_mapper
+
+        #: Gene x direct term incidence (no propagation)
+        self.direct = _incidence(rows, cols, (len(self.genes), len(direct)))
+        self.direct_terms = direct
+
+        # direct term x term propagation (transitive closure) matrix.
+        indptr, indices = _to_csr(_direct_term_ancestors(ontology, direct))
+        closure = scipy.sparse.csr_matrix(
+            (numpy.ones(len(indices), dtype=numpy.int32), indices, indptr),
+            shape=(len(direct), len(self.terms)))
+
+        #: Propagated gene x term incidence matrix (CSC).
+        self.matrix = _binarize(self.direct.dot(closure)).tocsc()
+
+    def gene_mask(self, genes):
+        """
+        Return a boolean row mask for `genes` (canonical gene names).
+        """
+        mask = numpy.zeros(len(self.genes), dtype=bool)
+        idx = [self.gene_index[g] for g in genes if g in self.gene_index]
+        mask[idx] = True
+        return mask
+
+    def annotated_terms(self, genes):
+        """
+        Return a list of term ids directly annotated by `genes`.
+        """
+        mask = self.gene_mask(genes)
+        sub = self.direct[numpy.flatnonzero(mask)]
+        return [self.direct_terms[i] for i in numpy.unique(sub.indices)]
+
+    def columns(self, terms):
+        """
+        Return matrix column indices for `terms` (resolving alternative ids).
+        """
+        return numpy.array(
+            [self.term_index[self.alias_mapper.get(t, t)] for t in terms],
+            dtype=numpy.intp)
+
+    def counts(self, mask, columns=None):
+        """
+        Return the number of genes in the row `mask` annotated to each
+        term (optionally only for `columns`).
+        """
+        matrix = self.matrix if columns is None else self.matrix[:, columns]
+        return numpy.asarray(
+            matrix.T.dot(mask.astype(numpy.int32))).ravel()
+
+    def term_genes(self, mask, columns):
+        """
+        Return a list of gene name lists, one for each of the `columns`,
+        with the genes in `mask` annotated to that term.
+        """
+        rows = numpy.flatnonzero(mask)
+        sub = self.matrix[rows][:, columns].tocsc()
+        sub.sort_indices()
+        return [[self.genes[rows[i]]
+                 for i in sub.indices[sub.indptr[j]: sub.indptr[j + 1]]]
+                for j in range(len(columns))]
+
+
+def _records_incidence(records, evidence_codes, aspects):
+    """
+    Return (genes, gene_indices, terms, term_indices) of all `records`
+    (:class:`AnnotationRecord`) with `evidence_codes` and `aspects`.
+    """
+    genes = sorted(set(ann.geneName for ann in records))
+    records = [ann for ann in records
+               if ann.Evidence_Code in evidence_codes and
+               ann.Aspect in aspects]
+    terms = sorted(set(ann.GO_ID for ann in records))
+    gene_index = dict((g, i) for i, g in enumerate(genes))
+    term_index = dict((t, i) for i, t in enumerate(terms))
+    rows = numpy.array([gene_index[ann.geneName] for ann in records],
+                       dtype=numpy.intp)
+    cols = numpy.array([term_index[ann.GO_ID] for ann in records],
+                       dtype=numpy.intp)
+    return genes, rows, terms, cols
+
+
+def _snapshot_incidence(snapshot, evidence_codes, aspects):
+    """
+    Same as :func:`_records_incidence` but working directly on the string
+    codes of an :class:`AnnotationsSnapshot`.
+    """
+    mask = _isin(snapshot.column("Evidence_Code"),
+                 snapshot.codes("Evidence_Code", evidence_codes))
+    mask &= _isin(snapshot.column("Aspect"),
+                  snapshot.codes("Aspect", aspects))
+
+    def index(codes, subset):
+        unique = numpy.unique(codes)
+        names = [snapshot.string(c) for c in unique]
+        order = numpy.argsort(names, kind="mergesort")
+        lookup = numpy.zeros(len(snapshot.offsets), dtype=numpy.intp)
+        lookup[unique[order]] = numpy.arange(len(unique))
+        return [names[i] for i in order], lookup[subset]
+
+    gene_codes = numpy.asarray(snapshot.column("DB_Object_Symbol"))
+    genes, rows = index(gene_codes, gene_codes[mask])
+    term_codes = numpy.asarray(snapshot.column("GO_ID"))[mask]
+    terms, cols = index(term_codes, term_codes)
+    return genes, rows, terms, cols
+
+
+_EnrichmentReference = namedtuple(
+    "_EnrichmentReference",
+    ["matrix", "reference", "ref_mask", "ref_counts", "slims_only"]
+)
+
+
+def _fdr_correct(results, across=False):
+    """
+    FDR correct the p-values in a list of enriched terms dictionaries
+    (either in each dictionary separately or `across` all of them).
+    """
+    if across:
+        groups = [[(i, term, value) for i, res in enumerate(results)
+                   for term, value in res.items()]]
+    else:
+        groups = [[(i, term, value) for term, value in res.items()]
+                  for i, res in enumerate(results)]
+
+    corrected = [{} for _ in results]
+    for group in groups:
+        group = sorted(group, key=lambda item: item[2][1])
+        fdrs = stats.FDR([p for _, _, (_, p, _) in group])
+        for (i, term, (genes, _, ref)), p in zip(group, fdrs):
+            corrected[i][term] = (genes, p, ref)
+    return corrected
+
+
+def _incidence(rows, cols, shape):
+    data = numpy.ones(len(rows), dtype=numpy.int32)
+    return _binarize(scipy.sparse.csr_matrix((data, (rows, cols)),
+                                             shape=shape))
+
+
+def _binarize(matrix):
+    matrix = matrix.tocsr()
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+    return matrix
+
+
+def _direct_term_ancestors(ontology, terms):
+    """
+    Return a list of integer (:class:`OntologyClosure`) id arrays of terms
+    whose annotations include the annotations of the corresponding term in
+    `terms` (i.e. the term itself and all its super terms), mirroring
+    :func:`Annotations.get_all_annotations`.
+    """
+    closure = ontology.closure
+    alt_parent = {}
+    for term_id, alt_ids in six.iteritems(ontology.reverse_alias_mapper):
+        for alt_id in alt_ids:
+            alt_parent.setdefault(alt_id, set()).add(term_id)
+
+    ancestors = []
+    for term in terms:
+        sources = set(alt_parent.get(term, ()))
+        if term in ontology.terms:
+            sources.add(term)
+        ancestors.append(closure.ancestor_ids_many(closure.indices(sources)))
+    return ancestors
+
+
+class AnnotationsSnapshot(object):
+    """
+    A compiled (binary) snapshot of annotation records.
+
+    The snapshot is a directory with a table of all distinct field values
+    (a byte string blob with offsets) and an (records x fields) array of
+    integer codes into that table, all stored as numpy `.npy` files. The
+    arrays are memory mapped on load so processes (e.g. forked workers)
+    share the same pages. :class:`AnnotationRecord` instances are only
+    created when requested.
+
+    :param str path: Path of the snapshot directory.
+    :param str mmap_mode: Passed to :func:`numpy.load`.
+
+    """
+    #: Version of the on disk format.
+    version = 1
+
+    def __init__(self, path, mmap_mode="r"):
+        with open(os.path.join(path, "meta.json"), "rt") as f:
+            meta = json.load(f)
+        if meta.get("version") != self.version:
+            raise ValueError("Unsupported snapshot version %r" %
+                             meta.get("version"))
+        self.path = path
+        #: Version of the annotations this snapshot was compiled from.
+        self.source_version = meta["source_version"]
+        self.header = meta["header"]
+        self.fields = meta["fields"]
+        self._field_index = dict((f, i) for i, f in enumerate(self.fields))
+
+        def load(name):
+            return numpy.load(os.path.join(path, name), mmap_mode=mmap_mode)
+
+        self.codes_array = load("codes.npy")
+        self.offsets = load("offsets.npy")
+        self.strings = load("strings.npy")
+        self._cache = {}
+        self._groups = {}
+
+    @classmethod
+    def compile(cls, records, path, source_version=None, header=""):
+        """
+        Compile `records` (a sequence of :class:`AnnotationRecord`) into
+        a snapshot at `path` and return it.
+        """
+        table = {}
+        blob = []
+        codes = numpy.zeros((len(records), len(annotationFields)),
+                            dtype=numpy.int32)
+        for i, record in enumerate(records):
+            for j, value in enumerate(record):
+                code = table.get(value)
+                if code is None:
+                    code = table[value] = len(blob)
+                    blob.append(value if isinstance(value, bytes)
+                                else value.encode("utf-8"))
+                codes[i, j] = code
+
+        offsets = numpy.zeros(len(blob) + 1, dtype=numpy.int64)
+        offsets[1:] = numpy.cumsum([len(b) for b in blob])
+        strings = numpy.frombuffer(b"".join(blob), dtype=numpy.uint8)
+
+        tmp_path = "%s.tmp%i" % (path, os.getpid())
+        if not os.path.isdir(tmp_path):
+            os.makedirs(tmp_path)
+        numpy.save(os.path.join(tmp_path, "codes.npy"), codes)
+        numpy.save(os.path.join(tmp_path, "offsets.npy"), offsets)
+        numpy.save(os.path.join(tmp_path, "strings.npy"), strings)
+        with open(os.path.join(tmp_path, "meta.json"), "wt") as f:
+            json.dump({"version": cls.version,
+                       "source_version": source_version,
+                       "header": header,
+                       "fields": list(annotationFields)}, f)
+
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.rename(tmp_path, path)
+        return cls(path)
+
+    def __len__(self):
+        return len(self.codes_array)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.record(i) for i in range(*index.indices(len(self)))]
+        return self.record(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.record(i)
+
+    def string(self, code):
+        """
+        Return the (interned) string for `code`.
+        """
+        value = self._cache.get(code)
+        if value is None:
+            value = self.strings[self.offsets[code]:
+                                 self.offsets[code + 1]].tobytes()
+            if not isinstance(value, str):
+                value = value.decode("utf-8")
+            value = self._cache[code] = intern(value)
+        return value
+
+    def codes(self, field, strings):
+        """
+        Return an array of codes of `field` values in `strings`.
+        """
+        strings = set(strings)
+        return numpy.array([c for c in numpy.unique(self.column(field))
+                            if self.string(c) in strings], dtype=numpy.int32)
+
+    def column(self, field):
+        """
+        Return the (memory mapped) code array of `field` for all records.
+        """
+        return self.codes_array[:, self._field_index[field]]
+
+    def unique(self, field):
+        """
+        Return a set of all distinct values of `field`.
+        """
+        return set(self.string(c) for c in numpy.unique(self.column(field)))
+
+    def record(self, i):
+        """
+        Return the i-th record as an :class:`AnnotationRecord`.
+        """
+        return AnnotationRecord._make(
+            [self.string(c) for c in self.codes_array[i]])
+
+    def groups(self, field):
+        """
+        Return a dictionary mapping distinct values of `field` to arrays
+        of indices of records with that value.
+        """
+        if field not in self._groups:
+            column = numpy.asarray(self.column(field))
+            order = numpy.argsort(column, kind="mergesort")
+            unique, start = numpy.unique(column[order], return_index=True)
+            end = numpy.append(start[1:], len(order))
+            self._groups[field] = dict(
+                (self.string(c), order[b:e])
+                for c, b, e in zip(unique, start, end))
+        return self._groups[field]
+
+
+class _SnapshotIndex(defaultdict):
+    """
+    A `defaultdict(list)` of :class:`AnnotationRecord` lists grouped by
+    a `field` of an :class:`AnnotationsSnapshot`, where the records are
+    created on first access of a key.
+    """
+    def __init__(self, snapshot, field):
+        defaultdict.__init__(self, list)
+        self._snapshot = snapshot
+        self._pending = dict(snapshot.groups(field))
+
+    def __missing__(self, key):
+        indices = self._pending.pop(key, ())
+        value = self[key] = [self._snapshot.record(i) for i in indices]
+        return value
+
+    def __contains__(self, key):
+        return defaultdict.__contains__(self, key) or key in self._pending
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def _materialize(self):
+        for key in list(self._pending):
+            self[key]
+
+    def __iter__(self):
+        self._materialize()
+        return defaultdict.__iter__(self)
+
+    def __len__(self):
+        return defaultdict.__len__(self) + len(self._pending)
+
+    def keys(self):
+        self._materialize()
+        return defaultdict.keys(self)
+
+    def values(self):
+        self._materialize()
+        return defaultdict.values(self)
+
+    def items(self):
+        self._materialize()
+        return defaultdict.items(self)
+
+
 class Annotations(object):
     """
     :class:`Annotations` object holds the annotations.
@@ -751,6 +1405,7 @@ class Annotations(object):
         """Set the ontology to use in the annotations mapping.
         """
         self.all_annotations = defaultdict(list)
+        self._gene_term_matrices = {}
         self._ontology = ontology
 
     def get_ontology(self):
@@ -782,11 +1437,62 @@ class Annotations(object):
                 raise obiTaxonomy.UnknownSpeciesIdentifier(org + str(code))
             serverfiles.download("GO", filename)
 
-        return cls(path, ontology=ontology, genematcher=genematcher,
-                   progress_callback=progress_callback)
+        source_version = "%s.%s" % (
+            cls.version, serverfiles.info("GO", filename)["datetime"])
+        snapshot_path = os.path.join(
+            snapshot_buffer_path(), "gene_association.%s" % code)
+        try:
+            snapshot = AnnotationsSnapshot(snapshot_path)
+        except (IOError, OSError, ValueError, KeyError):
+            snapshot = None
+
+        if snapshot is not None and snapshot.source_version == source_version:
+            return cls.from_snapshot(snapshot, ontology=ontology,
+                                     genematcher=genematcher)
+
+        annotations = cls(path, ontology=ontology, genematcher=genematcher,
+                          progress_callback=progress_callback)
+        try:
+            AnnotationsSnapshot.compile(annotations.annotations,
+                                        snapshot_path, source_version,
+                                        annotations.header)
+        except (IOError, OSError) as err:
+            warnings.warn("Could not save the annotations snapshot (%s)" %
+                          err, UserWarning)
+        return annotations
 
     Load = load
 
+    @classmethod
+    def from_snapshot(cls, snapshot, ontology=None, genematcher=None):
+        """Create an :class:`Annotations` instance from a compiled
+        :class:`AnnotationsSnapshot` (or a path to one).
+
+        The annotation records are created lazily, only when they are
+        accessed.
+
+        """
+        if isinstance(snapshot, basestring):
+            snapshot = AnnotationsSnapshot(snapshot)
+        annotations = cls(ontology=ontology)
+        annotations.annotations = snapshot
+        annotations.header = snapshot.header
+        annotations.gene_annotations = \
+            _SnapshotIndex(snapshot, "DB_Object_Symbol")
+        annotations.term_anotations = _SnapshotIndex(snapshot, "GO_ID")
+        annotations.genematcher = genematcher
+        if genematcher:
+            genematcher.set_targets(annotations.gene_names)
+        return annotations
+
+    def compile(self, path, source_version=None):
+        """Compile the annotations into an :class:`AnnotationsSnapshot`
+        at `path` (see :func:`from_snapshot`).
+
+        """
+        return AnnotationsSnapshot.compile(
+            self.annotations, path, source_version, self.header)
+
     def parse_file(self, file, progress_callback=None):
         """Parse and load the annotations from file.
 
@@ -833,10 +1539,14 @@ class Annotations(object):
         if not a.geneName or not a.GOId or a.Qualifier == "NOT":
             return
 
+        if not isinstance(self.annotations, list):
+            # loaded from a snapshot
+            self.annotations = list(self.annotations)
         self.gene_annotations[a.geneName].append(a)
         self.annotations.append(a)
         self.term_anotations[a.GOId].append(a)
         self.all_annotations = defaultdict(list)
+        self._gene_term_matrices = {}
 
         self._gene_names_dict = None
         self._gene_names = None
@@ -853,7 +1563,11 @@ class Annotations(object):
     @property
     def gene_names(self):
         if self._gene_names is None:
-            self._gene_names = set([ann.geneName for ann in self.annotations])
+            if isinstance(self.annotations, AnnotationsSnapshot):
+                self._gene_names = self.annotations.unique("DB_Object_Symbol")
+            else:
+                self._gene_names = set([ann.geneName
+                                        for ann in self.annotations])
         return self._gene_names
 
     @property
@@ -871,35 +1585,29 @@ class Annotations(object):
         to `genes`.
 
         """
-        def alias(gene):
-            if self.genematcher:
-                return self.genematcher.umatch(gene)
-            else:
-                return (gene if gene in self.gene_names
-                        else self.alias_mapper.get(gene, None))
+        genes = list(genes)
+        if self.genematcher:
+            aliases = self.genematcher.umatch_many(genes)
+        else:
+            aliases = [gene if gene in self.gene_names
+                       else self.alias_mapper.get(gene, None)
+                       for gene in genes]
 
-        return dict([(alias(gene), gene) for gene in genes if alias(gene)])
+        return dict([(alias, gene) for alias, gene in zip(aliases, genes)
+                     if alias])
 
     def _collect_annotations(self, id, visited):
-        """ Recursive function collects and caches all annotations for id
+        """ Collect and cache all annotations for id and its sub terms
         """
         if id not in self.all_annotations and id not in visited:
-            if id in self.ontology.reverse_alias_mapper:
-                annotations = [self.term_anotations.get(alt_id, [])
-                               for alt_id in
-                               self.ontology.reverse_alias_mapper[id]] + \
-                              [self.term_anotations[id]]
-            else:
-                ## annotations for this term alone
-                annotations = [self.term_anotations[id]]
             visited.add(id)
-            for typeId, child in self.ontology[id].related_to:
-                aa = self._collect_annotations(child, visited)
-                if type(aa) == set:
-                    ## if it was already reduced in get_all_annotations
-                    annotations.append(aa)
-                else:
-                    annotations.extend(aa)
+            reverse_alias_mapper = self.ontology.reverse_alias_mapper
+            annotations = []
+            for term in self.ontology.closure.descendants(id):
+                annotations.extend(self.term_anotations.get(alt_id, [])
+                                   for alt_id in
+                                   reverse_alias_mapper.get(term, ()))
+                annotations.append(self.term_anotations.get(term, []))
             self.all_annotations[id] = annotations
         return self.all_annotations[id]
 
@@ -938,6 +1646,20 @@ class Annotations(object):
         return list(set([ann.geneName for ann in annotations
                          if ann.Evidence_Code in evidence_codes]))
 
+    def get_gene_term_matrix(self, evidence_codes=None, aspects=None):
+        """ Return a (cached) :class:`GeneTermMatrix` for annotations with
+        `evidence_codes` and `aspects`.
+
+        """
+        self._ensure_ontology()
+        evidence_codes = frozenset(evidence_codes or evidenceDict.keys())
+        aspects = frozenset(aspects or ["P", "C", "F"])
+        key = (evidence_codes, aspects)
+        if key not in self._gene_term_matrices:
+            self._gene_term_matrices[key] = GeneTermMatrix(
+                self, self.ontology, evidence_codes, aspects)
+        return self._gene_term_matrices[key]
+
     def get_enriched_terms(self, genes, reference=None, evidence_codes=None,
                            slims_only=False, aspect=None,
                            prob=stats.Binomial(), use_fdr=True,
@@ -957,8 +1679,62 @@ class Annotations(object):
             or a set containing these elements.
 
         """
-        revGenesDict = self.get_gene_names_translator(genes)
-        genes = set(revGenesDict.keys())
+        state = self._enrichment_reference(reference, evidence_codes,
+                                           slims_only, aspect)
+        res = self._enriched_terms(genes, state, prob, progress_callback)
+        if use_fdr:
+            res = _fdr_correct([res])[0]
+        return res
+
+    def get_enriched_terms_batch(self, gene_lists, reference=None,
+                                 evidence_codes=None, slims_only=False,
+                                 aspect=None, prob=stats.Binomial(),
+                                 use_fdr=True, fdr_across_lists=False,
+                                 n_jobs=1, progress_callback=None):
+        """ Return a list of enriched terms dictionaries (see
+        :func:`get_enriched_terms`), one for each gene list in
+        `gene_lists`.
+
+        The reference gene set, the gene term matrix and the reference
+        counts are computed only once for all the lists.
+
+        :param gene_lists: A list of gene lists.
+        :param bool use_fdr: FDR adjust the p-values.
+        :param bool fdr_across_lists:
+            If `True` the FDR correction is applied over the p-values of
+            all lists together, otherwise for each list separately.
+        :param int n_jobs:
+            Number of worker processes (see
+            :func:`orangecontrib.bio.utils.parallel.parallel_map`).
+
+        The remaining parameters are the same as in
+        :func:`get_enriched_terms`.
+
+        """
+        gene_lists = list(gene_lists)
+        state = self._enrichment_reference(reference, evidence_codes,
+                                           slims_only, aspect)
+
+        def enriched(genes):
+            return self._enriched_terms(genes, state, prob)
+
+        def callback(done):
+            progress_callback(100.0 * done / len(gene_lists))
+
+        results = parallel.parallel_map(
+            enriched, gene_lists, n_jobs=n_jobs,
+            callback=callback if progress_callback else None)
+
+        if use_fdr:
+            results = _fdr_correct(results, across=fdr_across_lists)
+        return results
+
+    def _enrichment_reference(self, reference, evidence_codes, slims_only,
+                              aspect):
+        """ Return the state shared by enrichment of multiple gene lists
+        against a common reference.
+
+        """
         if reference:
             refGenesDict = self.get_gene_names_translator(reference)
             reference = set(refGenesDict.keys())
@@ -973,21 +1749,6 @@ class Annotations(object):
             aspects_set = aspect
 
         evidence_codes = set(evidence_codes or evidenceDict.keys())
-        annotations = [ann
-                       for gene in genes for ann in self.gene_annotations[gene]
-                       if ann.Evidence_Code in evidence_codes and
-                       ann.Aspect in aspects_set]
-
-        refAnnotations = set(
-            [ann
-             for gene in reference for ann in self.gene_annotations[gene]
-             if ann.Evidence_Code in evidence_codes and
-             ann.Aspect in aspects_set]
-        )
-
-        annotationsDict = defaultdict(set)
-        for ann in annotations:
-            annotationsDict[ann.GO_ID].add(ann)
 
         self._ensure_ontology()
         if slims_only and not self.ontology.slims_subset:
@@ -995,7 +1756,18 @@ class Annotations(object):
                           "Using 'goslim_generic' subset", UserWarning)
             self.ontology.set_slims_subset("goslim_generic")
 
-        terms = annotationsDict.keys()
+        matrix = self.get_gene_term_matrix(evidence_codes, aspects_set)
+        ref_mask = matrix.gene_mask(reference)
+        return _EnrichmentReference(
+            matrix=matrix, reference=reference, ref_mask=ref_mask,
+            ref_counts=matrix.counts(ref_mask), slims_only=slims_only)
+
+    def _enriched_terms(self, genes, state, prob, progress_callback=None):
+        revGenesDict = self.get_gene_names_translator(genes)
+        genes = set(revGenesDict.keys())
+        matrix = state.matrix
+
+        terms = matrix.annotated_terms(genes)
         filteredTerms = [term for term in terms if term in self.ontology]
 
         if len(terms) != len(filteredTerms):
@@ -1005,32 +1777,29 @@ class Annotations(object):
                           UserWarning)
 
         terms = self.ontology.extract_super_graph(filteredTerms)
-        res = {}
+        if state.slims_only:
+            terms = [term for term in terms
+                     if term in self.ontology.slims_subset]
+        else:
+            terms = list(terms)
 
+        # Only the genes that are also in the reference are counted.
+        mask = matrix.gene_mask(genes) & state.ref_mask
+
+        columns = matrix.columns(terms)
+        counts = matrix.counts(mask, columns)
+        ref_counts = state.ref_counts[columns]
+        term_genes = matrix.term_genes(mask, columns)
+
+        p_values = stats.p_values(prob, counts, len(state.reference),
+                                  ref_counts, len(genes))
+        res = {}
         milestones = progress_bar_milestones(len(terms), 100)
         for i, term in enumerate(terms):
-            if slims_only and term not in self.ontology.slims_subset:
-                continue
-            allAnnotations = self.get_all_annotations(term).intersection(refAnnotations)
-##            allAnnotations.intersection_update(refAnnotations)
-            allAnnotatedGenes = set([ann.geneName for ann in allAnnotations])
-            mappedGenes = genes.intersection(allAnnotatedGenes)
-
-            if len(reference) > len(allAnnotatedGenes):
-                mappedReferenceGenes = reference.intersection(allAnnotatedGenes)
-            else:
-                mappedReferenceGenes = allAnnotatedGenes.intersection(reference)
-            res[term] = ([revGenesDict[g] for g in mappedGenes],
-                         prob.p_value(len(mappedGenes), len(reference),
-                                      len(mappedReferenceGenes), len(genes)),
-                         len(mappedReferenceGenes))
+            res[term] = ([revGenesDict[g] for g in term_genes[i]],
+                         float(p_values[i]), int(ref_counts[i]))
             if progress_callback and i in milestones:
                 progress_callback(100.0 * i / len(terms))
-        if use_fdr:
-            res = sorted(res.items(), key=lambda x: x[1][1])
-            res = dict([(id, (genes, p, ref))
-                        for (id, (genes, _, ref)), p in
-                        zip(res, stats.FDR([p for _, (_, p, _) in res]))])
         return res
 
     def get_annotated_terms(self, genes, direct_annotation_only=False,
@@ -11,6 +11,8 @@ import Orange
 
 from . import geneset as obiGeneSets
 from .utils.expression import *
+from .utils.enrichment import GeneSetIndex, ranking_statistics, \
+    permuted_labels, permutation_scores, significance, preranked
 from . import gene as obiGene
 
 """
@@ -195,16 +197,14 @@ def gseapval(es, esnull):
     or negative portion of the distribution corresponding to the sign 
     of the observed ES(S).
     """
-    
-    try:
-        if es < 0:
-            return float(len([ a for a in esnull if a <= es ]))/ \
-                len([ a for a in esnull if a < 0])    
-        else: 
-            return float(len([ a for a in esnull if a >= es ]))/ \
-                len([ a for a in esnull if a >= 0])
-    except:
+    esnull = numpy.asarray(esnull, dtype=float)
+    if es < 0:
+        extreme, total = numpy.sum(esnull <= es), numpy.sum(esnull < 0)
+    else: 
+        extreme, total = numpy.sum(esnull >= es), numpy.sum(esnull >= 0)
+    if total == 0:
         return 1.0
+    return float(extreme)/total
 
 
 def enrichmentScore(data, subset, rankingf):
@@ -216,63 +216,80 @@ def enrichmentScore(data, subset, rankingf):
     es,l = enrichmentScoreRanked(subset, lcor, ordered)
     return es,l
 
+def expressionMatrix(data):
+    """
+    Return the expression matrix of data (NaN for unknown values) and
+    indices of class values (-1 for unknown).
+    """
+    X, y = data.toNumpyMA("A/C")
+    X = numpy.ma.filled(X.astype(float), numpy.nan)
+    y = numpy.ma.filled(y.astype(float), -1).astype(int)
+    return X, y
+
 def gseaE(data, subsets, rankingf=None, \
-        n=100, permutation="class", callback=None):
+        n=100, permutation="class", callback=None, block=25, n_jobs=1,
+        early_stopping=None):
     """
     Run GSEA algorithm on an example table.
 
     data: orange example table. 
     subsets: list of distinct subsets of data.
     rankingf: function that returns correlation to class of each 
-        variable.
+        variable. If None (default), "signal_to_noise" or "t", the 
+        rankings for all permutations are computed from the expression
+        matrix.
     n: number of random permutations to sample null distribution.
     permutation: "class" for permutating class, else permutate attribute 
         order.
+    block: number of permutations ranked at once.
+    n_jobs: number of worker processes for permutations (the results
+        do not depend on it). Outside the main thread (e.g. in widgets)
+        the permutations run serially.
+    early_stopping: if set to h, stop permuting a gene set after h of its
+        null scores are as extreme as its ES. The number of permutations
+        used is then added to each result tuple.
 
     """
 
-    if not rankingf:
-        rankingf=rankingFromOrangeMeas(MA_signalToNoise())
+    statistic = None
+    if not rankingf or rankingf in ("signal_to_noise", "t"):
+        statistic = rankingf or "signal_to_noise"
+        if iset(data):
+            X, labels = expressionMatrix(data)
+            rankingf = lambda d: ranking_statistics(X, labels, statistic)[0]
+        else:
+            rankingf = rankingFromOrangeMeas(MA_signalToNoise() \
+                if statistic == "signal_to_noise" else MA_t_test())
+            statistic = None
 
-    enrichmentScores = []
- 
     lcor = rankingf(data)
     #print lcor
 
-    ordered = orderedPointersCorr(lcor)
-
-    def rev(l):
-        return numpy.argsort(l)
-
-    rev2 = rev(ordered)
-
-    for subset in subsets:
-        es = enrichmentScoreRanked(subset, lcor, ordered, rev2=rev2)[0]
-        enrichmentScores.append(es)
+    index = GeneSetIndex(subsets, len(lcor))
+    enrichmentScores = index.enrichment_scores(lcor).tolist()
 
     runOptCallbacks(callback)
 
     #print "PERMUTATION", permutation
 
-    enrichmentNulls = [ [] for a in range(len(subsets)) ]
-
-    for i in range(n):
-
-        if permutation == "class":
-            d2 = shuffleClass(data, 2000+i) #fixed permutation
-            r2 = rankingf(d2)
+    def nullRankings(seeds):
+        if permutation == "class" and statistic:
+            #rank genes for a block of permuted labellings at once
+            return ranking_statistics(X, permuted_labels(labels, seeds), 
+                statistic)
+        elif permutation == "class":
+            return [ rankingf(shuffleClass(data, seed)) for seed in seeds ]
         else:
-            r2 = shuffleList(lcor, random.Random(2000+i))
+            return [ shuffleList(lcor, random.Random(seed)) for seed in seeds ]
 
-        ordered2 = orderedPointersCorr(r2)
-        rev22 = rev(ordered2)
-        for si,subset in enumerate(subsets):
-            esn = enrichmentScoreRanked(subset, r2, ordered2, rev2=rev22)[0]
-            enrichmentNulls[si].append(esn)
+    #fixed permutations (seeds 2000+i)
+    nulls = permutation_scores(index, nullRankings, n, seed=2000, 
+        block=block, n_jobs=n_jobs, 
+        callback=lambda: runOptCallbacks(callback),
+        observed=enrichmentScores, early_stopping=early_stopping)
 
-        runOptCallbacks(callback)
-
-    return gseaSignificance(enrichmentScores, enrichmentNulls)
+    return gseaSignificance(enrichmentScores, nulls.T,
+        permutations=early_stopping is not None)
 
 
 def runOptCallbacks(callback):
@@ -282,108 +299,40 @@ def runOptCallbacks(callback):
         except:
             callback()            
 
-def gseaR(rankings, subsets, n, callback=None):
+def gseaR(rankings, subsets, n, callback=None, n_jobs=1, early_stopping=None):
     """
     """
-    enrichmentScores = []
-    ordered = orderedPointersCorr(rankings)
-    
-    def rev(l):
-        return numpy.argsort(l)
+    index = GeneSetIndex(subsets, len(rankings))
+    enrichmentScores = index.enrichment_scores(rankings).tolist()
 
-    rev2 = rev(ordered)
-
-    for subset in subsets:
-
-        es = enrichmentScoreRanked(subset, rankings, ordered, rev2=rev2)[0]
-        enrichmentScores.append(es)
-    
     runOptCallbacks(callback)
 
-    enrichmentNulls = [ [] for a in range(len(subsets)) ]
+    def nullRankings(seeds):
+        return [ shuffleList(rankings, random.Random(seed)) for seed in seeds ]
 
-    for i in range(n):
-        
-        r2 = shuffleList(rankings, random.Random(2000+i))
-        ordered2 = orderedPointersCorr(r2)
-        rev22 = rev(ordered2)
+    nulls = permutation_scores(index, nullRankings, n, seed=2000, 
+        n_jobs=n_jobs, callback=lambda: runOptCallbacks(callback),
+        observed=enrichmentScores, early_stopping=early_stopping)
 
-        for si,subset in enumerate(subsets):
+    return gseaSignificance(enrichmentScores, nulls.T,
+        permutations=early_stopping is not None)
 
-            esn = enrichmentScoreRanked(subset, r2, ordered2, rev2=rev22)[0]
-            enrichmentNulls[si].append(esn)
-
-        runOptCallbacks(callback)
-
-    return gseaSignificance(enrichmentScores, enrichmentNulls)
-
-
-def gseaSignificance(enrichmentScores, enrichmentNulls):
-
-    #print enrichmentScores
-
-    import time
-
-    tb1 = time.time()
-
-    enrichmentPVals = []
-    nEnrichmentScores = []
-    nEnrichmentNulls = []
-
-    for i in range(len(enrichmentScores)):
-        es = enrichmentScores[i]
-        enrNull = enrichmentNulls[i]
-        #print es, enrNull
-
-        enrichmentPVals.append(gseapval(es, enrNull))
-
-        #normalize the ES(S,pi) and the observed ES(S), separetely rescaling
-        #the positive and negative scores by divident by the mean of the 
-        #ES(S,pi)
-
-        #print es, enrNull
-
-        def normalize(s):
-            try:
-                if s == 0:
-                    return 0.0
-                if s >= 0:
-                    meanPos = mean([a for a in enrNull if a >= 0])
-                    #print s, meanPos
-                    return s/meanPos
-                else:
-                    meanNeg = mean([a for a in enrNull if a < 0])
-                    #print s, meanNeg
-                    return -s/meanNeg
-            except:
-                return 0.0 #return if according mean value is uncalculable
-
-
-        nes = normalize(es)
-        nEnrichmentScores.append(nes)
-        
-        nenrNull = [ normalize(s) for s in enrNull ]
-        nEnrichmentNulls.append(nenrNull)
- 
-
-    #print "First part", time.time() - tb1
-
-    #FDR computation
-    #create a histogram of all NES(S,pi) over all S and pi
-    vals = reduce(lambda x,y: x+y, nEnrichmentNulls, [])
 
+def gseaSignificance(enrichmentScores, enrichmentNulls, permutations=False):
+    """
+    Return a list of (ES, NES, p-value, FDR) tuples for the enrichment
+    scores and their null distributions. If permutations is True, the 
+    number of permutations of each set (length of its null distribution) 
+    is added to the tuples.
 
-    def shorten(l, p=10000):
-        """
-        Take each len(l)/p element, if len(l)/p >= 2.
-        """
-        e = len(l)/p
-        if e <= 1:
-            return l
-        else:
-            return [ l[i] for i in xrange(0, len(l), e) ]
+    enrichmentNulls: a list of null distributions or an array of shape
+        (sets, permutations) with NaN for skipped permutations.
+    """
+    nulls = nullArray(enrichmentNulls, len(enrichmentScores))
 
-    #vals = shorten(vals) -> this can speed up second part. is it relevant TODO?
+    #normalize the ES(S,pi) and the observed ES(S), separetely rescaling
+    #the positive and negative scores by divident by the mean of the 
+    #ES(S,pi)
 
     """
     Use this null distribution to compute an FDR q value, for a given NES(S) =
@@ -393,79 +342,26 @@ def gseaSignificance(enrichmentScores, enrichmentNulls):
     = NES* <= 0.
     """
 
-    nvals = numpy.array(sorted(vals))
-    nnes = numpy.array(sorted(nEnrichmentScores))
-
-    #print "LEN VALS", len(vals), len(nEnrichmentScores)
-
-    fdrs = []
-
-    import operator
-
-    for i in range(len(enrichmentScores)):
-
-        nes = nEnrichmentScores[i]
-
-        """
-        #Strighfoward but slow implementation follows in comments.
-        #Useful as code description.
-        
-        if nes >= 0:
-            op0 = operator.ge
-            opn = operator.ge
-        else:
-            op0 = operator.lt
-            opn = operator.le
-
-        allPos = [a for a in vals if op0(a,0)]
-        allHigherAndPos = [a for a in allPos if opn(a,nes) ]
-
-        nesPos = [a for a in nEnrichmentScores if op0(a,0) ]
-        nesHigherAndPos = [a for a in nesPos if opn(a,nes) ]
+    nes, pvals, fdrs = significance(enrichmentScores, nulls)
 
-        top = len(allHigherAndPos)/float(len(allPos)) #p value
-        down = len(nesHigherAndPos)/float(len(nesPos))
-        
-        l1 = [ len(allPos), len(allHigherAndPos), len(nesPos), len(nesHigherAndPos)]
+    if permutations:
+        return zip(enrichmentScores, nes.tolist(), pvals.tolist(), fdrs.tolist(),
+            (~numpy.isnan(nulls)).sum(axis=1).tolist())
+    return zip(enrichmentScores, nes.tolist(), pvals.tolist(), fdrs.tolist())
 
-        allPos = allHigherAndPos = nesPos =  nesHigherAndPos = 1
-
-        """
 
-        #this could be speed up twice with the same accuracy! 
-        if nes >= 0:
-            allPos = int(len(vals) - numpy.searchsorted(nvals, 0, side="left"))
-            allHigherAndPos = int(len(vals) - numpy.searchsorted(nvals, nes, side="left"))
-            nesPos = len(nnes) - int(numpy.searchsorted(nnes, 0, side="left"))
-            nesHigherAndPos = len(nnes) - int(numpy.searchsorted(nnes, nes, side="left"))
-        else:
-            allPos = int(numpy.searchsorted(nvals, 0, side="left"))
-            allHigherAndPos = int(numpy.searchsorted(nvals, nes, side="right"))
-            nesPos = int(numpy.searchsorted(nnes, 0, side="left"))
-            nesHigherAndPos = int(numpy.searchsorted(nnes, nes, side="right"))
-           
-        """
-        #Comparing results
-        l2 = [ allPos, allHigherAndPos, nesPos, nesHigherAndPos ]
-        diffs = [ l1[i]-l2[i] for i in range(len(l1)) ]
-        sumd = sum( [ abs(a) for a in diffs ] )
-        if sumd > 0:
-            print(nes > 0)
-            print("orig", l1)
-            print("modi", l2)
-        """
-
-        try:
-            top = allHigherAndPos/float(allPos) #p value
-            down = nesHigherAndPos/float(nesPos)
-
-            fdrs.append(top/down)
-        except:
-            fdrs.append(1000000000.0)
-    
-    #print "Whole part", time.time() - tb1
-
-    return zip(enrichmentScores, nEnrichmentScores, enrichmentPVals, fdrs)
+def nullArray(enrichmentNulls, nsets):
+    """
+    Return null distributions as an array of shape (sets, permutations),
+    padded with NaN.
+    """
+    if isinstance(enrichmentNulls, numpy.ndarray):
+        return enrichmentNulls.astype(float).reshape(nsets, -1)
+    length = max([ len(a) for a in enrichmentNulls ] + [0])
+    nulls = numpy.full((nsets, length), numpy.nan)
+    for row, enrNull in zip(nulls, enrichmentNulls):
+        row[:len(enrNull)] = enrNull
+    return nulls
 
 
 def nth(l,n): return [ a[n] for a in l ]
@@ -898,7 +794,7 @@ class GSEA(object):
         for g in obiGeneSets.GeneSets(genesets):
             genes = g.genes
             datamatch = filter(lambda x: x[1] != None, 
-                [ (gene, self.gm.umatch(gene)) for gene in genes])
+                zip(genes, self.gm.umatch_many(genes)))
             self.genesets[g] = datamatch
 
     def selectGenesets(self, minSize=3, maxSize=1000, minPart=0.1):
@@ -930,7 +826,7 @@ class GSEA(object):
         """
         return dict( (gs, self.genesIndices(nth(self.genesets[gs],1))) for gs in gsets)
 
-    def compute(self, minSize=3, maxSize=1000, minPart=0.1, n=100, callback=None, rankingf=None, permutation="class"):
+    def compute(self, minSize=3, maxSize=1000, minPart=0.1, n=100, callback=None, rankingf=None, permutation="class", n_jobs=1, early_stopping=None):
 
         subsetsok = self.selectGenesets(minSize=minSize, maxSize=maxSize, minPart=minPart)
 
@@ -944,10 +840,10 @@ class GSEA(object):
             return {} # quick return if no genesets
 
         if len(itOrFirst(self.data)) > 1:
-            gseal = gseaE(self.data, nth(gsetsnumit,1), n=n, callback=callback, permutation=permutation, rankingf=rankingf)
+            gseal = gseaE(self.data, nth(gsetsnumit,1), n=n, callback=callback, permutation=permutation, rankingf=rankingf, n_jobs=n_jobs, early_stopping=early_stopping)
         else:
             rankings = [ self.data[0][at].native() for at in self.data.domain.attributes ]
-            gseal = gseaR(rankings, nth(gsetsnumit,1), n, callback=None)
+            gseal = gseaR(rankings, nth(gsetsnumit,1), n, callback=None, n_jobs=n_jobs, early_stopping=early_stopping)
 
         res = {}
 
@@ -957,6 +853,7 @@ class GSEA(object):
             rdict['nes'] = gseale[1]
             rdict['p'] = gseale[2]
             rdict['fdr'] = gseale[3]
+            rdict['permutations'] = gseale[4] if len(gseale) > 4 else n
             rdict['size'] = len(gs.genes)
             rdict['matched_size'] = len(self.genesets[gs])
             rdict['genes'] = nth(self.genesets[gs],1)
@@ -965,7 +862,7 @@ class GSEA(object):
         return res
 
 def direct(data, gene_sets, matcher, min_size=3, max_size=1000, min_part=0.1,
-    gene_desc=None, n=100, callback=None):
+    gene_desc=None, n=100, callback=None, n_jobs=1, early_stopping=None):
     """ Gene Set Enrichment analysis for pre-computed correlations
     between genes and phenotypes. 
     
@@ -980,11 +877,13 @@ def direct(data, gene_sets, matcher, min_size=3, max_size=1000, min_part=0.1,
 
     assert len(data.domain.attributes) == 1 or len(data) == 1
     return runGSEA(data, geneSets=gene_sets, matcher=matcher, minSize=min_size, 
-        maxSize=max_size, minPart=min_part, n=n, geneVar=gene_desc, callback=callback)
+        maxSize=max_size, minPart=min_part, n=n, geneVar=gene_desc, callback=callback,
+        n_jobs=n_jobs, early_stopping=early_stopping)
 
 def run(data, gene_sets, matcher, min_size=3, max_size=1000, min_part=0.1,
     at_least=3, phenotypes=None, gene_desc=None, phen_desc=None, n=100, 
-    permutation="phenotype", callback=None, rankingf=None):
+    permutation="phenotype", callback=None, rankingf=None, n_jobs=1,
+    early_stopping=None):
     """ Run Gene Set Enrichment Analysis.
 
     :param Orange.data.Table data: Gene expression data.  
@@ -1004,6 +903,15 @@ def run(data, gene_sets, matcher, min_size=3, max_size=1000, min_part=0.1,
         also in the data set. Default: 0.1.
     :param int at_least: Minimum number of valid gene values for each 
         phenotype (the rest are ignored). Default: 3.
+    :param int n_jobs: Number of worker processes for permutations
+        (-1 for all CPUs). The results do not depend on it. Outside the
+        main thread (e.g. in widgets) the permutations run serially.
+        Default: 1.
+    :param int early_stopping: If set to h, a gene set is not permuted
+        any more after h of its null enrichment scores are as extreme as
+        its ES (Besag and Clifford's sequential p-values). Only the
+        borderline gene sets then use all ``n`` permutations. Default:
+        None (no stopping).
     :param phen_desc: Location of data on phenotypes. By default the
         ``data.domain.class_var`` is used if it exists. If string, the
         corresponding entry from ``attributes`` dictionary of individual
@@ -1023,7 +931,8 @@ def run(data, gene_sets, matcher, min_size=3, max_size=1000, min_part=0.1,
         | fdr: FDR, 
         | size: gene set size,
         | matched_size: genes matched to the data, 
-        | genes: gene names from the data set }
+        | genes: gene names from the data set,
+        | permutations: number of permutations used }
 
     """
     assert len(data.domain.attributes) > 1 or len(data) > 1
@@ -1033,19 +942,19 @@ def run(data, gene_sets, matcher, min_size=3, max_size=1000, min_part=0.1,
     return runGSEA(data, geneSets=gene_sets, matcher=matcher, minSize=min_size, 
         maxSize=max_size, minPart=min_part, n=n, permutation=permutation, 
         geneVar=gene_desc, callback=callback, phenVar=phen_desc, 
-        classValues=phenotypes)
+        classValues=phenotypes, n_jobs=n_jobs, early_stopping=early_stopping)
 
 def runGSEA(data, organism=None, classValues=None, geneSets=None, n=100, 
         permutation="class", minSize=3, maxSize=1000, minPart=0.1, atLeast=3, 
         matcher=None, geneVar=None, phenVar=None, caseSensitive=False, 
-        rankingf=None, callback=None):
+        rankingf=None, callback=None, n_jobs=1, early_stopping=None):
     gso = GSEA(data, organism=organism, matcher=matcher, 
         classValues=classValues, atLeast=atLeast, caseSensitive=caseSensitive,
         geneVar=geneVar, phenVar=phenVar)
     gso.addGenesets(geneSets)
     res1 = gso.compute(n=n, permutation=permutation, minSize=minSize,
         maxSize=maxSize, minPart=minPart, rankingf=rankingf,
-        callback=callback)
+        callback=callback, n_jobs=n_jobs, early_stopping=early_stopping)
     return res1
 
 def etForAttribute(datal,a):
@@ -214,13 +214,17 @@ class Organism(object):
             if callback and i in milestones:
                 callback(50.0 + i * 50.0 / len(genes))
 
-        pItems = allPathways.items()
+        pItems = list(allPathways.items())
 
         for i, (p_id, entry) in enumerate(pItems):
             pathway = pathways_db.get_entry(p_id)
             entry[2].extend(reference.intersection(pathway.gene or []))
-            entry[1] = prob.p_value(len(entry[0]), len(reference),
-                                    len(entry[2]), len(genes))
+
+        p_values = utils.stats.p_values(
+            prob, [len(entry[0]) for _, entry in pItems], len(reference),
+            [len(entry[2]) for _, entry in pItems], len(genes))
+        for (_, entry), p_value in zip(pItems, p_values):
+            entry[1] = float(p_value)
         return dict([(pid, (genes, p, len(ref)))
                      for pid, (genes, p, ref) in allPathways.items()])
 
@@ -8,6 +8,8 @@ import textwrap
 
 from collections import namedtuple
 
+import numpy
+
 try:
     from urllib2 import urlopen
 except ImportError:
@@ -15,7 +17,7 @@ except ImportError:
 
 import six
 
-__all__ = ["Taxonomy"]
+__all__ = ["Taxonomy", "TaxonomySnapshot"]
 
 pjoin = os.path.join
 
@@ -45,15 +47,263 @@ class taxon(_taxon):
     _repr_pretty_ = namedtuple_repr_pretty
 
 
+class TaxonomySnapshot(object):
+    """
+    The taxonomy tree in numpy arrays.
+
+    Parents, ranks and depths of nodes are kept in arrays indexed by
+    node positions (:obj:`index` maps tax ids to positions). Nodes are
+    also numbered in a depth-first (pre-order) traversal of the tree, so
+    that the descendants of a node are the nodes numbered from its
+    :obj:`enter` up to its :obj:`exit`. Lineages, descendant checks,
+    lowest common ancestors and subtrees are thus computed with array
+    lookups.
+
+    :param tax_ids: Tax ids of nodes.
+    :param parent_tax_ids: Tax ids of their parents (roots are their
+        own parents).
+    :param rank_ids: Indices of ranks of nodes into `ranks`.
+    :param list ranks: Names of ranks.
+    """
+    #: Version of the format of saved snapshots.
+    FORMAT_VERSION = "1"
+
+    def __init__(self, tax_ids, parent_tax_ids, rank_ids, ranks,
+                 version=None):
+        tax_ids = numpy.asarray(tax_ids, dtype=numpy.int64)
+        parent_tax_ids = numpy.asarray(parent_tax_ids, dtype=numpy.int64)
+        self.tax_ids = tax_ids
+        self.ranks = list(ranks)
+        self.rank_ids = numpy.asarray(rank_ids, dtype=numpy.int16)
+        self.version = version
+
+        #: Positions of tax ids (-1 for unknown tax ids).
+        self.index = numpy.full(tax_ids.max() + 1 if len(tax_ids) else 1,
+                                -1, dtype=numpy.int32)
+        self.index[tax_ids] = numpy.arange(len(tax_ids), dtype=numpy.int32)
+
+        n = len(tax_ids)
+        parent = self.index[numpy.clip(parent_tax_ids, 0,
+                                       len(self.index) - 1)]
+        parent[(parent_tax_ids >= len(self.index)) |
+               (parent == numpy.arange(n))] = -1
+        #: Positions of parents (-1 for roots).
+        self.parent = parent
+
+        # depths by pointer jumping (distances to 2^k-th ancestors)
+        depth = (parent >= 0).astype(numpy.int64)
+        jump = parent.copy()
+        for _ in range(64):
+            has = numpy.flatnonzero(jump >= 0)
+            if not len(has):
+                break
+            depth[has] += depth[jump[has]]
+            jump[has] = jump[jump[has]]
+        else:
+            raise ValueError("The taxonomy contains cycles")
+        self.depth = depth.astype(numpy.int32)
+
+        # subtree sizes (bottom up) and pre-order numbers (top down)
+        bydepth = numpy.argsort(depth, kind="mergesort")
+        bounds = numpy.searchsorted(depth[bydepth],
+                                    numpy.arange(depth.max() + 2 if n else 0))
+        levels = [bydepth[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+        size = numpy.ones(n, dtype=numpy.int64)
+        for nodes in reversed(levels[1:]):
+            numpy.add.at(size, parent[nodes], size[nodes])
+        enter = numpy.zeros(n, dtype=numpy.int64)
+        for d, nodes in enumerate(levels):
+            par = parent[nodes] if d else numpy.zeros(len(nodes), dtype=int)
+            nodes = nodes[numpy.lexsort((tax_ids[nodes], par))]
+            par = parent[nodes] if d else numpy.zeros(len(nodes), dtype=int)
+            before = numpy.cumsum(size[nodes]) - size[nodes]
+            # sizes of the preceding siblings only
+            first = numpy.ones(len(nodes), dtype=bool)
+            first[1:] = par[1:] != par[:-1]
+            start = numpy.maximum.accumulate(
+                numpy.where(first, numpy.arange(len(nodes)), 0))
+            before -= before[start]
+            enter[nodes] = before + (enter[par] + 1 if d else 0)
+        #: Pre-order numbers of nodes.
+        self.enter = enter
+        #: Ends (exclusive) of pre-order numbers of subtrees.
+        self.exit = enter + size
+        #: Node positions in pre-order.
+        self.order = numpy.empty(n, dtype=numpy.int32)
+        self.order[enter] = numpy.arange(n, dtype=numpy.int32)
+
+    @classmethod
+    def from_db(cls, con, version=None):
+        """Read the tree from the taxonomy database connection."""
+        nodes = numpy.array(
+            con.execute("SELECT tax_id, parent_tax_id, rank_id FROM nodes")
+               .fetchall(), dtype=numpy.int64).reshape(-1, 3)
+        ranks = dict(con.execute("SELECT rank_id, rank FROM ranks"))
+        rank_names = [ranks.get(i) for i in
+                      range(max(ranks) + 1 if ranks else 0)]
+        return cls(nodes[:, 0], nodes[:, 1], nodes[:, 2], rank_names,
+                   version)
+
+    def save(self, filename):
+        """Save the snapshot (the file is replaced atomically)."""
+        fd, tmpname = tempfile.mkstemp(
+            dir=os.path.dirname(filename) or ".", suffix=".tmp")
+        try:
+            parent_tax_ids = numpy.where(self.parent >= 0,
+                                         self.tax_ids[self.parent],
+                                         self.tax_ids)
+            with os.fdopen(fd, "wb") as f:
+                numpy.savez(f, tax_ids=self.tax_ids,
+                            parent_tax_ids=parent_tax_ids,
+                            rank_ids=self.rank_ids,
+                            ranks=numpy.array([r or "" for r in self.ranks]),
+                            meta=numpy.array([self.FORMAT_VERSION,
+                                              str(self.version)]))
+            if os.path.exists(filename):
+                os.remove(filename)
+            os.rename(tmpname, filename)
+        except:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+            raise
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Load a saved snapshot. Return None if there is none or it is in
+        another format.
+        """
+        try:
+            with numpy.load(filename) as f:
+                fmt, version = [str(m) for m in f["meta"]]
+                if fmt != cls.FORMAT_VERSION:
+                    return None
+                return cls(f["tax_ids"], f["parent_tax_ids"], f["rank_ids"],
+                           [str(r) for r in f["ranks"]], version)
+        except (IOError, OSError, KeyError, ValueError):
+            return None
+
+    def positions(self, tax_ids):
+        """Return positions of (string or integer) tax ids (-1 for
+        unknown tax ids)."""
+        def as_int(tax_id):
+            try:
+                return int(tax_id)
+            except (ValueError, TypeError):
+                return -1
+        ids = numpy.array([as_int(t) for t in tax_ids], dtype=numpy.int64)
+        pos = numpy.full(len(ids), -1, dtype=numpy.int32)
+        valid = (ids >= 0) & (ids < len(self.index))
+        pos[valid] = self.index[ids[valid]]
+        return pos
+
+    def _position(self, tax_id):
+        pos = self.positions([tax_id])[0]
+        if pos < 0:
+            raise KeyError(tax_id)
+        return pos
+
+    def __contains__(self, tax_id):
+        return self.positions([tax_id])[0] >= 0
+
+    def __len__(self):
+        return len(self.tax_ids)
+
+    def _tax_id(self, pos):
+        return str(self.tax_ids[pos])
+
+    def parent_tax_id(self, tax_id):
+        parent = self.parent[self._position(tax_id)]
+        return self._tax_id(parent) if parent >= 0 else None
+
+    def rank(self, tax_id):
+        return self.ranks[self.rank_ids[self._position(tax_id)]]
+
+    def lineage(self, tax_id):
+        """Return tax ids of ancestors of `tax_id` from the root down."""
+        pos = self._position(tax_id)
+        ancestors = numpy.empty(self.depth[pos], dtype=numpy.int32)
+        for i in range(len(ancestors) - 1, -1, -1):
+            pos = self.parent[pos]
+            ancestors[i] = pos
+        return [str(t) for t in self.tax_ids[ancestors]]
+
+    def is_descendant(self, tax_ids, ancestor):
+        """
+        Return a boolean array telling which of `tax_ids` are (proper)
+        descendants of `ancestor`. Unknown tax ids are not descendants.
+        """
+        anc = self._position(ancestor)
+        pos = self.positions(tax_ids)
+        enter = self.enter[pos]
+        return (pos >= 0) & (enter > self.enter[anc]) & \
+            (enter < self.exit[anc])
+
+    def lca(self, tax_id1, tax_id2):
+        """Return the lowest common ancestor of two nodes (or None if
+        they are in different trees)."""
+        pos1, pos2 = self._position(tax_id1), self._position(tax_id2)
+        enter2 = self.enter[pos2]
+        while pos1 >= 0 and not (self.enter[pos1] <= enter2 <
+                                 self.exit[pos1]):
+            pos1 = self.parent[pos1]
+        return self._tax_id(pos1) if pos1 >= 0 else None
+
+    def child_tax_ids(self, tax_id):
+        return self.subnodes(tax_id, levels=1)
+
+    def subnodes(self, tax_id, levels=1):
+        """Return tax ids of descendants of `tax_id` at most `levels`
+        levels below it (in pre-order)."""
+        pos = self._position(tax_id)
+        subtree = self.order[self.enter[pos] + 1:self.exit[pos]]
+        subtree = subtree[self.depth[subtree] <= self.depth[pos] + levels]
+        return [str(t) for t in self.tax_ids[subtree]]
+
+
 class Taxonomy(collections.Mapping):
+    """
+    The NCBI taxonomy in an SQLite database.
+
+    :param str taxdb: Database file name.
+    :param bool loaded: Keep the tree in memory (:class:`TaxonomySnapshot`),
+        so that lineages and subtrees are computed without queries. The
+        snapshot is saved next to the database and reused until the
+        database changes.
+    """
     SCHEMA_VERSION = (0, 0, 1)
 
-    def __init__(self, taxdb):
+    def __init__(self, taxdb, loaded=False):
+        self._taxdb = taxdb
+        self._snapshot = None
         self._con = sqlite3.connect(taxdb, timeout=15)
         self._con.execute("""
             CREATE INDEX IF NOT EXISTS
                 index_names_tax_id ON names(tax_id)
         """)
+        if loaded:
+            self.snapshot()
+
+    def snapshot(self):
+        """Return the in-memory :class:`TaxonomySnapshot` (load it if
+        needed)."""
+        if self._snapshot is None:
+            st = os.stat(self._taxdb)
+            version = "%s_%s" % (st.st_mtime, st.st_size)
+            fname = self._taxdb + ".snapshot.npz"
+            snapshot = TaxonomySnapshot.load(fname)
+            if snapshot is None or snapshot.version != version:
+                snapshot = TaxonomySnapshot.from_db(self._con, version)
+                try:
+                    snapshot.save(fname)
+                except (OSError, IOError):
+                    pass
+            self._snapshot = snapshot
+        return self._snapshot
+
+    @property
+    def loaded(self):
+        return self._snapshot is not None
 
     def __node_query(self, tax_id):
         c = self._con.execute("""
@@ -117,6 +367,8 @@ class Taxonomy(collections.Mapping):
         return (str(r[0]) for r in c)
 
     def lineage(self, tax_id):
+        if self._snapshot is not None:
+            return self._snapshot.lineage(tax_id)
         lineage = []
         while True:
             parent = self.parent_tax_id(tax_id)
@@ -131,6 +383,9 @@ class Taxonomy(collections.Mapping):
         if not isinstance(tax_id, six.string_types):
             raise TypeError("Expected a string")
 
+        if self._snapshot is not None:
+            return self._snapshot.parent_tax_id(tax_id)
+
         node = self.__node_query(tax_id)
         _, parent, _ = node
         if parent == int(tax_id):
@@ -143,6 +398,9 @@ class Taxonomy(collections.Mapping):
         if not isinstance(tax_id, six.string_types):
             raise TypeError("Expected a string")
 
+        if self._snapshot is not None:
+            return self._snapshot.child_tax_ids(tax_id)
+
         c = self._con.execute("""
             SELECT tax_id
             FROM nodes
@@ -151,6 +409,40 @@ class Taxonomy(collections.Mapping):
         children = list(str(r[0]) for r in c if r[0] != 1)
         return children
 
+    def subnodes(self, tax_id, levels=1):
+        """Return tax ids of descendants of `tax_id` at most `levels`
+        levels below it (in pre-order, siblings ordered by tax ids)."""
+        if self._snapshot is not None:
+            return self._snapshot.subnodes(tax_id, levels)
+        res = []
+        if levels > 0:
+            for child in sorted(self.child_tax_ids(tax_id), key=int):
+                res.append(child)
+                res.extend(self.subnodes(child, levels - 1))
+        return res
+
+    def is_descendant(self, tax_id, ancestor):
+        """Is `tax_id` a (proper) descendant of `ancestor`?"""
+        if self._snapshot is not None:
+            return bool(self._snapshot.is_descendant([tax_id], ancestor)[0])
+        try:
+            return ancestor in self.lineage(tax_id)
+        except (KeyError, StopIteration):
+            return False
+
+    def lca(self, tax_id1, tax_id2):
+        """Return the lowest common ancestor of two tax ids (or None if
+        they are in different trees)."""
+        if self._snapshot is not None:
+            return self._snapshot.lca(tax_id1, tax_id2)
+        lca = None
+        for a, b in zip(self.lineage(tax_id1) + [tax_id1],
+                        self.lineage(tax_id2) + [tax_id2]):
+            if a != b:
+                break
+            lca = a
+        return lca
+
     def name(self, tax_id):
         return self[tax_id].name
 
@@ -199,7 +199,7 @@ def get_atlas_summary(genes, organism, gene_matcher=None,
         gene_matcher = _cached_default_gene_matcher(organism)
         
     matched, unmatched = [], []
-    for gene, match in zip(genes, map(gene_matcher.umatch, genes)):
+    for gene, match in zip(genes, gene_matcher.umatch_many(genes)):
         if match:
             matched.append(match)
         else:
@@ -179,14 +179,21 @@ def pickled_cache(filename=None, dependencies=[], version=1, maxSize=30,
 
 
 class Taxonomy(object):
+    """
+    The NCBI taxonomy.
+
+    :param bool loaded: Keep the taxonomy tree in memory, so that
+        lineages, subnodes, ranks and descendants are found without
+        database queries (see :class:`ncbi.taxonomy.TaxonomySnapshot`).
+    """
     DOMAIN = "Taxonomy"
     FILENAME = "ncbi-taxonomy.sqlite"
 
-    def __init__(self):
+    def __init__(self, loaded=False):
         from .ncbi.taxonomy import Taxonomy
         # Ensure the taxonomy db is downloaded.
         filename = serverfiles.localpath_download(self.DOMAIN, self.FILENAME)
-        self._tax = Taxonomy(filename)
+        self._tax = Taxonomy(filename, loaded=loaded)
 
     def get_entry(self, id):
         try:
@@ -197,8 +204,7 @@ class Taxonomy(object):
     def search(self, string, onlySpecies=True, exact=False):
         res = self._tax.search(string, exact)
         if onlySpecies:
-            res = [taxid for taxid in res
-                   if self._tax[taxid].rank == "species"]
+            res = [taxid for taxid in res if self.rank(taxid) == "species"]
         return res
 
     def __iter__(self):
@@ -212,17 +218,30 @@ class Taxonomy(object):
                 if q != "scientific name"]
 
     def rank(self, id):
+        if self._tax.loaded:
+            return self._tax.snapshot().rank(id)
         return self._tax[id].rank
 
     def parent(self, id):
+        if self._tax.loaded:
+            # the root is its own parent
+            return self._tax.parent_tax_id(id) or id
         return self._tax[id].parent_tax_id
 
+    def lineage(self, id):
+        """Return a list of taxids from the root to the parent of `id`."""
+        return self._tax.lineage(id)
+
+    def is_descendant(self, id, ancestor):
+        """Is `id` a descendant of `ancestor`?"""
+        return self._tax.is_descendant(id, ancestor)
+
+    def lca(self, id1, id2):
+        """Return the lowest common ancestor of two taxids."""
+        return self._tax.lca(id1, id2)
+
     def subnodes(self, id, levels=1):
-        res = self._tax.child_tax_ids(id)
-        if levels > 1:
-            for child_id in res:
-                res.extend(self.subnodes(child_id, levels - 1))
-        return res
+        return self._tax.subnodes(id, levels)
 
     def taxids(self):
         return list(self._tax)
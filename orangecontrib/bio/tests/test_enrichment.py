@@ -0,0 +1,514 @@
+import random
+import unittest
+import warnings
+
+import numpy
+import scipy.sparse
+import scipy.stats
+
+from orangecontrib.bio.utils import enrichment
+
+
+def running_sum_score(subset, ranking):
+    """Enrichment score by definition (one step per gene)."""
+    subset = set(subset)
+    order = sorted(range(len(ranking)), key=lambda i: -ranking[i])
+    total = sum(abs(ranking[i]) for i in subset)
+    if total == 0:
+        return 0.0
+    miss = -1. / (len(ranking) - len(subset))
+    sums = [0.0]
+    for i in order:
+        sums.append(sums[-1] + (abs(ranking[i]) / total if i in subset
+                                else miss))
+    return max(sums) if abs(max(sums)) > abs(min(sums)) else min(sums)
+
+
+class TestGeneSetIndex(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(42)
+        self.n_genes = 200
+        # rounded to get some ties
+        self.ranking = numpy.round(rng.randn(self.n_genes), 1)
+        self.sets = [rng.randint(0, self.n_genes, size)
+                     for size in rng.randint(1, 40, 50)]
+        self.sets += [[], [3, 3, 5], list(range(20))]
+
+    def test_index(self):
+        index = enrichment.GeneSetIndex(self.sets, self.n_genes)
+        self.assertEqual(len(index), len(self.sets))
+        for i, s in enumerate(self.sets):
+            genes = index.indices[index.indptr[i]:index.indptr[i + 1]]
+            self.assertEqual(list(genes), sorted(set(s)))
+        self.assertEqual(list(index.sizes[-3:]), [0, 2, 20])
+
+    def test_enrichment_scores(self):
+        index = enrichment.GeneSetIndex(self.sets, self.n_genes)
+        scores = index.enrichment_scores(self.ranking)
+        self.assertEqual(scores.shape, (len(self.sets),))
+        # equal up to rounding (the totals are summed in a different order)
+        for s, score in zip(self.sets, scores):
+            self.assertAlmostEqual(
+                score, running_sum_score(s, list(self.ranking)), places=12)
+
+        # a small block size processes the sets in many blocks
+        positions = enrichment.ranked_positions(self.ranking)
+        keys = index.set_ids * self.n_genes + positions[index.indices]
+        set_positions = numpy.sort(keys) - index.set_ids * self.n_genes
+        weights = numpy.abs(self.ranking[
+            enrichment.ranked_order(self.ranking)])[set_positions]
+        blocked = enrichment.running_sum_scores(
+            index.indptr, set_positions, weights, self.n_genes, max_block=10)
+        numpy.testing.assert_array_equal(blocked, scores)
+
+    def test_zero_weights(self):
+        ranking = self.ranking.copy()
+        ranking[:30] = 0.
+        sets = [list(range(5)), list(range(3, 40)), []]
+        index = enrichment.GeneSetIndex(sets, self.n_genes)
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            scores = index.enrichment_scores(ranking)
+        self.assertEqual(scores[0], 0)
+        self.assertAlmostEqual(scores[1], running_sum_score(sets[1], ranking))
+
+    def test_permutation_scores(self):
+        index = enrichment.GeneSetIndex(self.sets, self.n_genes)
+
+        def null_rankings(seeds):
+            return [numpy.random.RandomState(seed).permutation(self.ranking)
+                    for seed in seeds]
+
+        res = []
+        for n_jobs in [1, 3]:
+            progress = []
+            res.append(enrichment.permutation_scores(
+                index, null_rankings, 23, block=5, n_jobs=n_jobs,
+                callback=lambda: progress.append(1)))
+            self.assertEqual(len(progress), 23)
+        self.assertEqual(res[0].shape, (23, len(self.sets)))
+        numpy.testing.assert_array_equal(res[0], res[1])
+        numpy.testing.assert_array_equal(
+            res[0][7], index.enrichment_scores(null_rankings([2007])[0]))
+
+        empty = enrichment.permutation_scores(index, null_rankings, 0)
+        self.assertEqual(empty.shape, (0, len(self.sets)))
+
+    def test_early_stopping(self):
+        index = enrichment.GeneSetIndex(self.sets, self.n_genes)
+        observed = index.enrichment_scores(self.ranking)
+
+        def null_rankings(seeds):
+            return [numpy.random.RandomState(seed).permutation(self.ranking)
+                    for seed in seeds]
+
+        full = enrichment.permutation_scores(index, null_rankings, 60,
+                                             block=7)
+        res = []
+        for n_jobs in [1, 3]:
+            progress = []
+            res.append(enrichment.permutation_scores(
+                index, null_rankings, 60, block=7, n_jobs=n_jobs,
+                callback=lambda: progress.append(1), observed=observed,
+                early_stopping=3))
+            self.assertEqual(len(progress), 60)
+        numpy.testing.assert_array_equal(res[0], res[1])
+
+        stopped = 0
+        for obs, null, expected in zip(observed, res[0].T, full.T):
+            used = int(numpy.sum(~numpy.isnan(null)))
+            numpy.testing.assert_array_equal(null[:used], expected[:used])
+            self.assertTrue(numpy.all(numpy.isnan(null[used:])))
+            extreme = expected >= obs if obs >= 0 else expected <= obs
+            if used < 60:
+                stopped += 1
+                self.assertEqual(extreme[:used].sum(), 3)
+                self.assertTrue(extreme[used - 1])
+            else:
+                self.assertLessEqual(extreme[:-1].sum(), 2)
+        self.assertGreater(stopped, 0)
+
+    def test_take(self):
+        index = enrichment.GeneSetIndex(self.sets, self.n_genes)
+        sub = index.take([5, 2, 51])
+        self.assertEqual(len(sub), 3)
+        for i, j in enumerate([5, 2, 51]):
+            self.assertEqual(
+                list(sub.indices[sub.indptr[i]:sub.indptr[i + 1]]),
+                list(index.indices[index.indptr[j]:index.indptr[j + 1]]))
+        numpy.testing.assert_array_equal(
+            sub.enrichment_scores(self.ranking),
+            index.enrichment_scores(self.ranking)[[5, 2, 51]])
+
+    def test_ranked_order(self):
+        ranking = [0.5, 1.0, 0.5, -1.0]
+        self.assertEqual(list(enrichment.ranked_order(ranking)),
+                         [1, 0, 2, 3])
+        self.assertEqual(list(enrichment.ranked_positions(ranking)),
+                         [1, 0, 2, 3])
+
+
+def signal_to_noise(a, b):
+    def stdevm(x):
+        m = numpy.mean(x)
+        return max(numpy.std(x, ddof=1), 0.2 * abs(1.0 if m == 0 else m))
+    return (numpy.mean(a) - numpy.mean(b)) / (stdevm(a) + stdevm(b))
+
+
+class TestRankingStatistics(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(0)
+        self.X = rng.randn(12, 40) + 8
+        self.X[:, :3] = 0.01 * rng.randn(12, 3)
+        self.X[rng.rand(12, 40) < 0.1] = numpy.nan
+        self.labels = numpy.array([0] * 6 + [1] * 5 + [2])
+
+    def group_values(self, labels, gene, group):
+        x = self.X[labels == group, gene]
+        return x[~numpy.isnan(x)]
+
+    def test_statistics(self):
+        labels = enrichment.permuted_labels(self.labels, range(2000, 2005))
+        snr = enrichment.ranking_statistics(self.X, labels)
+        t = enrichment.ranking_statistics(self.X, labels, "t")
+        self.assertEqual(snr.shape, (5, 40))
+        for i, l in enumerate(labels):
+            for gene in range(40):
+                a = self.group_values(l, gene, 0)
+                b = self.group_values(l, gene, 1)
+                if len(a) > 1 and len(b) > 1:
+                    self.assertAlmostEqual(snr[i, gene],
+                                           signal_to_noise(a, b))
+                self.assertAlmostEqual(
+                    t[i, gene], scipy.stats.ttest_ind(a, b)[0])
+
+        self.assertRaises(ValueError, enrichment.ranking_statistics,
+                          self.X, self.labels, "f")
+
+    def test_missing_group(self):
+        snr = enrichment.ranking_statistics(self.X, [0] * 11 + [1])
+        self.assertTrue(numpy.all(snr == 0))
+
+    def test_undefined_signal_to_noise(self):
+        labels = numpy.array([0] * 10 + [1] * 2)
+        X = self.X.copy()
+        X[10, :5] = numpy.nan  # a single value in the second group
+        X[10:, 5] = numpy.nan  # no values
+        snr = enrichment.ranking_statistics(X, labels)[0]
+        undefined = enrichment.ranking_statistics(
+            X, labels, keep_undefined=True)[0]
+        self.X = X
+        # MA_signalToNoise gives NaN for groups with less than two values
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            expected = [signal_to_noise(self.group_values(labels, g, 0),
+                                        self.group_values(labels, g, 1))
+                        for g in range(X.shape[1])]
+        for gene in range(X.shape[1]):
+            if numpy.isnan(expected[gene]):
+                self.assertEqual(snr[gene], 0)
+                self.assertTrue(numpy.isnan(undefined[gene]))
+            else:
+                self.assertAlmostEqual(snr[gene], expected[gene])
+                self.assertAlmostEqual(undefined[gene], expected[gene])
+        self.assertTrue(numpy.all(numpy.isnan(expected[:6])))
+
+    def test_permuted_labels(self):
+        labels = enrichment.permuted_labels(self.labels, [2000, 2001])
+        for seed, row in zip([2000, 2001], labels):
+            locations = list(range(len(self.labels)))
+            random.Random(seed).shuffle(locations)
+            expected = [None] * len(self.labels)
+            for i, location in enumerate(locations):
+                expected[location] = self.labels[i]
+            self.assertEqual(list(row), expected)
+
+
+class TestSignificance(unittest.TestCase):
+    def test_significance(self):
+        scores = [0.5, -0.4, 0.0, 0.2]
+        nulls = numpy.array([[0.1, 0.6, -0.2, 0.3],
+                             [-0.5, -0.1, 0.2, numpy.nan],
+                             [0.1, -0.1, numpy.nan, numpy.nan],
+                             [0.0, 0.0, -0.3, 0.4]])
+        nes, p, fdr = enrichment.significance(scores, nulls)
+
+        # nominal p-values on the part of the null with the same sign
+        numpy.testing.assert_almost_equal(p, [1. / 3, 1. / 2, 1. / 1, 1. / 3])
+        # scores rescaled by the mean positive or negative null score
+        numpy.testing.assert_almost_equal(
+            nes, [0.5 / (1. / 3), -0.4 / 0.3, 0.0, 0.2 / (0.4 / 3)])
+
+        null_nes = [[0.3, 1.8, -1.0, 0.9], [-5. / 3, -1. / 3, 1.0],
+                    [1.0, -1.0], [0.0, 0.0, -1.0, 3.0]]
+        null_nes = numpy.array(sum(null_nes, []))
+        for s, q in zip(nes, fdr):
+            if s >= 0:
+                null_pos = null_nes[null_nes >= 0]
+                obs_pos = nes[nes >= 0]
+                top = numpy.mean(null_pos >= s)
+                down = numpy.mean(obs_pos >= s)
+            else:
+                null_neg = null_nes[null_nes < 0]
+                obs_neg = nes[nes < 0]
+                top = numpy.mean(null_neg <= s)
+                down = numpy.mean(obs_neg <= s)
+            self.assertAlmostEqual(q, top / down)
+
+    def test_degenerate(self):
+        nes, p, fdr = enrichment.significance([0.3, -0.2], numpy.zeros((2, 0)))
+        numpy.testing.assert_array_equal(p, [1.0, 1.0])
+        numpy.testing.assert_array_equal(nes, [0.0, 0.0])
+        numpy.testing.assert_array_equal(fdr, [1000000000.0] * 2)
+
+
+class TestPreranked(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(1)
+        self.ranking = rng.randn(500)
+        self.ranking[:10] += 3
+        self.sets = [numpy.arange(10)] + \
+            [rng.choice(500, 20, replace=False) for _ in range(20)]
+
+    def test_preranked(self):
+        es, nes, p, fdr = enrichment.preranked(self.ranking, self.sets, n=200)
+        index = enrichment.GeneSetIndex(self.sets, len(self.ranking))
+        numpy.testing.assert_array_equal(
+            es, index.enrichment_scores(self.ranking))
+        for a in [nes, p, fdr]:
+            self.assertEqual(a.shape, (len(self.sets),))
+        # the set of the top genes
+        self.assertEqual(p[0], 0)
+        self.assertGreater(nes[0], nes[1:].max())
+
+        # CSR arrays and parallel workers give the same results
+        res = enrichment.preranked(self.ranking, (index.indptr, index.indices),
+                                   n=200, n_jobs=2, block=30)
+        for a, b in zip(res, [es, nes, p, fdr]):
+            numpy.testing.assert_array_equal(a, b)
+
+    def test_random_positions(self):
+        rng = numpy.random.RandomState(0)
+        for k, n in [(0, 10), (5, 10), (30, 100), (99, 100)]:
+            positions = enrichment.random_positions(rng, k, n)
+            self.assertEqual(len(positions), k)
+            self.assertEqual(len(set(positions)), k)
+            self.assertTrue(numpy.all((positions >= 0) & (positions < n)))
+
+
+def ttest(a, b):
+    """t-score of a gene as MA_t_test (0 if scipy fails)."""
+    try:
+        return float(scipy.stats.ttest_ind(a, b)[0])
+    except Exception:
+        return 0.0
+
+
+def sample_std(x):
+    """Standard deviation as statc.std (None for too few values)."""
+    if len(x) < 2:
+        return None
+    m = sum(x) / float(len(x))
+    return (sum((v - m) ** 2 for v in x) / (len(x) - 1.)) ** 0.5
+
+
+class TestClassStatistics(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(1)
+        # small integers and groups of 4 samples keep sums exact, so that
+        # tied genes have exactly tied statistics
+        self.X = rng.randint(-5, 6, size=(8, 12)).astype(float)
+        self.labels = numpy.array([0] * 4 + [1] * 4)
+        self.X[:, 1] = self.X[[1, 0, 3, 2, 7, 6, 5, 4], 0]  # tied with 0
+        self.X[:, 2] = 3.  # no variance
+        self.X[:, 3] = [1.] * 4 + [2.] * 4  # no variance within groups
+        self.X[:4, 4] = numpy.nan  # no values in the first group
+        self.X[:3, 5] = numpy.nan  # a single value in the first group
+        self.X[:, 6] = self.X[:, 0] + 1  # tied with 0 and 1
+        self.X[:, 7] = -self.X[:, 0]
+        self.X[5, 8] = numpy.nan
+
+    def values(self, gene, group):
+        x = self.X[self.labels == group, gene]
+        return list(x[~numpy.isnan(x)])
+
+    def test_tscores(self):
+        t = enrichment.ranking_statistics(self.X, self.labels, "t",
+                                          keep_undefined=True)[0]
+        with numpy.errstate(all="ignore"):
+            for gene in range(12):
+                expected = ttest(self.values(gene, 0), self.values(gene, 1))
+                if numpy.isfinite(expected):
+                    self.assertAlmostEqual(t[gene], expected)
+                else:
+                    self.assertTrue(numpy.isnan(t[gene]) and numpy.isnan(expected)
+                                    or t[gene] == expected)
+        self.assertEqual(t[0], t[1])
+        self.assertTrue(numpy.isnan(t[2]))
+        self.assertEqual(t[3], -numpy.inf)
+
+    def test_gaussians(self):
+        gaussians = enrichment.class_gaussians(self.X, self.labels)
+        self.assertEqual(gaussians.shape, (12, 4))
+        for gene in range(12):
+            a, b = self.values(gene, 0), self.values(gene, 1)
+            mi1 = numpy.mean(a) if a else None
+            mi2 = numpy.mean(b) if b else None
+            st1, st2 = sample_std(a), sample_std(b)
+            if st1 == 0 or st2 == 0:
+                st1 = st2 = sample_std(a + b)
+            for v, e in zip(gaussians[gene], [mi1, st1, mi2, st2]):
+                if e is None:
+                    self.assertTrue(numpy.isnan(v))
+                else:
+                    self.assertAlmostEqual(v, e)
+
+    def corg_baseline(self, inds):
+        """CORGs with per-gene t-scores and activity scores of samples."""
+        tscores = [ttest(self.values(i, 0), self.values(i, 1)) for i in inds]
+        sortedinds = [i for i, _ in sorted(zip(inds, tscores),
+                                           key=lambda x: x[1],
+                                           reverse=bool(numpy.mean(tscores) >= 0))]
+
+        def S(corg):
+            scores = [sum(0.0 if numpy.isnan(v) else v for v in row[corg]) /
+                      len(corg) ** 0.5 for row in self.X]
+            scores = numpy.array(scores)
+            return abs(ttest(scores[self.labels == 0], scores[self.labels == 1]))
+
+        g, bg = S(sortedinds[:1]), 1
+        for a in range(2, len(sortedinds) + 1):
+            tg = S(sortedinds[:a])
+            if tg > g:
+                g, bg = tg, a
+            else:
+                break
+        return sortedinds[:bg]
+
+    def test_corg_genes(self):
+        rng = numpy.random.RandomState(2)
+        sets = [[0, 1, 6], [0, 7, 1], [2, 3, 0], [3, 2], [5, 8, 9, 10, 11],
+                [9, 10, 11, 0, 1]]
+        sets += [list(rng.choice([0, 3, 5, 7, 8, 9, 10, 11], 4, replace=False))
+                 for _ in range(20)]
+        with numpy.errstate(all="ignore"):
+            for inds in sets:
+                self.assertEqual(
+                    enrichment.corg_genes(self.X, self.labels, inds),
+                    self.corg_baseline(inds))
+
+
+class TestSetScores(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(0)
+        self.X = rng.randn(15, 30)
+        self.X[rng.rand(15, 30) < 0.15] = numpy.nan
+        self.X[3] = self.X[4]
+        self.labels = numpy.array([0] * 7 + [1] * 7 + [2])
+        # a gene can be counted twice
+        self.sets = [[0, 1, 2, 2], [7], []] + \
+            [list(rng.choice(30, 8, replace=False)) for _ in range(5)]
+        genes = sum(self.sets, [])
+        sets = sum([[i] * len(s) for i, s in enumerate(self.sets)], [])
+        self.membership = scipy.sparse.coo_matrix(
+            (numpy.ones(len(genes)), (genes, sets)),
+            shape=(30, len(self.sets)))
+
+    def known(self, row, genes):
+        values = self.X[row, genes]
+        return values[~numpy.isnan(values)]
+
+    def test_means_medians(self):
+        means = enrichment.set_means(self.X, self.membership)
+        medians = enrichment.set_medians(self.X, self.membership)
+        self.assertEqual(means.shape, (15, len(self.sets)))
+        for i in range(15):
+            for j, genes in enumerate(self.sets):
+                values = self.known(i, genes)
+                if len(values):
+                    self.assertAlmostEqual(means[i, j], numpy.mean(values))
+                    self.assertAlmostEqual(medians[i, j],
+                                           numpy.median(values))
+                else:
+                    self.assertTrue(numpy.isnan(means[i, j]))
+                    self.assertTrue(numpy.isnan(medians[i, j]))
+
+    def test_correlation_scores(self):
+        for exclude_same in [False, True]:
+            scores = enrichment.set_correlation_scores(
+                self.X, self.labels, self.X[:6], self.membership,
+                exclude_same=exclude_same)
+            self.assertEqual(scores.shape, (6, len(self.sets)))
+            for i in range(6):
+                for j, genes in enumerate(self.sets[3:], 3):
+                    cors = [[], []]
+                    for k in range(14):
+                        a, b = self.X[k, genes], self.X[i, genes]
+                        common = ~numpy.isnan(a) & ~numpy.isnan(b)
+                        same = numpy.all(numpy.isnan(a) == numpy.isnan(b)) \
+                            and numpy.all(a[common] == b[common])
+                        if exclude_same and same:
+                            continue
+                        cors[self.labels[k]].append(
+                            numpy.corrcoef(a[common], b[common])[0, 1])
+                    self.assertAlmostEqual(
+                        scores[i, j], scipy.stats.ttest_ind(*cors)[0])
+
+    def test_degenerate_correlation_scores(self):
+        X = numpy.random.RandomState(1).randn(9, 6)
+        X[:, 0] = 2.  # a constant gene
+        X[:, 1] = 2.  # samples without variance on set 0
+        sets = [[0, 1], [0], [0, 2, 3], [2, 3, 4, 5]]
+        membership = scipy.sparse.csc_matrix(
+            [[float(g in s) for s in sets] for g in range(6)])
+        # with a single member of a class
+        for labels in [numpy.array([0] * 8 + [1]),
+                       numpy.array([0] * 7 + [1, 2]),
+                       numpy.array([0] * 4 + [1] * 5)]:
+            scores = enrichment.set_correlation_scores(X, labels, X[:3],
+                                                       membership)
+            for i in range(3):
+                for j, genes in enumerate(sets):
+                    cors = [[], []]
+                    for k in range(9):
+                        if labels[k] < 2:
+                            with numpy.errstate(all="ignore"):
+                                cors[labels[k]].append(numpy.corrcoef(
+                                    X[k, genes], X[i, genes])[0, 1]
+                                    if len(genes) > 1 else numpy.nan)
+                    with numpy.errstate(all="ignore"):
+                        t = scipy.stats.ttest_ind(*cors)[0]
+                    self.assertAlmostEqual(scores[i, j],
+                                           t if numpy.isfinite(t) else 0.0)
+        self.assertTrue(numpy.all(scores[:, :2] == 0))
+
+    def test_no_unknowns(self):
+        X = numpy.random.RandomState(2).randn(10, 8)
+        labels = numpy.array([0] * 5 + [1] * 5)
+        membership = scipy.sparse.csc_matrix(
+            [[1., 0.], [1., 0.], [1., 0.], [0., 1.], [0., 1.], [0., 1.],
+             [0., 1.], [0., 0.]])
+        default = enrichment.set_correlation_scores(X, labels, X, membership)
+        self.assertTrue(numpy.all(default != 0))
+        numpy.testing.assert_array_equal(
+            enrichment.set_correlation_scores(X, labels, X, membership,
+                                              no_unknowns=True),
+            default)
+        X[2, 0] = X[7, 3] = numpy.nan
+        scores = enrichment.set_correlation_scores(X, labels, X, membership,
+                                                   no_unknowns=True)
+        # learning samples with unknown values of set genes are left out
+        rows = [0, 1, 3, 4, 5, 6, 7, 8, 9]
+        known = enrichment.set_correlation_scores(
+            X[rows], labels[rows], X[rows], membership)
+        numpy.testing.assert_allclose(scores[rows, 0], known[:, 0])
+        self.assertEqual(scores[2, 0], 0)
+        rows = [0, 1, 2, 3, 4, 5, 6, 8, 9]
+        known = enrichment.set_correlation_scores(
+            X[rows], labels[rows], X[rows], membership)
+        numpy.testing.assert_allclose(scores[rows, 1], known[:, 1])
+        self.assertEqual(scores[7, 1], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
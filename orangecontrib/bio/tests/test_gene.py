@@ -0,0 +1,327 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from orangecontrib.bio import gene
+
+ALIASES = [set(["BRCA1", "672", "RNF53"]), set(["TP53", "7157", "p53"]),
+           set(["TP53BP1", "7158", "p53BP1"]), set(["X1", "p53"])]
+
+
+class Aliases(gene.MatcherAliasesPickled):
+    version = "v1"
+    created = 0
+
+    def filename(self):
+        return "test_aliases"
+
+    def create_aliases_version(self):
+        return self.version
+
+    def create_aliases(self):
+        Aliases.created += 1
+        return ALIASES
+
+
+class TestAliasIndex(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = gene.gene_matcher_path
+        gene.gene_matcher_path = self.dir
+        Aliases.created = 0
+        Aliases.version = "v1"
+
+    def tearDown(self):
+        gene.gene_matcher_path = self.path
+        shutil.rmtree(self.dir)
+
+    def test_match(self):
+        targets = ["brca1", "7157", "X1", "TP53BP1"]
+        expected = gene.MatcherAliases(ALIASES).set_targets(targets)
+        m = Aliases().set_targets(targets)
+        for g in ["BRCA1", "rnf53", "p53", "P53", "7158", "none"]:
+            self.assertEqual(sorted(m.match(g)), sorted(expected.match(g)))
+            self.assertEqual(m.umatch(g), expected.umatch(g))
+        self.assertEqual(m.explain("RNF53"), [(["brca1"], ALIASES[0])])
+        self.assertEqual(Aliases.created, 1)
+
+        # the index is reused ...
+        Aliases().set_targets(targets)
+        self.assertEqual(Aliases.created, 1)
+        self.assertEqual(Aliases().aliases, ALIASES)
+        self.assertEqual(Aliases.created, 1)
+
+        # ... until the version changes
+        Aliases.version = "v2"
+        Aliases().set_targets(targets)
+        self.assertEqual(Aliases.created, 2)
+
+    def test_case(self):
+        m = Aliases(ignore_case=False).set_targets(["TP53", "X1"])
+        self.assertEqual(m.match("tp53"), [])
+        self.assertEqual(sorted(m.match("p53")), ["TP53", "X1"])
+        m = Aliases().set_targets(["TP53"])
+        self.assertEqual(m.match("tp53"), ["TP53"])
+        self.assertEqual(Aliases.created, 2)
+
+    def test_joined(self):
+        other = [set(["p53BP1", "53BP1"])]
+
+        class Other(Aliases):
+            def filename(self):
+                return "test_other"
+
+            def create_aliases(self):
+                return other
+
+        m = gene.matcher([[Aliases(), Other()]], direct=False)
+        m.set_targets(["TP53BP1"])
+        self.assertEqual(m.umatch("53bp1"), "TP53BP1")
+
+        joined = gene.MatcherAliasesPickledJoined([Aliases(), Other()])
+        mo = joined.set_targets(["TP53BP1", "X1"])
+        self.assertEqual(mo.explain("53BP1"),
+                         [(["TP53BP1"], ALIASES[2] | other[0])])
+        self.assertEqual(sorted(map(sorted, joined.aliases)),
+                         sorted(map(sorted, gene.join_sets_l(
+                             [ALIASES, other], lower=True))))
+        self.assertTrue(os.path.exists(joined._joined_filename()))
+
+        # saved joined groups are reused
+        fn = joined._joined_filename()
+        os.utime(fn, (0, 0))
+        joined = gene.MatcherAliasesPickledJoined([Aliases(), Other()])
+        self.assertEqual(joined.set_targets(["TP53BP1"]).umatch("7158"),
+                         "TP53BP1")
+        self.assertEqual(os.path.getmtime(fn), 0)
+
+    def test_joined_aliases(self):
+        sources = [[set(["A", "b"]), set(["C"])],
+                   [set(["a", "D"]), set(["b", "E"]), set(["F"])]]
+        joined = gene.JoinedAliases.build(sources, ignore_case=True)
+        groups = [joined.group(i, [lambda i, k=k: sources[k][i]
+                                   for k in range(2)])
+                  for i in range(len(joined))]
+        self.assertEqual(sorted(map(sorted, groups)),
+                         sorted(map(sorted, gene.join_sets_l(sources, True))))
+        self.assertEqual(joined.joined_ids(1, [2]),
+                         set(i for i, g in enumerate(groups) if "F" in g))
+
+        path = os.path.join(self.dir, "joined.npz")
+        joined.version = "v1"
+        joined.save(path)
+        loaded = gene.JoinedAliases.load(path)
+        self.assertEqual(loaded.version, "v1")
+        self.assertEqual(loaded.components.tolist(),
+                         joined.components.tolist())
+
+
+class Suffix(gene.Match):
+    def __init__(self, suffix):
+        self.suffix = suffix
+
+    def match(self, g):
+        return [g + self.suffix]
+
+
+class TestMatchMany(unittest.TestCase):
+    def setUp(self):
+        gene.match_cache.clear()
+
+    def test_match_many(self):
+        targets = ["brca1", "TP53", "X1", "TP53BP1"]
+        m = gene.matcher([gene.MatcherAliases(ALIASES)])
+        m.set_targets(targets)
+        genes = ["BRCA1", "tp53", "p53", "7158", "none", "tp53"]
+        matches = m.match_many(genes)
+        self.assertEqual([sorted(x) for x in matches],
+                         [sorted(m.match(g)) for g in genes])
+        self.assertEqual(m.umatch_many(genes),
+                         [m.umatch(g) for g in genes])
+        self.assertEqual(m.umatch_many(genes),
+                         ["brca1", "TP53", None, "TP53BP1", None, "TP53"])
+        # results are copies
+        matches[0].append("X")
+        self.assertEqual(m.match_many(["BRCA1"]), [["brca1"]])
+
+    def test_cache(self):
+        calls = []
+
+        class Counting(gene.Match):
+            def match(self, g):
+                calls.append(g)
+                return [g.upper()]
+
+        m = Counting()
+        self.assertEqual(m.umatch_many(["a", "b", "a"]), ["A", "B", "A"])
+        self.assertEqual(calls, ["a", "b"])
+        self.assertEqual(m.umatch_many(["b", "c"]), ["B", "C"])
+        self.assertEqual(calls, ["a", "b", "c"])
+        # a different match object does not share results
+        Counting().match_many(["a"])
+        self.assertEqual(calls, ["a", "b", "c", "a"])
+
+        m.cache = None
+        m.match_many(["a"])
+        self.assertEqual(calls, ["a", "b", "c", "a", "a"])
+
+    def test_pickled_tokens(self):
+        m = Suffix("1")
+        self.assertEqual(m.umatch_many(["a"]), ["a1"])
+        # an unpickled matcher (e.g. in another process) keeps its token,
+        # which must not be given to new matchers
+        tokens = set([m._cache_token()])
+        for i in range(20):
+            tokens.add(Suffix(str(i))._cache_token())
+        self.assertEqual(len(tokens), 21)
+        loaded = pickle.loads(pickle.dumps(m))
+        self.assertEqual(loaded._cache_token(), m._cache_token())
+        gene.match_cache.clear()
+        other = Suffix("2")
+        self.assertNotEqual(other._cache_token(), loaded._cache_token())
+        self.assertEqual(loaded.umatch_many(["a"]), ["a1"])
+        self.assertEqual(other.umatch_many(["a"]), ["a2"])
+
+    def test_lru(self):
+        cache = gene.LRUCache(maxsize=2)
+        cache.update([("a", 1), ("b", 2)])
+        self.assertEqual(cache.get_many(["a", "c"]), {"a": 1})
+        cache.update([("c", 3)])
+        self.assertNotIn("b", cache)
+        self.assertEqual(cache.get_many(["a", "b", "c"]), {"a": 1, "c": 3})
+        self.assertEqual(len(cache), 2)
+
+
+GENE_INFO = """\
+#tax_id\tGeneID\tSymbol\tLocusTag\tSynonyms\tdbXrefs\tchromosome\tmap_location\tdescription\ttype\tSymbol_from_nomenclature_authority\tFull_name_from_nomenclature_authority\tNomenclature_status\tOther_designations\tModification_date
+9606\t672\tBRCA1\t-\tRNF53|BRCC1\tHGNC:1100\t17\t17q21\tBRCA1, DNA repair associated\tprotein-coding\tBRCA1\tBRCA1, DNA repair associated\tO\t-\t20150101
+9606\t7157\tTP53\t-\tp53\t-\t17\t17p13.1\ttumor protein p53\tprotein-coding\tTP53\ttumor protein p53\tO\tcellular tumor antigen p53\t20150101
+"""
+
+
+class TestGeneInfoIndex(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = gene.gene_matcher_path
+        gene.gene_matcher_path = self.dir
+        self.fname = os.path.join(self.dir, "gene_info.9606.db")
+        with open(self.fname, "w") as f:
+            f.write(GENE_INFO)
+
+    def tearDown(self):
+        gene.gene_matcher_path = self.path
+        shutil.rmtree(self.dir)
+
+    def test_infos(self):
+        info = gene.NCBIGeneInfo.load(self.fname)
+        self.assertEqual(sorted(info.keys()), ["672", "7157"])
+        self.assertEqual(len(info), 2)
+        self.assertIn("672", info)
+        self.assertNotIn("1", info)
+
+        brca1 = info["672"]
+        self.assertEqual(brca1.symbol, "BRCA1")
+        self.assertEqual(brca1.synonyms, ["RNF53", "BRCC1"])
+        self.assertIsNone(brca1.locus_tag)
+        self.assertEqual(repr(brca1), GENE_INFO.splitlines()[1])
+        self.assertRaises(KeyError, lambda: info["1"])
+
+        tp53, none = info.infos(["7157", "1"], columns=["symbol", "synonyms"])
+        self.assertIsNone(none)
+        self.assertEqual(tp53.symbol, "TP53")
+        self.assertEqual(tp53.synonyms, ["p53"])
+        self.assertRaises(AttributeError, lambda: tp53.description)
+
+        bysymbol = info.infos_by_symbol(["TP53", "X"], columns=["gene_id"])
+        self.assertEqual([i.gene_id for i in bysymbol["TP53"]], ["7157"])
+        self.assertNotIn("X", bysymbol)
+
+        info["1"] = brca1
+        self.assertEqual(info["1"].symbol, "BRCA1")
+        self.assertEqual(len(info), 3)
+        self.assertEqual(sorted(k for k, _ in info.items()), ["1", "672", "7157"])
+
+    def test_ncbi_aliases(self):
+        info = gene.NCBIGeneInfo.load(self.fname)
+        queries = []
+        records = info._index.records
+
+        def counted(ids, columns=None):
+            queries.append(list(ids))
+            return records(ids, columns)
+
+        info._index.records = counted
+        NCBIGeneInfo = gene.NCBIGeneInfo
+        gene.NCBIGeneInfo = lambda *args, **kwargs: info
+        try:
+            aliases = gene.MatcherAliasesNCBI.__new__(gene.MatcherAliasesNCBI)
+            aliases.organism = "9606"
+            res = aliases.create_aliases()
+        finally:
+            gene.NCBIGeneInfo = NCBIGeneInfo
+        self.assertEqual(sorted(map(sorted, res)),
+                         [["672", "BRCA1", "BRCC1", "RNF53"],
+                          ["7157", "TP53", "p53"]])
+        self.assertEqual(len(queries), 1)
+
+    def test_rebuild(self):
+        index = gene.NCBIGeneInfo.info_index(self.fname)
+        self.assertEqual(len(index), 2)
+        with open(self.fname, "a") as f:
+            f.write("9606\t1\tA1BG\n")
+        index = gene.NCBIGeneInfo.info_index(self.fname)
+        self.assertEqual(len(index), 3)
+        record = index.records(["1"], ["symbol", "description"])["1"]
+        self.assertEqual(record, ("A1BG", "-"))
+
+
+GENE_HISTORY = """\
+#tax_id\tGeneID\tDiscontinued_GeneID\tDiscontinued_Symbol\tDiscontinue_Date
+9606\t-\t5\tA\t20050101
+9606\t7157\t10\tB\t20050101
+9606\t10\t20\tC\t20040101
+9606\t20\t30\tD\t20030101
+9606\t672\t40\tE\t20030101
+"""
+
+
+class TestGeneHistoryIndex(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = gene.gene_matcher_path
+        gene.gene_matcher_path = self.dir
+        self.fname = os.path.join(self.dir, "gene_history.9606.db")
+        with open(self.fname, "w") as f:
+            f.write(GENE_HISTORY)
+
+    def tearDown(self):
+        gene.gene_matcher_path = self.path
+        shutil.rmtree(self.dir)
+
+    def test_resolve(self):
+        index = gene.NCBIGeneInfo.load_history_index(self.fname)
+        self.assertEqual(len(index), 5)
+        ids = [30, 20, 10, 5, 40, 7157, 1]
+        self.assertEqual(index.resolve(ids).tolist(),
+                         [7157, 7157, 7157, -1, 672, 7157, 1])
+        self.assertEqual(index.resolve(ids, chain=False).tolist(),
+                         [20, 10, 7157, -1, 672, 7157, 1])
+
+        # the saved index is reused until the file changes
+        index = gene.NCBIGeneInfo.load_history_index(self.fname)
+        self.assertEqual(len(index), 5)
+        with open(self.fname, "a") as f:
+            f.write("9606\t1\t50\tF\t20010101\n")
+        index = gene.NCBIGeneInfo.load_history_index(self.fname)
+        self.assertEqual(index.resolve([50]).tolist(), [1])
+
+        info = gene.NCBIGeneInfo.__new__(gene.NCBIGeneInfo)
+        info._history_index = index
+        self.assertEqual(info.resolve_ids(["30", "5", "672", "X"]),
+                         ["7157", None, "672", "X"])
+
+
+if __name__ == "__main__":
+    unittest.main()
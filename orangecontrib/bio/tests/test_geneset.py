@@ -0,0 +1,227 @@
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import six
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from orangecontrib.bio import geneset
+from orangecontrib.bio.geneset import store
+
+
+def genesets():
+    return geneset.GeneSets([
+        geneset.GeneSet(id="GO:1", name="a", genes=["A", "B", "C"],
+                        hierarchy=("GO", "biological_process"),
+                        organism="9606", link="http://a"),
+        geneset.GeneSet(id="GO:2", name="b", genes=["B"],
+                        hierarchy=("GO", "molecular_function"),
+                        organism="9606"),
+        geneset.GeneSet(id="GO:3", name="c", genes=["C", "D", "E", "F"],
+                        hierarchy=("GO", "biological_process"),
+                        organism="9606", description="desc"),
+    ])
+
+
+class TestGeneSetStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = store.GeneSetStore(os.path.join(self.dir, "gs.sqlite"))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.dir)
+
+    def test_load(self):
+        gs = genesets()
+        self.store.add(gs)
+        self.assertEqual(self.store.load(), gs)
+        self.assertEqual(
+            set(g.id for g in self.store.load(("GO", "biological_process"))),
+            set(["GO:1", "GO:3"]))
+        self.assertEqual(len(self.store.load(("GO",), "9606")), 3)
+        self.assertEqual(len(self.store.load(("GO",), "10090")), 0)
+        self.assertEqual(len(self.store.load(("KEGG",))), 0)
+        self.assertEqual(set(self.store.ids(min_size=2, max_size=3)),
+                         set(["GO:1"]))
+        loaded = self.store.load(ids=["GO:3"])
+        self.assertEqual(list(loaded), [g for g in gs if g.id == "GO:3"])
+        self.assertEqual(
+            sorted(self.store.hierarchies()),
+            [(("GO", "biological_process"), "9606", 2),
+             (("GO", "molecular_function"), "9606", 1)])
+
+    def test_containing(self):
+        self.store.add(genesets())
+        self.assertEqual(
+            dict((g, sorted(ids)) for g, ids in
+                 self.store.containing(["B", "C", "X"]).items()),
+            {"B": ["GO:1", "GO:2"], "C": ["GO:1", "GO:3"]})
+        self.assertEqual(self.store.overlaps(["A", "B", "C", "C", "X"]),
+                         {"GO:1": 3, "GO:2": 1, "GO:3": 1})
+        self.assertEqual(
+            self.store.overlaps(["A", "B", "C"], min_size=2),
+            {"GO:1": 3, "GO:3": 1})
+
+    def test_many_ids(self):
+        gs = geneset.GeneSets()
+        for i in range(1200):
+            gs.add(geneset.GeneSet(id="S:%d" % i, name=str(i),
+                                   genes=["G%d" % i, "G%d" % (i + 1)],
+                                   hierarchy=("S",), organism="9606"))
+        self.store.add(gs)
+        ids = ["S:%d" % i for i in range(0, 1200, 2)] + \
+            ["X:%d" % i for i in range(1000)]
+        self.assertEqual(set(g.id for g in self.store.load(ids=ids)),
+                         set(ids[:600]))
+        self.assertEqual(len(self.store.ids(ids=ids + ids)), 600)
+        self.assertEqual(sorted(self.store.ids(ids=ids[::-1])),
+                         sorted(ids[:600]))
+        self.assertEqual(self.store.ids(ids=[]), [])
+        genes = ["G%d" % i for i in range(1201)]
+        overlaps = self.store.overlaps(genes, ids=ids)
+        self.assertEqual(overlaps, dict((i, 2) for i in ids[:600]))
+        loaded = dict((g.id, g) for g in self.store.load(ids=ids))
+        self.assertEqual(loaded["S:4"].genes, set(["G4", "G5"]))
+        paths = [os.path.join(self.dir, str(i)) for i in range(1200)]
+        self.assertEqual(len(self.store.load(paths=paths, ids=ids)), 0)
+
+    def test_sync_file(self):
+        fname = os.path.join(self.dir, geneset.filename(("GO",), "9606"))
+        with open(fname, "wb") as f:
+            pickle.dump(genesets(), f)
+        self.store.sync_file(fname)
+        self.store.sync_file(fname)
+        self.assertEqual(self.store.load(paths=[fname]), genesets())
+
+        # a changed file is imported again
+        with open(fname, "wb") as f:
+            pickle.dump(geneset.GeneSets(list(genesets())[:1]), f)
+        os.utime(fname, (0, 0))
+        self.store.sync_file(fname)
+        self.assertEqual(len(self.store.load()), 1)
+
+    def test_load_fn(self):
+        for gs in genesets().split_by_hierarchy():
+            fname = geneset.filename(gs.common_hierarchy(), gs.common_org())
+            with open(os.path.join(self.dir, fname), "wb") as f:
+                pickle.dump(gs, f)
+
+        def list_files():
+            return [geneset.filename_parse(fn) + (True,)
+                    for fn in os.listdir(self.dir)
+                    if geneset.is_genesets_file(fn)]
+
+        def get_file(h, o):
+            return os.path.join(self.dir, geneset.filename(h, o))
+
+        loaded = geneset.load_fn(("GO",), "9606", list_files, get_file)
+        self.assertEqual(loaded, genesets())
+        loaded = geneset.load_fn(("GO",), "9606", list_files, get_file,
+                                 min_size=3)
+        self.assertEqual(set(g.id for g in loaded), set(["GO:1", "GO:3"]))
+        self.assertTrue(os.path.exists(os.path.join(self.dir, store.FILENAME)))
+        self.assertRaises(geneset.NoGenesetsException, geneset.load_fn,
+                          ("KEGG",), "9606", list_files, get_file)
+
+
+class TestGeneSetsIndex(unittest.TestCase):
+    def test_index(self):
+        gs = genesets()
+        byid = dict((g.id, g) for g in gs)
+        index = gs.gene_index()
+        self.assertIs(gs.gene_index(), index)
+        self.assertEqual(sorted(g.id for g in index["C"]), ["GO:1", "GO:3"])
+        self.assertEqual(index["X"], [])
+        self.assertEqual(
+            dict((g, sorted(s.id for s in sets)) for g, sets in
+                 index.containing(["A", "B", "X"]).items()),
+            {"A": ["GO:1"], "B": ["GO:1", "GO:2"]})
+        self.assertEqual(index.overlaps(["C", "D", "B", "X", "D"]),
+                         {byid["GO:1"]: 2, byid["GO:2"]: 1, byid["GO:3"]: 2})
+        self.assertEqual(index.overlaps([]), {})
+
+        # the index is rebuilt when gene sets change
+        gs.add(geneset.GeneSet(id="K", name="k", genes=["X"]))
+        self.assertEqual([g.id for g in gs.gene_index()["X"]], ["K"])
+
+        # and is not pickled
+        gs2 = pickle.loads(pickle.dumps(gs))
+        self.assertEqual(gs2, gs)
+        self.assertFalse(hasattr(gs2, "_gene_index"))
+
+
+GMT = """\
+set1\tfirst [http://example.com/1]\tA\tB\tC
+set2\tsecond\tB\tD\t
+
+set3\tthird\tA\tB\tC\tD\tE
+"""
+
+GMX = """\
+set1\tset2\tset3
+first [http://example.com/1]\tsecond\tthird
+A\tB\tA
+B\tD\tB
+C\t\tC
+\t\tD
+\t\tE
+"""
+
+
+class TestGMT(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def check(self, gs, name):
+        byid = dict((g.id, g) for g in gs)
+        self.assertEqual(sorted(byid), ["set1", "set2", "set3"])
+        self.assertEqual(byid["set1"].genes, set(["A", "B", "C"]))
+        self.assertEqual(byid["set2"].genes, set(["B", "D"]))
+        self.assertEqual(byid["set1"].description, "first")
+        self.assertEqual(byid["set1"].link, "http://example.com/1")
+        self.assertEqual(byid["set2"].hierarchy, ("Custom", name))
+        # gene names are shared between gene sets
+        b1 = [g for g in byid["set1"].genes if g == "B"][0]
+        b3 = [g for g in byid["set3"].genes if g == "B"][0]
+        self.assertIs(b1, b3)
+
+    def test_gmt(self):
+        fname = os.path.join(self.dir, "sets.gmt")
+        with open(fname, "w") as f:
+            f.write(GMT)
+        self.check(geneset.load_gmt(fname), fname)
+        self.check(geneset.collections(fname), fname)
+
+        old = geneset.loadGMT(GMT, "x")
+        new = geneset.load_gmt(io.BytesIO(GMT.encode("utf-8")), name="x")
+        self.assertEqual(set((g.id, g.description, g.link) for g in old),
+                         set((g.id, g.description, g.link) for g in new))
+
+    def test_gzip_gmx(self):
+        fname = os.path.join(self.dir, "sets.gmx.gz")
+        with gzip.open(fname, "wb") as f:
+            f.write(GMX.encode("utf-8"))
+        self.check(geneset.load_gmt(fname), fname)
+        with open(fname, "rb") as f:
+            self.check(geneset.load_gmt(gzip.GzipFile(fileobj=f),
+                                        name="gmx", format="gmx"), "gmx")
+
+    def test_size_filter(self):
+        it = geneset.iter_gmt(io.StringIO(six.text_type(GMT)),
+                              min_size=3, max_size=4)
+        self.assertEqual([g.id for g in it], ["set1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
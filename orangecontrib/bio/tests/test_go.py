@@ -0,0 +1,183 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from six import StringIO
+
+from orangecontrib.bio import go
+
+
+ONTOLOGY = """\
+format-version: 1.2
+
+[Term]
+id: GO:0000001
+name: root
+namespace: biological_process
+
+[Term]
+id: GO:0000002
+name: a
+namespace: biological_process
+is_a: GO:0000001 ! root
+
+[Term]
+id: GO:0000003
+name: b
+namespace: biological_process
+is_a: GO:0000001 ! root
+
+[Term]
+id: GO:0000004
+name: c
+namespace: biological_process
+is_a: GO:0000002 ! a
+is_a: GO:0000003 ! b
+
+"""
+
+ANNOTATIONS = [
+    ("G1", "GO:0000004", "IDA"),
+    ("G2", "GO:0000002", "IEA"),
+    ("G3", "GO:0000003", "IDA"),
+    ("G4", "GO:0000001", "IDA"),
+    ("G5", "GO:0000004", "IEA"),
+]
+
+
+def annotation_line(gene, term, evidence):
+    fields = ["DB", gene, gene, "", term, "ref", evidence, "", "P", "",
+              "", "protein", "taxon:9606", "20000101", "DB", "", ""]
+    return "\t".join(fields)
+
+
+class TestGeneTermMatrix(unittest.TestCase):
+    def setUp(self):
+        self.ontology = go.Ontology(StringIO(ONTOLOGY))
+        self.annotations = go.Annotations(ontology=self.ontology)
+        self.annotations.extend(annotation_line(*a) for a in ANNOTATIONS)
+
+    def test_propagation(self):
+        matrix = self.annotations.get_gene_term_matrix()
+        mask = matrix.gene_mask(matrix.genes)
+        counts = dict(zip(matrix.terms, matrix.counts(mask)))
+        self.assertEqual(counts, {"GO:0000001": 5, "GO:0000002": 3,
+                                  "GO:0000003": 3, "GO:0000004": 2})
+
+        columns = matrix.columns(["GO:0000003"])
+        genes = matrix.term_genes(mask, columns)[0]
+        self.assertEqual(sorted(genes), ["G1", "G3", "G5"])
+
+    def test_evidence(self):
+        matrix = self.annotations.get_gene_term_matrix(evidence_codes=["IDA"])
+        counts = dict(zip(matrix.terms,
+                          matrix.counts(matrix.gene_mask(matrix.genes))))
+        self.assertEqual(counts["GO:0000001"], 3)
+        self.assertEqual(counts["GO:0000002"], 1)
+
+    def test_enriched_terms(self):
+        res = self.annotations.get_enriched_terms(
+            ["G1", "G2"], use_fdr=False)
+        self.assertEqual(set(res), {"GO:0000001", "GO:0000002",
+                                    "GO:0000003", "GO:0000004"})
+        genes, p, ref = res["GO:0000002"]
+        self.assertEqual(sorted(genes), ["G1", "G2"])
+        self.assertEqual(ref, 3)
+        self.assertAlmostEqual(p, go.stats.Binomial().p_value(2, 5, 3, 2))
+
+        genes, _, ref = res["GO:0000003"]
+        self.assertEqual(genes, ["G1"])
+        self.assertEqual(ref, 3)
+
+    def test_enriched_terms_batch(self):
+        lists = [["G1", "G2"], ["G3"], ["G4", "G5"]]
+        expected = [self.annotations.get_enriched_terms(genes)
+                    for genes in lists]
+        for n_jobs in [1, 2]:
+            res = self.annotations.get_enriched_terms_batch(
+                lists, n_jobs=n_jobs)
+            self.assertEqual(len(res), len(lists))
+            for r, e in zip(res, expected):
+                self.assertEqual(set(r), set(e))
+                for term in r:
+                    self.assertEqual(sorted(r[term][0]), sorted(e[term][0]))
+                    self.assertEqual(r[term][1:], e[term][1:])
+
+        raw = self.annotations.get_enriched_terms_batch(lists, use_fdr=False)
+        pooled = self.annotations.get_enriched_terms_batch(
+            lists, fdr_across_lists=True)
+        p_values = sorted((p, i, term) for i, r in enumerate(raw)
+                          for term, (_, p, _) in r.items())
+        fdr = go.stats.FDR([p for p, _, _ in p_values])
+        for (_, i, term), q in zip(p_values, fdr):
+            self.assertAlmostEqual(pooled[i][term][1], q)
+
+    def test_snapshot(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, "snapshot")
+        self.annotations.compile(path, "v1")
+
+        loaded = go.Annotations.from_snapshot(path, ontology=self.ontology)
+        self.assertIsInstance(loaded.annotations, go.AnnotationsSnapshot)
+        self.assertEqual(loaded.annotations.source_version, "v1")
+        self.assertEqual(list(loaded), list(self.annotations))
+        self.assertEqual(loaded.gene_names, self.annotations.gene_names)
+        self.assertEqual(loaded.gene_annotations["G1"],
+                         self.annotations.gene_annotations["G1"])
+        self.assertEqual(loaded.gene_annotations["G9"], [])
+
+        res = loaded.get_enriched_terms(["G1", "G2"], use_fdr=False)
+        expected = self.annotations.get_enriched_terms(
+            ["G1", "G2"], use_fdr=False)
+        self.assertEqual(set(res), set(expected))
+        for term in res:
+            self.assertEqual(sorted(res[term][0]), sorted(expected[term][0]))
+            self.assertEqual(res[term][1:], expected[term][1:])
+
+        loaded.add_annotation(annotation_line("G9", "GO:0000002", "IDA"))
+        self.assertEqual(len(loaded), len(ANNOTATIONS) + 1)
+        self.assertIn("G9", loaded.gene_names)
+
+    def test_enriched_terms_reference(self):
+        res = self.annotations.get_enriched_terms(
+            ["G1", "G2"], reference=["G1", "G3", "G4"], use_fdr=False)
+        # G2 is not in the reference
+        genes, _, ref = res["GO:0000002"]
+        self.assertEqual(genes, ["G1"])
+        self.assertEqual(ref, 1)
+        self.assertEqual(res["GO:0000001"][2], 3)
+
+
+class TestOntologyClosure(unittest.TestCase):
+    def setUp(self):
+        self.ontology = go.Ontology(StringIO(ONTOLOGY))
+
+    def test_closure(self):
+        closure = self.ontology.closure
+        self.assertEqual(closure.ancestors("GO:0000004"),
+                         {"GO:0000001", "GO:0000002", "GO:0000003",
+                          "GO:0000004"})
+        self.assertEqual(closure.descendants("GO:0000003"),
+                         {"GO:0000003", "GO:0000004"})
+        self.assertTrue(closure.is_ancestor("GO:0000001", "GO:0000004"))
+        self.assertTrue(closure.is_ancestor("GO:0000002", "GO:0000002"))
+        self.assertFalse(closure.is_ancestor("GO:0000004", "GO:0000001"))
+        self.assertFalse(closure.is_ancestor("GO:0000002", "GO:0000003"))
+
+        matrix = closure.ancestors_matrix(closure.indices(["GO:0000002"]))
+        self.assertEqual(closure.terms_for(matrix.indices),
+                         ["GO:0000001", "GO:0000002"])
+
+    def test_graphs(self):
+        self.assertEqual(self.ontology.extract_super_graph("GO:0000002"),
+                         {"GO:0000001", "GO:0000002"})
+        self.assertEqual(self.ontology.extract_sub_graph(["GO:0000002"]),
+                         {"GO:0000002", "GO:0000004"})
+
+        self.ontology.set_slims_subset(["GO:0000001", "GO:0000003"])
+        self.assertEqual(self.ontology.slims_for_term("GO:0000004"),
+                         {"GO:0000001", "GO:0000003"})
+        self.assertEqual(self.ontology.slims_for_term("GO:0000003"),
+                         {"GO:0000003"})
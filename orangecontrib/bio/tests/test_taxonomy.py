@@ -1,8 +1,13 @@
 import os
 import unittest
 import errno
+import io
+import shutil
+import tarfile
+import tempfile
 
 from orangecontrib.bio import taxonomy
+from orangecontrib.bio.ncbi import taxonomy as ncbi_taxonomy
 from orangecontrib.bio.utils import serverfiles
 
 
@@ -50,3 +55,97 @@ class TestTaxonomy(unittest.TestCase):
         lineage = tax._tax.lineage("9606")
         self.assertEqual(lineage[0], "1")
         self.assertEqual(lineage[-1], "9605")
+
+
+NODES = [("1", "1", "no rank"), ("2", "1", "superkingdom"),
+         ("10", "2", "genus"), ("11", "10", "species"),
+         ("12", "10", "species"), ("20", "1", "superkingdom"),
+         ("21", "20", "species"), ("13", "11", "subspecies")]
+
+
+class TestTaxonomySnapshot(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        archive = os.path.join(self.dir, "taxdump.tar.gz")
+        files = {
+            "nodes.dmp": "".join("\t|\t".join(node) + "\t|\n"
+                                 for node in NODES),
+            "names.dmp": "".join("%s\t|\tname %s\t|\t\t|\tscientific name\t|\n"
+                                 % (node[0], node[0]) for node in NODES)
+        }
+        with tarfile.open(archive, "w:gz") as tar:
+            for name, content in files.items():
+                data = content.encode("utf-8")
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        self.db = os.path.join(self.dir, "taxonomy.sqlite")
+        ncbi_taxonomy.Taxonomy.initialize(self.db, archive)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_loaded(self):
+        tax = ncbi_taxonomy.Taxonomy(self.db)
+        loaded = ncbi_taxonomy.Taxonomy(self.db, loaded=True)
+        self.assertTrue(loaded.loaded)
+        for tax_id, _, _ in NODES:
+            self.assertEqual(loaded.lineage(tax_id), tax.lineage(tax_id))
+            self.assertEqual(loaded.parent_tax_id(tax_id),
+                             tax.parent_tax_id(tax_id))
+            self.assertEqual(sorted(loaded.child_tax_ids(tax_id)),
+                             sorted(tax.child_tax_ids(tax_id)))
+        self.assertEqual(loaded.lineage("13"), ["1", "2", "10", "11"])
+
+        snapshot = loaded.snapshot()
+        self.assertEqual(snapshot.rank("12"), "species")
+        self.assertEqual(loaded.subnodes("2", levels=2), ["10", "11", "12"])
+        self.assertEqual(loaded.subnodes("1", levels=10),
+                         ["2", "10", "11", "13", "12", "20", "21"])
+        self.assertEqual(snapshot.is_descendant(
+            ["13", "10", "21", "2", "99"], "10").tolist(),
+            [True, False, False, False, False])
+        self.assertTrue(loaded.is_descendant("13", "2"))
+        self.assertEqual(loaded.lca("13", "12"), "10")
+        self.assertEqual(loaded.lca("13", "21"), "1")
+        self.assertEqual(loaded.lca("11", "13"), "11")
+        self.assertRaises(KeyError, snapshot.lineage, "99")
+        self.assertRaises(KeyError, snapshot.lineage, "abc")
+        self.assertRaises(KeyError, loaded.lineage, "abc")
+        self.assertNotIn("abc", snapshot)
+        self.assertEqual(snapshot.positions(["abc", None]).tolist(), [-1, -1])
+
+        # without the snapshot, the same answers come from queries
+        for tax_id, _, _ in NODES:
+            for levels in [1, 2, 10]:
+                self.assertEqual(tax.subnodes(tax_id, levels),
+                                 loaded.subnodes(tax_id, levels))
+            for other, _, _ in NODES:
+                self.assertEqual(tax.is_descendant(tax_id, other),
+                                 loaded.is_descendant(tax_id, other))
+                self.assertEqual(tax.lca(tax_id, other),
+                                 loaded.lca(tax_id, other))
+        self.assertFalse(tax.is_descendant("99", "1"))
+        self.assertFalse(tax.loaded)
+
+        # the snapshot is saved and reused
+        saved = ncbi_taxonomy.TaxonomySnapshot.load(self.db + ".snapshot.npz")
+        self.assertEqual(saved.version, snapshot.version)
+        self.assertEqual(saved.enter.tolist(), snapshot.enter.tolist())
+        self.assertEqual(saved.ranks, snapshot.ranks)
+
+    def test_parent(self):
+        subnodes = {}
+        for loaded in [False, True]:
+            tax = taxonomy.Taxonomy.__new__(taxonomy.Taxonomy)
+            tax._tax = ncbi_taxonomy.Taxonomy(self.db, loaded=loaded)
+            self.assertEqual(tax.parent("13"), "11")
+            self.assertEqual(tax.parent("1"), "1")
+            self.assertEqual(tax.rank("12"), "species")
+            self.assertEqual(tax.subnodes("2"), ["10"])
+            self.assertEqual(tax.subnodes("1", 2), ["2", "10", "20", "21"])
+            self.assertEqual(tax._tax.loaded, loaded)
+            subnodes[loaded] = [tax.subnodes(tax_id, levels)
+                                for tax_id, _, _ in NODES
+                                for levels in [1, 2, 3, 10]]
+        self.assertEqual(subnodes[False], subnodes[True])
@@ -0,0 +1,277 @@
+import random
+import unittest
+
+import numpy
+
+from orangecontrib.bio import gene, geneset
+
+try:
+    import Orange.utils
+    from orangecontrib.bio.geneset import transform
+except ImportError:
+    transform = None
+
+
+def expression_table(X, y, classes=("a", "b")):
+    """An Orange table with genes g0, g1, ... and a class."""
+    attributes = [Orange.feature.Continuous("g%d" % i)
+                  for i in range(X.shape[1])]
+    class_var = Orange.feature.Discrete("c", values=list(classes))
+    domain = Orange.data.Domain(attributes, class_var)
+    rows = [["?" if numpy.isnan(v) else float(v) for v in row] +
+            [classes[c]] for row, c in zip(X, y)]
+    return Orange.data.Table(domain, rows)
+
+
+def expression_data():
+    rng = numpy.random.RandomState(1)
+    X = rng.randint(-5, 6, size=(8, 12)).astype(float)
+    X[:, 1] = X[[1, 0, 3, 2, 7, 6, 5, 4], 0]  # tied with 0
+    X[:, 2] = 3.  # no variance
+    X[:, 3] = [1.] * 4 + [2.] * 4  # no variance within classes
+    X[:3, 5] = numpy.nan  # a single value in the first class
+    X[:, 6] = X[:, 0] + 1  # tied with 0 and 1
+    X[:, 7] = -X[:, 0]
+    X[5, 8] = numpy.nan
+    return expression_table(X, [0] * 4 + [1] * 4)
+
+
+def same(a, b):
+    return a == b or a != a and b != b
+
+
+@unittest.skipIf(transform is None, "Orange 2 is not available")
+class TestClassStatistics(unittest.TestCase):
+    def setUp(self):
+        self.data = expression_data()
+        self.n = len(self.data.domain.attributes)
+
+    def test_tscores(self):
+        stats = transform.ClassStatistics(self.data)
+        for i in range(self.n):
+            expected = transform.tscorec(self.data, i)
+            if numpy.isfinite(expected):
+                self.assertAlmostEqual(stats.tscores[i], expected)
+            else:
+                self.assertTrue(same(stats.tscores[i], expected))
+
+    def test_gaussians(self):
+        stats = transform.ClassStatistics(self.data)
+        for i in range(self.n):
+            expected = transform.estimate_gaussian_per_class(
+                self.data, i, common_if_extreme=True)
+            for v, e in zip(stats.gaussian(i), expected):
+                if e is None:
+                    self.assertIsNone(v)
+                else:
+                    self.assertAlmostEqual(v, e)
+
+    def corg_baseline(self, inds):
+        """ CORGs from per-gene t-scores (as before ClassStatistics). """
+        tscores = [transform.tscorec(self.data, at) for at in inds]
+        sortedinds = transform.nth(sorted(zip(inds, tscores),
+                                          key=lambda x: x[1],
+                                          reverse=numpy.mean(tscores) >= 0), 0)
+
+        def S(corg):
+            X = numpy.array([[transform.corgs_activity_score(ex, corg)]
+                             for ex in self.data])
+            y = [int(ex.getclass()) for ex in self.data]
+            return abs(transform.tscorec(expression_table(X, y), 0))
+
+        g, bg = S(sortedinds[:1]), 1
+        for a in range(2, len(sortedinds) + 1):
+            tg = S(sortedinds[:a])
+            if tg > g:
+                g, bg = tg, a
+            else:
+                break
+        return sortedinds[:bg]
+
+    def test_compute_corg(self):
+        cache = transform.StatisticsCache()
+        sets = [[0, 1, 6], [0, 7, 1], [2, 3, 0], [3, 2], [5, 8, 9, 10, 11],
+                [9, 10, 11, 0, 1], [7, 8, 9]]
+        for inds in sets:
+            expected = self.corg_baseline(inds)
+            self.assertEqual(transform.compute_corg(self.data, inds), expected)
+            self.assertEqual(transform.compute_corg(
+                self.data, inds, statistics=cache(self.data)), expected)
+            # the old interface with a cache of t-scores
+            tscorecache = {}
+            self.assertEqual(transform.compute_corg(self.data, inds, tscorecache),
+                             expected)
+            self.assertEqual(sorted(tscorecache), sorted(set(inds)))
+
+    def test_compute_llr(self):
+        inds = list(range(self.n))
+        expected = [transform.estimate_gaussian_per_class(
+            self.data, i, common_if_extreme=True) for i in inds]
+        cache = {}
+        for res in [transform.compute_llr(self.data, inds),
+                    transform.compute_llr(self.data, inds, cache),
+                    transform.compute_llr(self.data, inds, cache),
+                    transform.compute_llr(
+                        self.data, inds,
+                        statistics=transform.StatisticsCache()(self.data))]:
+            for g, e in zip(res, expected):
+                for v, ev in zip(g, e):
+                    if ev is None:
+                        self.assertIsNone(v)
+                    else:
+                        self.assertAlmostEqual(v, ev)
+        self.assertEqual(sorted(cache), inds)
+
+    def test_statistics_cache(self):
+        cache = transform.StatisticsCache(maxsize=2)
+        stats = cache(self.data)
+        self.assertIs(cache(Orange.data.Table(self.data)), stats)
+        other = Orange.data.Table(self.data)
+        other[0][0] = 100.
+        self.assertIsNot(cache(other), stats)
+
+
+def random_data(n_genes=30, n_samples=20, seed=0):
+    rng = numpy.random.RandomState(seed)
+    X = rng.randn(n_samples, n_genes)
+    y = [0] * (n_samples // 2) + [1] * (n_samples - n_samples // 2)
+    X[numpy.array(y) == 1, :5] += 1.5
+    X[rng.rand(n_samples, n_genes) < 0.05] = numpy.nan
+    return expression_table(X, y)
+
+
+def random_gene_sets(n_genes=30, seed=0):
+    rng = numpy.random.RandomState(seed)
+    sets = [geneset.GeneSet(id="set%d" % i, name="set%d" % i,
+                            genes=["g%d" % g for g in
+                                   rng.choice(n_genes, 6, replace=False)])
+            for i in range(8)]
+    # a set of differentially expressed genes and some unknown ones
+    sets.append(geneset.GeneSet(id="de", name="de",
+                                genes=["g0", "g1", "g2", "g3", "x1", "x2"]))
+    return sets
+
+
+@unittest.skipIf(transform is None, "Orange 2 is not available")
+class TestParallelFit(unittest.TestCase):
+    def setUp(self):
+        self.data = random_data()
+        self.gene_sets = random_gene_sets()
+
+    def transformed(self, method, n_jobs, **kwargs):
+        trans = method(matcher=gene.matcher([]), gene_sets=self.gene_sets,
+                       n_jobs=n_jobs, **kwargs)
+        res = trans(self.data)
+        return [a.name for a in res.domain.attributes], \
+            numpy.array([[float(v) for v in ex.native(0)[:-1]] for ex in res])
+
+    def test_serial_and_parallel(self):
+        methods = [(transform.PLS, {}), (transform.PCA, {}),
+                   (transform.PCA, {"turn": True}),
+                   (transform.SPCA, {"threshold": 0.2, "atleast": 1}),
+                   (transform.CORGs, {}), (transform.LLR, {}),
+                   (transform.LLR, {"normalize": False})]
+        for method, kwargs in methods:
+            names, serial = self.transformed(method, 1, **kwargs)
+            self.assertEqual(len(names), len(self.gene_sets))
+            for n_jobs in [2, 3]:
+                pnames, parallel = self.transformed(method, n_jobs, **kwargs)
+                self.assertEqual(pnames, names)
+                numpy.testing.assert_allclose(
+                    parallel, serial, err_msg=method.__name__)
+
+    def test_build_feature(self):
+        """ Features built one by one equal those built together. """
+        for method in [transform.PCA, transform.CORGs]:
+            trans = method(matcher=gene.matcher([]), gene_sets=self.gene_sets)
+            features = trans.build_features(self.data, self.gene_sets)
+            for gs, at in zip(self.gene_sets, features):
+                single = trans.build_feature(self.data, gs)
+                for ex in self.data:
+                    self.assertAlmostEqual(float(at.get_value_from(ex, 0)),
+                                           float(single.get_value_from(ex, 0)))
+
+
+@unittest.skipIf(transform is None, "Orange 2 is not available")
+class TestSPCAPermutations(unittest.TestCase):
+    def setUp(self):
+        self.data = random_data(n_genes=40, n_samples=16, seed=3)
+        self.gene_sets = random_gene_sets(n_genes=40, seed=3)
+
+    def threshold_baseline(self, pval, perm, sperm):
+        """ The threshold from t-scores of shuffled copies of the data. """
+        from orangecontrib.bio.utils import expression
+        joined = []
+        rand = random.Random(0)
+        nat = len(self.data.domain.attributes)
+        datap = Orange.data.Table(self.data.domain, self.data)
+        for p in range(perm):
+            transform._shuffleClass(datap, rand)
+            if sperm is not None:
+                ti = rand.sample(range(nat), sperm)
+            else:
+                ti = range(nat)
+            joined.extend([expression.MA_t_test()(i, datap) for i in ti])
+        joined = sorted(map(abs, joined), reverse=True)
+        return joined[int(pval * len(joined))]
+
+    def test_threshold(self):
+        for pval, perm, sperm in [(0.05, 30, 10), (0.01, 45, None),
+                                  (0.2, 7, 40)]:
+            trans = transform.SPCA_ttperm(
+                matcher=gene.matcher([]), gene_sets=self.gene_sets,
+                pval=pval, perm=perm, sperm=sperm, atleast=1)
+            features = trans.build_features(self.data, self.gene_sets)
+            expected = self.threshold_baseline(pval, perm, sperm)
+            self.assertAlmostEqual(trans.threshold, expected)
+
+            # the same genes as selected with the baseline threshold
+            spca = transform.SPCA(
+                matcher=gene.matcher([]), gene_sets=self.gene_sets,
+                threshold=expected, atleast=1)
+            expected_features = spca.build_features(self.data, self.gene_sets)
+            self.assertEqual([set(at.dbg[0]) for at in features],
+                             [set(at.dbg[0]) for at in expected_features])
+
+    def test_parallel(self):
+        thresholds = []
+        for n_jobs in [1, 2]:
+            trans = transform.SPCA_ttperm(
+                matcher=gene.matcher([]), gene_sets=self.gene_sets,
+                perm=50, sperm=20, n_jobs=n_jobs)
+            trans.build_features(self.data, self.gene_sets)
+            thresholds.append(trans.threshold)
+        self.assertEqual(thresholds[0], thresholds[1])
+
+
+@unittest.skipIf(transform is None, "Orange 2 is not available")
+class TestSetSig(unittest.TestCase):
+    def test_matrix_and_instances(self):
+        rng = numpy.random.RandomState(4)
+        X = rng.randn(9, 12)
+        X[:, 0] = 2.  # a constant gene
+        X[:, 1] = 2.
+        gene_sets = [geneset.GeneSet(id=str(i), name=str(i), genes=genes)
+                     for i, genes in enumerate(
+                         [["g0", "g1", "g2"], ["g0", "g1"],
+                          ["g3", "g4", "g5", "g6"], ["g7", "g8", "g9"]])]
+        # a single member of a class
+        for y in [[0] * 8 + [1], [0] * 4 + [1] * 5]:
+            data = expression_table(X, y)
+            for check_same in [False, True]:
+                trans = transform.SetSig(matcher=gene.matcher([]),
+                                         gene_sets=gene_sets, min_size=2,
+                                         no_unknowns=True,
+                                         check_same=check_same)
+                res = trans(data)
+                # values computed for each instance (setSig_example_geneset)
+                slow = Orange.data.Table(res.domain, data)
+                for ex, ex_slow in zip(res, slow):
+                    for v, e in zip(ex.native(0)[:-1], ex_slow.native(0)[:-1]):
+                        e = float(e)
+                        self.assertAlmostEqual(
+                            float(v), e if numpy.isfinite(e) else 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+import os
+import random
+import threading
+import warnings
+import unittest
+
+import numpy
+
+from orangecontrib.bio.utils import parallel, stats
+
+
+class TestParallel(unittest.TestCase):
+    def test_parallel_map(self):
+        offset = 3  # a closure need not be picklable
+
+        def func(x):
+            return x * x + offset
+
+        progress = []
+        res = parallel.parallel_map(func, range(10), n_jobs=2,
+                                    callback=progress.append)
+        self.assertEqual(res, [x * x + 3 for x in range(10)])
+        self.assertEqual(progress, list(range(1, 11)))
+
+        self.assertEqual(parallel.parallel_map(func, [], n_jobs=2), [])
+        self.assertEqual(parallel.parallel_map(func, [1], n_jobs=-1), [4])
+
+    def test_workers(self):
+        pids = parallel.parallel_map(lambda _: os.getpid(), range(4),
+                                     n_jobs=2)
+        if parallel._fork_context() is not None:
+            self.assertNotIn(os.getpid(), pids)
+
+    def test_threads(self):
+        """ Calls from other threads run serially, each with its own func. """
+        results = {}
+
+        def run(k):
+            results[k] = parallel.parallel_map(
+                lambda x: (k, x, os.getpid()), range(6), n_jobs=2)
+
+        threads = [threading.Thread(target=run, args=(k,)) for k in range(4)]
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertTrue(w)
+        self.assertTrue(all(issubclass(x.category, RuntimeWarning)
+                            for x in w))
+        for k in range(4):
+            self.assertEqual(results[k],
+                             [(k, x, os.getpid()) for x in range(6)])
+        self.assertIsNone(parallel._tasks)
+
+    def test_nested(self):
+        res = parallel.parallel_map(
+            lambda x: parallel.parallel_map(lambda y: x * y, range(3),
+                                            n_jobs=2),
+            range(4), n_jobs=2)
+        self.assertEqual(res, [[x * y for y in range(3)] for x in range(4)])
+
+    def test_effective_n_jobs(self):
+        self.assertEqual(parallel.effective_n_jobs(None), 1)
+        self.assertEqual(parallel.effective_n_jobs(1), 1)
+        self.assertEqual(parallel.effective_n_jobs(4), 4)
+        self.assertEqual(parallel.effective_n_jobs(-1), parallel.cpu_count())
+
+
+class TestStats(unittest.TestCase):
+    def _test_p_values(self, prob, hypergeometric):
+        rnd = random.Random(42)
+        args = []
+        for _ in range(500):
+            N = rnd.randint(1, 500)
+            m, n = rnd.randint(0, N), rnd.randint(0, N)
+            k = rnd.randint(0, min(n, m) if hypergeometric else n)
+            args.append((k, N, m, n))
+        # include very small p-values (the inexact 1 - sum case)
+        args += [(40, 1000, 10, 50), (1, 1000, 999, 1), (0, 10, 0, 5)]
+        expected = [prob.p_value(*a) for a in args]
+        k, N, m, n = map(numpy.array, zip(*args))
+        numpy.testing.assert_allclose(prob.p_values(k, N, m, n), expected,
+                                      rtol=1e-9, atol=1e-300)
+        numpy.testing.assert_allclose(
+            stats.p_values(prob, k, N, m, n), expected, rtol=1e-9)
+
+    def test_binomial(self):
+        self._test_p_values(stats.Binomial(), False)
+
+    def test_hypergeometric(self):
+        self._test_p_values(stats.Hypergeometric(), True)
+
+    def test_pmf_out_of_range(self):
+        prob = stats.Hypergeometric()
+        k, N, m, n = [numpy.array(a) for a in
+                      zip((-1000, 4000, 2000, 1), (2000, 4000, 2000, 1),
+                          (1, 4000, 2000, 1))]
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            res = prob._pmf(k, N, m, n)
+        numpy.testing.assert_allclose(res, [0., 0., prob(1, 4000, 2000, 1)])
+
+    def test_p_values_shape(self):
+        prob = stats.Hypergeometric()
+        res = prob.p_values([[1, 2], [3, 0]], 20, 5, 6)
+        self.assertEqual(res.shape, (2, 2))
+        self.assertAlmostEqual(res[1, 0], prob.p_value(3, 20, 5, 6))
+        self.assertEqual(res[1, 1], 1.0)
+
+    def test_fdr(self):
+        p_values = [0.01, 0.04, 0.03, 0.005, 0.5]
+        fdr = stats.FDR(p_values)
+        self.assertIsInstance(fdr, list)
+        numpy.testing.assert_allclose(
+            fdr, [0.025, 0.05, 0.05, 0.025, 0.5])
+        self.assertEqual(stats.FDR(sorted(p_values), ordered=True),
+                         sorted(fdr))
+
+        by = stats.FDR(numpy.array(p_values), dependent=True)
+        self.assertIsInstance(by, numpy.ndarray)
+        harmonic = sum(1.0 / i for i in range(1, 6))
+        numpy.testing.assert_allclose(by, numpy.array(fdr) * harmonic)
+
+        self.assertEqual(stats.FDR([]), [])
+        numpy.testing.assert_allclose(stats.Bonferroni(p_values),
+                                      numpy.array(p_values) / 5)
+
+    def test_q_values(self):
+        rs = numpy.random.RandomState(0)
+        p_values = numpy.concatenate([rs.uniform(size=4000),
+                                      rs.beta(0.1, 10, size=1000)])
+        pi0 = stats.estimate_pi0(p_values)
+        self.assertGreater(pi0, 0.7)
+        self.assertLess(pi0, 0.95)
+        self.assertGreater(stats.estimate_pi0(rs.uniform(size=5000)), 0.95)
+        self.assertAlmostEqual(stats.estimate_pi0(p_values, 0.5),
+                               numpy.mean(p_values > 0.5) / 0.5)
+
+        q = stats.q_values(p_values, pi0=pi0)
+        numpy.testing.assert_allclose(
+            q, numpy.minimum(pi0 * stats.FDR(p_values), 1.0))
+
+        q = stats.q_values([0.01, float("nan"), 0.5], pi0=1.0)
+        self.assertEqual(q[0], 0.02)
+        self.assertTrue(numpy.isnan(q[1]))
@@ -5,6 +5,7 @@ from . import stats
 from . import expression
 from . import group
 from . import environ
+from . import parallel
 
 
 def progress_bar_milestones(count, iterations=100):
@@ -0,0 +1,793 @@
+"""
+Array based computation of gene set enrichment scores (GSEA).
+
+Gene sets are encoded as a single CSR index (:class:`GeneSetIndex`) of
+gene (column) indices, so that the running-sum enrichment scores of all
+sets for a ranking are computed with a few vectorized operations.
+Gene rankings for many (permuted) phenotype labellings are computed
+directly from the expression matrix (:func:`ranking_statistics`), and
+the significance of all sets is computed on an array of their null
+distributions (:func:`significance`).
+
+Per-sample gene set scores (means, medians and correlation t-scores of
+:mod:`orangecontrib.bio.geneset.transform`) are computed for all sets
+at once from a sparse gene-set membership matrix.
+
+"""
+from __future__ import absolute_import, division
+
+import random
+
+import numpy
+import scipy.sparse
+
+from . import parallel
+
+
+def ranked_order(ranking):
+    """
+    Return the indices of `ranking` ordered by decreasing value (ties keep
+    their original order, as in :func:`orangecontrib.bio.gsea.orderedPointersCorr`).
+    """
+    ranking = numpy.asarray(ranking, dtype=float)
+    return numpy.argsort(-ranking, kind="mergesort")
+
+
+def ranked_positions(ranking):
+    """
+    Return the position of each gene in the ranked order of `ranking`
+    (the inverse of :func:`ranked_order`).
+    """
+    order = ranked_order(ranking)
+    positions = numpy.empty(len(order), dtype=int)
+    positions[order] = numpy.arange(len(order))
+    return positions
+
+
+class GeneSetIndex(object):
+    """
+    Gene sets encoded as a CSR index of gene indices.
+
+    The genes of set `i` are ``indices[indptr[i]:indptr[i + 1]]``.
+
+    :param sets: A sequence of gene index sequences (duplicate genes
+        within a set are ignored).
+    :param int n_genes: The number of genes (length of the rankings).
+    """
+    def __init__(self, sets, n_genes):
+        sets = [numpy.asarray(s, dtype=int).ravel() for s in sets]
+        sizes = numpy.array([len(s) for s in sets], dtype=int)
+        set_ids = numpy.repeat(numpy.arange(len(sets)), sizes)
+        if len(sets):
+            genes = numpy.concatenate(sets).astype(numpy.int64)
+        else:
+            genes = numpy.zeros(0, dtype=numpy.int64)
+        keys = numpy.unique(set_ids * n_genes + genes)
+        set_ids, genes = numpy.divmod(keys, n_genes)
+        sizes = numpy.bincount(set_ids, minlength=len(sets))
+        indptr = numpy.r_[0, numpy.cumsum(sizes)]
+        self._init(indptr, genes, n_genes)
+
+    @classmethod
+    def from_csr(cls, indptr, indices, n_genes):
+        """
+        Construct the index directly from `indptr` and `indices` arrays
+        (the genes within a set must be unique).
+        """
+        index = cls.__new__(cls)
+        index._init(indptr, indices, n_genes)
+        return index
+
+    def _init(self, indptr, indices, n_genes):
+        self.indptr = numpy.asarray(indptr, dtype=int)
+        self.indices = numpy.asarray(indices, dtype=int)
+        self.n_genes = n_genes
+        self._set_ids = None
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    @property
+    def sizes(self):
+        """The number of genes in each set."""
+        return numpy.diff(self.indptr)
+
+    @property
+    def set_ids(self):
+        """The set of each entry in `indices`."""
+        if self._set_ids is None:
+            self._set_ids = numpy.repeat(numpy.arange(len(self)), self.sizes)
+        return self._set_ids
+
+    def take(self, sets):
+        """Return an index of the selected `sets` (set indices)."""
+        sets = numpy.asarray(sets, dtype=int)
+        sizes = self.sizes[sets]
+        offsets = numpy.cumsum(sizes) - sizes
+        entries = (numpy.repeat(self.indptr[sets] - offsets, sizes) +
+                   numpy.arange(sizes.sum()))
+        return GeneSetIndex.from_csr(numpy.r_[0, numpy.cumsum(sizes)],
+                                     self.indices[entries], self.n_genes)
+
+    def enrichment_scores(self, ranking, p=1.0):
+        """
+        Return the enrichment scores of all sets for `ranking` (the same
+        as :func:`orangecontrib.bio.gsea.enrichmentScoreRanked` for each
+        set up to rounding: the total weight of a set is summed in the
+        ranked order instead of the set iteration order, so the scores
+        can differ in the last few bits).
+
+        :param ranking: Correlations of genes with the phenotype.
+        :param float p: The weight exponent.
+        :rtype: numpy.ndarray
+        """
+        ranking = numpy.asarray(ranking, dtype=float)
+        order = ranked_order(ranking)
+        positions = numpy.empty(len(order), dtype=int)
+        positions[order] = numpy.arange(len(order))
+        weights = numpy.abs(ranking[order])
+        if p != 1.0:
+            weights = weights ** p
+        return self.scores_at(positions, weights)
+
+    def scores_at(self, positions, weights, genes=None):
+        """
+        Return the enrichment scores of all sets given the ranked
+        `positions` of genes and `weights` (absolute correlations) at each
+        position.
+
+        :param positions: Position of each gene in the ranked order.
+        :param weights: Weight of the gene at each ranked position.
+        :param genes: Indices into `positions` to use in place of
+            `indices`.
+        """
+        if genes is None:
+            genes = self.indices
+        n = self.n_genes
+        set_ids = self.set_ids
+        # sort genes by their position within each set
+        keys = set_ids.astype(numpy.int64) * n + positions[genes]
+        keys.sort()
+        set_positions = keys - set_ids.astype(numpy.int64) * n
+        return running_sum_scores(
+            self.indptr, set_positions, weights[set_positions], n)
+
+
+def permutation_scores(index, null_rankings, n, seed=2000, block=25,
+                       n_jobs=1, callback=None, observed=None,
+                       early_stopping=None, score=None):
+    """
+    Return the enrichment scores of all sets for `n` permutations (an
+    array of shape (n, len(index))).
+
+    Permutation `i` uses the seed ``seed + i``. The permutations are
+    processed in blocks of `block` (distributed among `n_jobs` worker
+    processes), so the results do not depend on `n_jobs`.
+
+    With `early_stopping` set to `h`, a set is no longer permuted once `h`
+    of its null scores are at least as extreme as its `observed` score
+    (Besag and Clifford's sequential p-value); the scores of the skipped
+    permutations are NaN.
+
+    :param GeneSetIndex index: Gene sets.
+    :param null_rankings: A function returning the rankings (a sequence
+        or an array with a row per ranking) for a sequence of seeds.
+    :param int n: Number of permutations.
+    :param int seed: Seed of the first permutation.
+    :param int block: Number of permutations ranked at once.
+    :param int n_jobs: Number of worker processes.
+    :param callback: A function called (without arguments) after each
+        permutation.
+    :param observed: The observed enrichment scores (for `early_stopping`).
+    :param int early_stopping: The number of extreme null scores after
+        which a set is not permuted any more (default: None, no stopping).
+    :param score: A function ``score(index, ranking)`` returning the
+        enrichment scores of `index` for a null ranking (default:
+        ``index.enrichment_scores(ranking)``).
+    """
+    starts = list(range(0, n, block))
+    n_jobs = parallel.effective_n_jobs(n_jobs)
+    if score is None:
+        score = GeneSetIndex.enrichment_scores
+
+    def scores(start, index, callback=None):
+        seeds = range(seed + start, seed + min(start + block, n))
+        res = numpy.zeros((len(seeds), len(index)))
+        for i, ranking in enumerate(null_rankings(seeds)):
+            res[i] = score(index, ranking)
+            if callback is not None:
+                callback()
+        return res
+
+    def run(starts, index):
+        if n_jobs == 1 or len(starts) < 2:
+            return [scores(start, index, callback) for start in starts]
+        done = [0]
+
+        def progress(count):
+            # report each permutation from the completed blocks
+            for start in starts[done[0]:count]:
+                for _ in range(min(start + block, n) - start):
+                    callback()
+            done[0] = count
+
+        return parallel.parallel_map(lambda start: scores(start, index),
+                                     starts, n_jobs=n_jobs,
+                                     callback=progress if callback else None)
+
+    if early_stopping is None:
+        res = run(starts, index)
+        if not res:
+            return numpy.zeros((0, len(index)))
+        return numpy.vstack(res)
+
+    observed = numpy.asarray(observed, dtype=float)
+    res = numpy.full((n, len(index)), numpy.nan)
+    exceeded = numpy.zeros(len(index), dtype=int)
+    stopped = numpy.zeros(len(index), dtype=bool)
+    processed = 0
+    # a round of blocks for the active sets at a time; the scores after a
+    # set's stopping permutation are discarded, as if the blocks were run
+    # one by one
+    for r in range(0, len(starts), n_jobs):
+        active = numpy.flatnonzero(~stopped)
+        if len(active) == 0:
+            break
+        round_starts = starts[r:r + n_jobs]
+        for start, null in zip(round_starts,
+                               run(round_starts, index.take(active))):
+            obs = observed[active]
+            extreme = numpy.where(obs >= 0, null >= obs, null <= obs)
+            before = exceeded[active] + numpy.cumsum(extreme, axis=0) - extreme
+            used = (before < early_stopping) & ~stopped[active]
+            res[start:start + len(null), active] = \
+                numpy.where(used, null, numpy.nan)
+            exceeded[active] += (extreme & used).sum(axis=0)
+            stopped[active] |= exceeded[active] >= early_stopping
+            processed += len(null)
+
+    if callback is not None:
+        for _ in range(n - processed):
+            callback()
+    return res
+
+
+def random_positions(random, k, n):
+    """
+    Return `k` distinct random integers from ``range(n)`` in random order
+    (the first `k` elements of a random permutation).
+
+    :param numpy.random.RandomState random: Random generator.
+    """
+    if 2 * k > n:
+        return random.permutation(n)[:k]
+    values = random.randint(0, n, k)
+    order = numpy.arange(k)
+    first = numpy.empty(n, dtype=int)
+    while True:
+        # the first occurrence of each value (the last assignment wins)
+        first[values[::-1]] = order[::-1]
+        repeated = first[values] != order
+        count = numpy.count_nonzero(repeated)
+        if count == 0:
+            return values
+        # draw again for the repeated values
+        values[repeated] = random.randint(0, n, count)
+
+
+def preranked(ranking, sets, n=1000, p=1.0, seed=0, block=25, n_jobs=1,
+              early_stopping=None, callback=None):
+    """
+    Gene set enrichment analysis of a precomputed gene ranking with gene
+    permutations.
+
+    The ranking is sorted once. Permutation `i` assigns random distinct
+    ranked positions (drawn with ``numpy.random.RandomState(seed + i)``)
+    to the genes in the sets, which is the same as randomly permuting all
+    genes, but without creating the permuted rankings.
+
+    :param numpy.ndarray ranking: Correlations of genes with the phenotype.
+    :param sets: Gene sets as a :class:`GeneSetIndex`, a pair of CSR
+        arrays ``(indptr, indices)`` or a sequence of gene index arrays.
+    :param int n: Number of permutations.
+    :param float p: The weight exponent.
+    :param int seed: Seed of the first permutation.
+    :param int block: Number of permutations processed at once.
+    :param int n_jobs: Number of worker processes.
+    :param int early_stopping: See :func:`permutation_scores`.
+    :param callback: A function called after each permutation.
+    :return: A tuple of arrays (ES, NES, p-values, FDR) with an element
+        for each set.
+    """
+    ranking = numpy.asarray(ranking, dtype=float)
+    n_genes = len(ranking)
+    if isinstance(sets, GeneSetIndex):
+        index = sets
+    elif isinstance(sets, tuple) and len(sets) == 2:
+        index = GeneSetIndex.from_csr(sets[0], sets[1], n_genes)
+    else:
+        index = GeneSetIndex(sets, n_genes)
+
+    order = ranked_order(ranking)
+    positions = numpy.empty(n_genes, dtype=int)
+    positions[order] = numpy.arange(n_genes)
+    weights = numpy.abs(ranking[order])
+    if p != 1.0:
+        weights = weights ** p
+
+    observed = index.scores_at(positions, weights)
+
+    # slots of genes that are in any of the sets
+    genes = numpy.unique(index.indices)
+    slots = numpy.zeros(n_genes, dtype=int)
+    slots[genes] = numpy.arange(len(genes))
+
+    def null_positions(seeds):
+        return (random_positions(numpy.random.RandomState(s), len(genes),
+                                 n_genes)
+                for s in seeds)
+
+    def score(index, null_positions):
+        return index.scores_at(null_positions, weights,
+                               genes=slots[index.indices])
+
+    nulls = permutation_scores(index, null_positions, n, seed=seed,
+                               block=block, n_jobs=n_jobs, callback=callback,
+                               observed=observed,
+                               early_stopping=early_stopping, score=score)
+    nes, pvals, fdr = significance(observed, nulls.T)
+    return observed, nes, pvals, fdr
+
+
+def running_sum_scores(indptr, positions, weights, n_genes,
+                       max_block=2 ** 22):
+    """
+    Return the maximum deviation from zero of the running enrichment sum
+    for every set.
+
+    :param indptr: CSR index pointers of the sets.
+    :param positions: The ranked positions of the genes in each set
+        (increasing within a set).
+    :param weights: Weights of the genes in `positions`.
+    :param int n_genes: Length of the ranking.
+    :param int max_block: Maximal number of elements in the (padded) array
+        of running sums computed at once.
+    """
+    indptr = numpy.asarray(indptr)
+    positions = numpy.asarray(positions)
+    weights = numpy.asarray(weights, dtype=float)
+    sizes = numpy.diff(indptr)
+    n_sets = len(sizes)
+    scores = numpy.zeros(n_sets)
+    if n_sets == 0:
+        return scores
+
+    set_ids = numpy.repeat(numpy.arange(n_sets), sizes)
+    sum_weights = numpy.bincount(set_ids, weights, minlength=n_sets)
+    valid = sum_weights != 0
+    # sets with zero total weight are skipped (their scores stay 0)
+    in_set = numpy.where(valid, 1. / numpy.where(valid, sum_weights, 1.), 0.)
+    rest = n_genes - sizes
+    not_in_set = numpy.where(rest > 0, -(1. / numpy.maximum(rest, 1)), 0.)
+
+    # The running sum steps down by `not_in_set` for every gene not in the
+    # set and up by `weight * in_set` for every gene in the set. Steps down
+    # between consecutive genes from the set are joined (as in
+    # enrichmentScoreRanked) so that the sums are accumulated in the same
+    # order.
+    gaps = numpy.empty_like(positions)
+    gaps[1:] = positions[1:] - positions[:-1] - 1
+    starts = indptr[:-1][sizes > 0]
+    gaps[starts] = positions[starts]
+    down = not_in_set[set_ids] * gaps
+    up = in_set[set_ids] * weights
+    tail = numpy.zeros(n_sets)
+    ends = indptr[1:][sizes > 0] - 1
+    tail[sizes > 0] = n_genes - positions[ends] - 1
+    tail = not_in_set * tail
+
+    # Accumulate the interleaved steps of sets of similar size in padded
+    # blocks (row per set).
+    selected = numpy.argsort(sizes, kind="mergesort")
+    selected = selected[valid[selected]]
+    widths = 2 * sizes[selected] + 1
+    start = 0
+    while start < len(selected):
+        cost = numpy.arange(1, len(selected) - start + 1) * widths[start:]
+        end = start + max(numpy.searchsorted(cost, max_block, side="right"), 1)
+        rows = selected[start:end]
+        start = end
+
+        k = sizes[rows]
+        offsets = numpy.cumsum(k) - k
+        row = numpy.repeat(numpy.arange(len(rows)), k)
+        local = numpy.arange(k.sum()) - offsets[row]
+        member = indptr[rows][row] + local
+
+        block = numpy.zeros((len(rows), 2 * k.max() + 1))
+        block[row, 2 * local] = down[member]
+        block[row, 2 * local + 1] = up[member]
+        block[numpy.arange(len(rows)), 2 * k] = tail[rows]
+        sums = numpy.cumsum(block, axis=1)
+
+        max_sum = numpy.maximum(sums.max(axis=1), 0.)
+        min_sum = numpy.minimum(sums.min(axis=1), 0.)
+        scores[rows] = numpy.where(
+            numpy.abs(max_sum) > numpy.abs(min_sum), max_sum, min_sum)
+    return scores
+
+
+def permuted_labels(labels, seeds):
+    """
+    Return an array with a row of `labels` permuted for each seed in
+    `seeds` (the same permutations as :func:`orangecontrib.bio.gsea.shuffleClass`).
+    """
+    labels = numpy.asarray(labels)
+    permuted = numpy.empty((len(seeds), len(labels)), dtype=labels.dtype)
+    for row, seed in zip(permuted, seeds):
+        locations = list(range(len(labels)))
+        random.Random(seed).shuffle(locations)
+        row[locations] = labels
+    return permuted
+
+
+def ranking_statistics(X, labels, statistic="signal_to_noise", a=0, b=1,
+                       keep_undefined=False):
+    """
+    Return the differential expression of all genes between two groups of
+    samples for one or more labellings of the samples.
+
+    Group sums are computed for all labellings at once with matrix
+    products.
+
+    :param X: Expression matrix (samples x genes), NaN for missing values.
+    :param labels: Sample labels (group indices), or a two dimensional
+        array of labellings (a row per labelling).
+    :param str statistic: "signal_to_noise" (as
+        :class:`~orangecontrib.bio.utils.expression.MA_signalToNoise`)
+        or "t" (as :class:`~orangecontrib.bio.utils.expression.MA_t_test`).
+    :param int a: The label of the first group.
+    :param int b: The label of the second group.
+    :param bool keep_undefined: Keep infinite and undefined (NaN)
+        statistics, as scipy.stats.ttest_ind returns them for genes
+        without variance or with too few values.
+    :return: An array of statistics (labellings x genes). Genes without
+        enough values in a group get 0 (unless `keep_undefined`). Unlike
+        MA_signalToNoise, which gives NaN for a group with fewer than two
+        values, this keeps such genes in the middle of a ranking.
+    """
+    if statistic not in ("signal_to_noise", "t"):
+        raise ValueError("Unknown statistic %r" % statistic)
+    X = numpy.asarray(X, dtype=float)
+    labels = numpy.atleast_2d(labels)
+    known = ~numpy.isnan(X)
+    # center the genes for a more accurate variance
+    counts = known.sum(axis=0)
+    center = numpy.where(known, X, 0.).sum(axis=0) / numpy.maximum(counts, 1)
+    Xc = numpy.where(known, X - center, 0.)
+    known = known.astype(float)
+
+    def moments(group):
+        G = (labels == group).astype(float)
+        n = G.dot(known)
+        s = G.dot(Xc)
+        ss = G.dot(Xc * Xc)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            m = s / n
+        # sum of squared deviations
+        d = numpy.maximum(ss - s * numpy.nan_to_num(m), 0.)
+        return n, m, d
+
+    na, ma, da = moments(a)
+    nb, mb, db = moments(b)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        if statistic == "signal_to_noise":
+            def stdevm(n, m, d):
+                # minimally 0.2*|m|, where m=0 is adjusted to m=1
+                m = m + center
+                return numpy.maximum(numpy.sqrt(d / (n - 1)),
+                                     0.2 * numpy.abs(numpy.where(m == 0, 1., m)))
+            stat = (ma - mb) / (stdevm(na, ma, da) + stdevm(nb, mb, db))
+        else:
+            pooled = (da + db) / (na + nb - 2)
+            stat = (ma - mb) / numpy.sqrt(pooled * (1. / na + 1. / nb))
+    if keep_undefined:
+        return stat
+    if statistic == "signal_to_noise":
+        valid = (na > 1) & (nb > 1)
+    else:
+        valid = (na > 0) & (nb > 0) & (na + nb > 2)
+    valid &= numpy.isfinite(stat)
+    return numpy.where(valid, stat, 0.)
+
+
+def significance(scores, nulls):
+    """
+    Return normalized enrichment scores, nominal p-values and FDR q-values
+    of gene sets (as :func:`orangecontrib.bio.gsea.gseaSignificance`).
+
+    :param scores: Enrichment scores of sets.
+    :param nulls: Null enrichment scores (an array of shape
+        (len(scores), number of permutations), NaN for skipped
+        permutations).
+    :return: A tuple of arrays (NES, p-values, FDR).
+    """
+    scores = numpy.asarray(scores, dtype=float)
+    nulls = numpy.asarray(nulls, dtype=float).reshape(len(scores), -1)
+    known = ~numpy.isnan(nulls)
+    positive = known & (nulls >= 0)
+    negative = known & (nulls < 0)
+
+    # nominal p-values from the part of the null distribution with the
+    # same sign as the ES
+    es = scores[:, None]
+    neg_es = scores < 0
+    extreme = numpy.where(neg_es, numpy.sum(known & (nulls <= es), axis=1),
+                          numpy.sum(known & (nulls >= es), axis=1))
+    total = numpy.where(neg_es, negative.sum(axis=1), positive.sum(axis=1))
+    p = numpy.where(total > 0, extreme / numpy.maximum(total, 1), 1.0)
+
+    # rescale positive and negative scores by the mean positive and
+    # negative null score; means are accumulated sequentially (as sum)
+    def mean(mask):
+        count = mask.sum(axis=1)
+        if nulls.shape[1] == 0:
+            return count, numpy.zeros(len(scores))
+        sums = numpy.cumsum(numpy.where(mask, nulls, 0.), axis=1)[:, -1]
+        return count, sums / numpy.maximum(count, 1)
+
+    n_pos, mean_pos = mean(positive)
+    n_neg, mean_neg = mean(negative)
+    pos_ok = ((n_pos > 0) & (mean_pos != 0))[:, None]
+    neg_ok = (n_neg > 0)[:, None]
+    mean_pos = numpy.where(pos_ok[:, 0], mean_pos, 1.)[:, None]
+    mean_neg = numpy.where(neg_ok[:, 0], mean_neg, 1.)[:, None]
+
+    def normalize(values):
+        res = numpy.where(values >= 0,
+                          numpy.where(pos_ok, values / mean_pos, 0.),
+                          numpy.where(neg_ok, -values / mean_neg, 0.))
+        res[values == 0] = 0.
+        res[numpy.isnan(values)] = numpy.nan
+        return res
+
+    nes = normalize(es)[:, 0]
+    null_nes = normalize(nulls)
+
+    # FDR: the fraction of null NES (of the same sign) at least as extreme
+    # divided by the fraction of observed NES at least as extreme
+    nvals = numpy.sort(null_nes[known])
+    nnes = numpy.sort(nes)
+    nonneg = nes >= 0
+
+    def counts(values):
+        n = len(values)
+        zero = numpy.searchsorted(values, 0, side="left")
+        same_sign = numpy.where(nonneg, n - zero, zero)
+        as_extreme = numpy.where(
+            nonneg, n - numpy.searchsorted(values, nes, side="left"),
+            numpy.searchsorted(values, nes, side="right"))
+        return same_sign, as_extreme
+
+    all_pos, all_higher = counts(nvals)
+    nes_pos, nes_higher = counts(nnes)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        top = all_higher / all_pos.astype(float)
+        down = nes_higher / nes_pos.astype(float)
+        fdr = top / down
+    valid = (all_pos > 0) & (nes_pos > 0) & (down != 0)
+    fdr = numpy.where(valid, fdr, 1000000000.0)
+    return nes, p, fdr
+
+
+def class_gaussians(X, labels, a=0, b=1, common_if_extreme=True):
+    """
+    Return means and sample standard deviations of known values of all
+    genes in two groups of samples (as
+    :func:`~orangecontrib.bio.geneset.transform.estimate_gaussian_per_class`).
+
+    :param X: Expression matrix (samples x genes), NaN for missing values.
+    :param labels: Sample labels (group indices).
+    :param bool common_if_extreme: Genes without variance in a group
+        get the standard deviation of both groups in both groups.
+    :return: An array (genes x 4) of the mean and the standard deviation
+        of the first and of the second group; NaN where a group has too
+        few values.
+    """
+    X = numpy.asarray(X, dtype=float)
+    labels = numpy.asarray(labels)
+
+    def moments(rows):
+        Xr = X[rows]
+        known = ~numpy.isnan(Xr)
+        n = known.sum(axis=0)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            mi = numpy.where(known, Xr, 0.).sum(axis=0) / n
+            ss = numpy.where(known, (Xr - mi) ** 2, 0.).sum(axis=0)
+            st = numpy.sqrt(ss / (n - 1))
+        st[n < 2] = numpy.nan
+        return mi, st
+
+    mi1, st1 = moments(labels == a)
+    mi2, st2 = moments(labels == b)
+    if common_if_extreme:
+        _, st = moments((labels == a) | (labels == b))
+        extreme = (st1 == 0) | (st2 == 0)
+        st1 = numpy.where(extreme, st, st1)
+        st2 = numpy.where(extreme, st, st2)
+    return numpy.array([mi1, st1, mi2, st2]).T
+
+
+def activity_tscores(X, labels, inds):
+    """
+    Return t-scores of CORGs activity scores (sums of values, with
+    unknown values as 0, divided by the square root of the number of
+    genes) of all prefixes of genes `inds`.
+    """
+    X = numpy.nan_to_num(numpy.asarray(X, dtype=float)[:, inds])
+    scores = numpy.cumsum(X, axis=1) / numpy.sqrt(numpy.arange(1, len(inds) + 1))
+    return ranking_statistics(scores, labels, "t", keep_undefined=True)[0]
+
+
+def corg_genes(X, labels, inds, tscores=None):
+    """
+    Return condition-responsive genes (CORGs) of a gene set: member
+    genes ordered by their t-scores (decreasing if their mean is
+    non-negative) are added while the t-score of the activity score
+    increases.
+
+    :param X: Expression matrix (samples x genes), NaN for missing values.
+    :param labels: Sample labels (0 and 1).
+    :param list inds: Indices of genes of the set.
+    :param tscores: t-scores of genes `inds` (computed if not given).
+    :return: A list of CORG indices.
+    """
+    inds = list(inds)
+    if tscores is None:
+        tscores = ranking_statistics(numpy.asarray(X, dtype=float)[:, inds],
+                                     labels, "t", keep_undefined=True)[0]
+    tscores = [float(t) for t in tscores]
+    pairs = sorted(zip(inds, tscores), key=lambda x: x[1],
+                   reverse=bool(numpy.mean(tscores) >= 0))
+    sortedinds = [i for i, _ in pairs]
+    # absolute separation of activity scores (not in the article)
+    S = numpy.abs(activity_tscores(X, labels, sortedinds))
+    best = 1
+    for a in range(2, len(sortedinds) + 1):
+        if S[a - 1] > S[best - 1]:
+            best = a
+        else:
+            break
+    return sortedinds[:best]
+
+
+def _membership_columns(membership):
+    """Return CSC arrays of membership with genes repeated by their counts."""
+    M = scipy.sparse.csc_matrix(membership)
+    counts = numpy.round(M.data).astype(int)
+    sets = numpy.repeat(numpy.arange(M.shape[1]), numpy.diff(M.indptr))
+    sizes = numpy.bincount(numpy.repeat(sets, counts), minlength=M.shape[1])
+    indptr = numpy.concatenate([[0], numpy.cumsum(sizes)])
+    return indptr, numpy.repeat(M.indices, counts)
+
+
+def set_means(X, membership):
+    """
+    Return the mean of known values of genes of each set for all samples.
+
+    :param X: Expression matrix (samples x genes), NaN for missing values.
+    :param membership: A sparse (genes x sets) matrix with the number of
+        times a gene is counted in a set.
+    :return: An array (samples x sets); NaN where a set has no known
+        values.
+    """
+    X = numpy.asarray(X, dtype=float)
+    M = scipy.sparse.csc_matrix(membership)
+    known = ~numpy.isnan(X)
+    sums = M.T.dot(numpy.where(known, X, 0.).T).T
+    counts = M.T.dot(known.T.astype(float)).T
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        return numpy.where(counts > 0, sums / counts, numpy.nan)
+
+
+def set_medians(X, membership):
+    """
+    Return the median of known values of genes of each set for all
+    samples (see :func:`set_means`).
+    """
+    X = numpy.asarray(X, dtype=float)
+    indptr, indices = _membership_columns(membership)
+    res = numpy.empty((X.shape[0], len(indptr) - 1))
+    res.fill(numpy.nan)
+    for i in range(len(indptr) - 1):
+        values = numpy.sort(X[:, indices[indptr[i]:indptr[i + 1]]], axis=1)
+        # NaN are sorted last
+        counts = numpy.sum(~numpy.isnan(values), axis=1)
+        rows = numpy.flatnonzero(counts)
+        lo = values[rows, (counts[rows] - 1) // 2]
+        hi = values[rows, counts[rows] // 2]
+        res[rows, i] = (lo + hi) / 2.
+    return res
+
+
+def set_correlation_scores(L, labels, A, membership, exclude_same=False,
+                           no_unknowns=False):
+    """
+    Return correlation t-scores of samples for all gene sets (SetSig,
+    :class:`orangecontrib.bio.geneset.transform.SetSig`).
+
+    For each set, a sample from `A` is correlated (Pearson, on genes
+    known in both samples) with every sample from `L` and the
+    correlations with samples of the first and the second group are
+    compared with a t-test.
+
+    :param L: Learning expression matrix (samples x genes), NaN for
+        missing values.
+    :param labels: Groups (0 or 1) of learning samples; samples with
+        other labels are not used.
+    :param A: Expression matrix of samples to score (with the same genes
+        as `L`).
+    :param membership: A sparse (genes x sets) matrix (see
+        :func:`set_means`).
+    :param bool exclude_same: Leave out learning samples with the same
+        values of the set genes as the scored sample.
+    :param bool no_unknowns: Correlate samples on all genes of a set
+        instead of on genes known in both; learning samples with unknown
+        values of set genes are left out (and samples of `A` with them get 0).
+    :return: An array of t-scores (samples of `A` x sets); 0 where they
+        are undefined or infinite.
+    """
+    L = numpy.asarray(L, dtype=float)
+    A = numpy.asarray(A, dtype=float)
+    labels = numpy.asarray(labels)
+    groups = [labels == 0, labels == 1]
+    indptr, indices = _membership_columns(membership)
+    res = numpy.empty((A.shape[0], len(indptr) - 1))
+
+    for i in range(len(indptr) - 1):
+        cols = indices[indptr[i]:indptr[i + 1]]
+        Ls, As = L[:, cols], A[:, cols]
+        kl, ka = ~numpy.isnan(Ls), ~numpy.isnan(As)
+        # correlation is invariant to a common shift of all values
+        shift = numpy.nanmean(Ls) if kl.any() else 0.
+        Ls = numpy.where(kl, Ls - shift, 0.)
+        As = numpy.where(ka, As - shift, 0.)
+        kl, ka = kl.astype(float), ka.astype(float)
+        # sums over genes known in both samples of a pair
+        n = ka.dot(kl.T)
+        sa, sl = As.dot(kl.T), ka.dot(Ls.T)
+        saa, sll = (As * As).dot(kl.T), ka.dot((Ls * Ls).T)
+        sal = As.dot(Ls.T)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            va = numpy.maximum(n * saa - sa * sa, 0.)
+            vl = numpy.maximum(n * sll - sl * sl, 0.)
+            r = (n * sal - sa * sl) / numpy.sqrt(va * vl)
+        r[n < 2] = numpy.nan
+
+        if exclude_same:
+            def keys(values, known):
+                return [v.tobytes() + k.tobytes() for v, k in
+                        zip(values + 0., known.astype(bool))]
+            learn = keys(Ls, kl)
+            skip = numpy.array([[a == l for l in learn]
+                                for a in keys(As, ka)], dtype=bool)
+            skip = skip.reshape(r.shape)
+        else:
+            skip = numpy.zeros(r.shape, dtype=bool)
+        if no_unknowns:
+            skip |= n < len(cols)
+
+        moments = []
+        for g in groups:
+            use = ~skip & g
+            count = use.sum(axis=1)
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                m = numpy.where(use, r, 0.).sum(axis=1) / count
+                d = numpy.where(use, (r - m[:, None]) ** 2, 0.).sum(axis=1)
+            moments.append((count, m, d))
+        (na, ma, da), (nb, mb, db) = moments
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            pooled = (da + db) / (na + nb - 2)
+            t = (ma - mb) / numpy.sqrt(pooled * (1. / na + 1. / nb))
+        res[:, i] = numpy.where(numpy.isfinite(t), t, 0.)
+    return res
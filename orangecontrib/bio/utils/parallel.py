@@ -0,0 +1,120 @@
+"""
+Helpers for running independent tasks on a pool of worker processes.
+
+The workers are forked, so the task function and its items (including any
+large arrays they reference) are inherited by the workers instead of being
+pickled for each task. Only the results are sent back. Where fork is not
+available, and in threads other than the main thread (forking a
+multithreaded process is unsafe), the tasks run serially in the calling
+process.
+
+"""
+from __future__ import absolute_import
+
+import sys
+import threading
+import warnings
+import multiprocessing
+
+# (func, items) of the parallel_map run by a worker process; set by the
+# pool initializer, so it is None in the calling process.
+_tasks = None
+
+
+def cpu_count():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def effective_n_jobs(n_jobs):
+    """
+    Return the number of worker processes for `n_jobs` (`None` or 1 means
+    no workers, negative numbers count back from the number of CPUs, i.e.
+    -1 uses all of them).
+    """
+    if n_jobs is None or n_jobs == 0:
+        return 1
+    elif n_jobs < 0:
+        return max(cpu_count() + 1 + n_jobs, 1)
+    else:
+        return n_jobs
+
+
+def _fork_context():
+    if sys.platform == "win32":
+        return None
+    try:
+        return multiprocessing.get_context("fork")
+    except AttributeError:
+        # Python 2 always forks on posix.
+        return multiprocessing
+    except ValueError:
+        return None
+
+
+def _in_main_thread():
+    try:
+        return threading.current_thread() is threading.main_thread()
+    except AttributeError:
+        # Python 2
+        return isinstance(threading.current_thread(), threading._MainThread)
+
+
+def _init_worker(func, items):
+    # the arguments are inherited by the forked workers (not pickled)
+    global _tasks
+    _tasks = (func, items)
+
+
+def _run_task(i):
+    func, items = _tasks
+    return func(items[i])
+
+
+def parallel_map(func, items, n_jobs=1, callback=None, chunksize=1):
+    """
+    Return ``[func(item) for item in items]``, computed on `n_jobs` forked
+    worker processes.
+
+    :param func: A function of a single argument (need not be picklable).
+    :param items: A sequence of arguments.
+    :param int n_jobs: Number of worker processes (see `effective_n_jobs`).
+        Outside the main thread the items are processed serially (with
+        a RuntimeWarning if more than one worker was requested).
+    :param callback:
+        An optional function called with the number of completed items
+        (in the calling process).
+    :param int chunksize: Number of items sent to a worker at a time.
+
+    """
+    items = list(items)
+    n_jobs = min(effective_n_jobs(n_jobs), len(items))
+    context = _fork_context() if n_jobs > 1 else None
+
+    if context is not None and _tasks is None and not _in_main_thread():
+        warnings.warn("parallel_map called outside the main thread runs "
+                      "serially (n_jobs=%d ignored)" % n_jobs, RuntimeWarning,
+                      stacklevel=2)
+        context = None
+
+    if context is None or _tasks is not None:
+        # serial (also when called from within a worker or another thread)
+        results = []
+        for i, item in enumerate(items):
+            results.append(func(item))
+            if callback:
+                callback(i + 1)
+        return results
+
+    pool = context.Pool(n_jobs, _init_worker, (func, items))
+    try:
+        results = []
+        for result in pool.imap(_run_task, range(len(items)), chunksize):
+            results.append(result)
+            if callback:
+                callback(len(results))
+        return results
+    finally:
+        pool.terminate()
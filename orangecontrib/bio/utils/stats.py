@@ -2,6 +2,8 @@ import math
 import threading
 import six
 
+import numpy
+
 
 def _lngamma(z):
     x = 0
@@ -40,6 +42,69 @@ class LogBin(object):
                     LogBin._lookup.append(math.log(LogBin._max_factorial))
             LogBin._max = max
 
+    @staticmethod
+    def _lookup_array():
+        """Return the log factorial lookup table as a numpy array."""
+        with LogBin._lock:
+            array = LogBin.__dict__.get("_lookup_np")
+            if array is None or len(array) != len(LogBin._lookup):
+                array = numpy.array(LogBin._lookup, dtype=float)
+                LogBin._lookup_np = array
+            return array
+
+    def _logbin_array(self, n, k):
+        """Vectorized version of `_logbin` for integer arrays n and k."""
+        if n.size and n.max() >= self._max:
+            self._extend(int(n.max()) + 100)
+        lookup = self._lookup_array()
+        valid = (k < n) & (k >= 0)
+        n = numpy.where(valid, n, 0)
+        k = numpy.where(valid, k, 0)
+        return numpy.where(valid, lookup[n] - lookup[n - k] - lookup[k], 0.0)
+
+    def _range_sums(self, start, stop, N, m, n):
+        """
+        Return sums of probabilities (`_pmf`) of i in range(start, stop)
+        for each element of the (equal length 1D) argument arrays.
+        """
+        lengths = numpy.maximum(stop - start, 0)
+        total = int(lengths.sum())
+        if not total:
+            return numpy.zeros(len(start))
+        idx = numpy.repeat(numpy.arange(len(start)), lengths)
+        offsets = numpy.cumsum(lengths) - lengths
+        i = start[idx] + (numpy.arange(total) - offsets[idx])
+        pmf = self._pmf(i, N[idx], m[idx], n[idx])
+        return numpy.bincount(idx, weights=pmf, minlength=len(start))
+
+    def _tail_p_values(self, k, N, m, n, upper):
+        """
+        The probability that k or more (up to and including upper) tests
+        are positive (vectorized `p_value`).
+        """
+        k, N, m, n, upper = numpy.broadcast_arrays(
+            *[numpy.asarray(a, dtype=numpy.int64) for a in [k, N, m, n, upper]])
+        shape = k.shape
+        k, N, m, n, upper = [a.ravel() for a in [k, N, m, n, upper]]
+        res = numpy.empty(len(k))
+
+        # starting from k gives the shorter list of values
+        direct = upper - k + 1 <= k
+        res[direct] = self._range_sums(k[direct], upper[direct] + 1,
+                                       N[direct], m[direct], n[direct])
+
+        comp = numpy.flatnonzero(~direct)
+        value = 1.0 - self._range_sums(numpy.zeros(len(comp), dtype=int),
+                                       k[comp], N[comp], m[comp], n[comp])
+        # if the value is small it is probably inexact due to the limited
+        # precision of floats, so compute it without subtraction
+        inexact = value < 1e-3
+        ie = comp[inexact]
+        value[inexact] = self._range_sums(k[ie], upper[ie] + 1,
+                                          N[ie], m[ie], n[ie])
+        res[comp] = value
+        return res.reshape(shape)
+
     def _logbin(self, n, k):
         if n >= self._max:
             self._extend(n + 100)
@@ -102,6 +167,24 @@ class Binomial(LogBin):
             else:
                 return value
 
+    def _pmf(self, k, N, m, n):
+        """Vectorized `__call__`."""
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            p = 1.0 * m / N
+            res = numpy.exp(self._logbin_array(n, k) +
+                            k * numpy.log(p) + (n - k) * numpy.log(1.0 - p))
+        res = numpy.minimum(res, 1.0)
+        res = numpy.where(p == 0.0, (k == 0).astype(float), res)
+        res = numpy.where(p == 1.0, (k == n).astype(float), res)
+        return res
+
+    def p_values(self, k, N, m, n):
+        """ Vectorized :func:`p_value`: the arguments can be numpy arrays
+        (or sequences) of equal (or broadcastable) shapes. Return an array
+        of p-values.
+        """
+        return self._tail_p_values(k, N, m, n, n)
+
 class Hypergeometric(LogBin):
     """ `Hypergeometric distribution
     <http://en.wikipedia.org/wiki/Hypergeometric_distribution>`_ is
@@ -144,68 +227,194 @@ class Hypergeometric(LogBin):
             else:
                 return value
 
-## to speed-up FDR, calculate ahead sum([1/i for i in range(1, m+1)]), for m in [1,100000]. For higher values of m use an approximation, with error less or equal to 4.99999157277e-006. (sum([1/i for i in range(1, m+1)])  ~ log(m) + 0.5772..., 0.5572 is an Euler-Mascheroni constant) 
-c = [1.0]
-for m in range(2, 100000):
-    c.append( c[-1] + 1.0/m)
+    def _pmf(self, k, N, m, n):
+        """Vectorized `__call__`."""
+        valid = (k >= numpy.maximum(0, n + m - N)) & (k <= numpy.minimum(n, m))
+        # out-of-range k could overflow exp; their probabilities are 0
+        logp = numpy.where(valid, self._logbin_array(m, k) +
+                           self._logbin_array(N - m, n - k) -
+                           self._logbin_array(N, n), -numpy.inf)
+        return numpy.minimum(numpy.exp(logp), 1.0)
+
+    def p_values(self, k, N, m, n):
+        """ Vectorized :func:`p_value`: the arguments can be numpy arrays
+        (or sequences) of equal (or broadcastable) shapes. Return an array
+        of p-values.
+        """
+        return self._tail_p_values(k, N, m, n, numpy.minimum(n, m))
+
+
+def p_values(prob, k, N, m, n):
+    """
+    Return an array of p-values of `prob` (a :class:`Binomial` or
+    :class:`Hypergeometric` instance) for arrays of k, N, m and n.
+    Falls back to `prob.p_value` for objects without `p_values`.
+    """
+    if hasattr(prob, "p_values"):
+        return prob.p_values(k, N, m, n)
+    k, N, m, n = numpy.broadcast_arrays(k, N, m, n)
+    return numpy.array([prob.p_value(*args) for args in
+                        zip(*[a.ravel().tolist() for a in [k, N, m, n]])],
+                       dtype=float).reshape(k.shape)
+
+#: Euler-Mascheroni constant
+EULER_GAMMA = 0.57721566490153286060651209008240243104215933593992
+
+
+def _harmonic(m):
+    """
+    Return the m-th harmonic number (``sum([1/i for i in range(1, m+1)])``).
+
+    For m < 100000 the sum is computed exactly (the cost is negligible
+    compared to the sorting of m p-values), for larger m the approximation
+    log(m) + 0.5772... (with error less or equal to 4.99999157277e-006) is
+    used.
+    """
+    m = int(m)
+    if m < 100000:
+        return float(numpy.cumsum(1.0 / numpy.arange(1, m + 1))[-1])
+    else:
+        return math.log(m) + EULER_GAMMA
+
 
 def is_sorted(l):
     return all(l[i] <= l[i+1] for i in range(len(l)-1))
 
+
+def _as_result(values, like):
+    """Return `values` as a list unless `like` is a numpy array."""
+    return values if isinstance(like, numpy.ndarray) else values.tolist()
+
+
 def FDR(p_values, dependent=False, m=None, ordered=False):
     """
     `False Discovery Rate <http://en.wikipedia.org/wiki/False_discovery_rate>`_ correction on a list of p-values.
 
-    :param p_values: a list of p-values.
+    The Benjamini-Hochberg procedure (Benjamini-Yekutieli if `dependent` is
+    True). If `p_values` is a numpy array, an array is returned.
+
+    :param p_values: a list (or a numpy array) of p-values.
     :param dependent: use correction for dependent hypotheses (default False).
     :param m: number of hypotheses tested (default ``len(p_values)``).
     :param ordered: prevent sorting of p-values if they are already sorted (default False).
     """
+    p = numpy.asarray(p_values, dtype=float).ravel()
 
-    if not ordered:
-        ordered = is_sorted(p_values)
+    if not m:
+        m = len(p)
+    if m <= 0 or not len(p):
+        return _as_result(numpy.zeros(0), p_values)
 
-    if not ordered:
-        joined = [ (v,i) for i,v in enumerate(p_values) ]
-        joined.sort()
-        p_values = [ p[0] for p in joined ]
-        indices = [ p[1] for p in joined ]
+    if dependent:  # correct q for dependent tests
+        m = m * _harmonic(m)
+
+    if ordered:
+        order = None
+    else:
+        order = numpy.argsort(p, kind="mergesort")
+        p = p[order]
+
+    fdrs = p * m / numpy.arange(1.0, len(p) + 1)
+    fdrs = numpy.minimum.accumulate(fdrs[::-1])[::-1]
+
+    if order is not None:
+        unsorted = numpy.empty_like(fdrs)
+        unsorted[order] = fdrs
+        fdrs = unsorted
+
+    return _as_result(fdrs, p_values)
 
-    if not m:
-        m = len(p_values)
-    if m <= 0 or not p_values:
-        return []
-
-    if dependent: # correct q for dependent tests
-        k = c[m-1] if m <= len(c) else math.log(m) + 0.57721566490153286060651209008240243104215933593992
-        m = m * k
-
-    tmp_fdrs = [p*m/(i+1.0) for (i, p) in enumerate(p_values)]
-    fdrs = []
-    cmin = tmp_fdrs[-1]
-    for f in reversed(tmp_fdrs):
-        cmin = min(f, cmin)
-        fdrs.append( cmin)
-    fdrs.reverse()
-
-    if not ordered:
-        new = [ None ] * len(fdrs)
-        for v,i in zip(fdrs, indices):
-            new[i] = v
-        fdrs = new
-
-    return fdrs
 
 def Bonferroni(p_values, m=None):
     """
     `Bonferroni correction <http://en.wikipedia.org/wiki/Bonferroni_correction>`_ correction on a list of p-values.
 
-    :param p_values: a list of p-values.
+    If `p_values` is a numpy array, an array is returned.
+
+    :param p_values: a list (or a numpy array) of p-values.
     :param m: number of hypotheses tested (default ``len(p_values)``).
     """
+    p = numpy.asarray(p_values, dtype=float)
     if not m:
-        m = len(p_values)
+        m = p.size
     if m == 0:
-        return []
+        return _as_result(numpy.zeros(0), p_values)
     m = float(m)
-    return [p/m for p in p_values]
+    return _as_result(p / m, p_values)
+
+
+def estimate_pi0(p_values, lambdas=None, smooth=True):
+    """
+    Estimate the proportion of true null hypotheses (pi0) from a list of
+    p-values, as proposed by `Storey and Tibshirani (2003)
+    <http://dx.doi.org/10.1073/pnas.1530509100>`_.
+
+    pi0(lambda) = #{p > lambda} / (m * (1 - lambda)) is computed for all
+    `lambdas` and (if `smooth` is True) a cubic smoothing spline (weighted
+    by the estimates' standard errors) fitted to it is evaluated at the
+    largest lambda.
+
+    :param p_values: a list (or a numpy array) of p-values (nan values
+        are ignored).
+    :param lambdas: tuning parameter values (default
+        ``numpy.arange(0, 0.96, 0.05)``); if a single value is given the
+        unsmoothed pi0(lambda) is returned.
+    :param bool smooth: smooth the pi0(lambda) estimates.
+    :rtype: float
+    """
+    p = numpy.asarray(p_values, dtype=float).ravel()
+    p = numpy.sort(p[~numpy.isnan(p)])
+    m = len(p)
+    if not m:
+        return 1.0
+
+    if lambdas is None:
+        lambdas = numpy.arange(0, 0.96, 0.05)
+    lambdas = numpy.atleast_1d(numpy.asarray(lambdas, dtype=float))
+
+    greater = m - numpy.searchsorted(p, lambdas, side="right")
+    pi0s = greater / (m * (1.0 - lambdas))
+
+    if len(lambdas) < 4 or not smooth:
+        pi0 = pi0s[-1]
+    else:
+        import scipy.interpolate
+        # weight by the inverse (binomial) standard error of pi0(lambda)
+        var = pi0s * (1.0 - (1.0 - lambdas) * pi0s) / (m * (1.0 - lambdas))
+        spline = scipy.interpolate.UnivariateSpline(
+            lambdas, pi0s, w=1.0 / numpy.sqrt(var + 1e-12), k=3)
+        pi0 = float(spline(lambdas[-1]))
+        if pi0 <= 0:
+            # a poor fit; fall back to the raw estimate
+            pi0 = pi0s[-1]
+    if pi0 <= 0:
+        return 1.0
+    return float(min(pi0, 1.0))
+
+
+def q_values(p_values, pi0=None, lambdas=None, m=None, ordered=False):
+    """
+    Storey's `q-values <http://dx.doi.org/10.1073/pnas.1530509100>`_ for a
+    list of p-values (the Benjamini-Hochberg adjusted p-values scaled by
+    the estimated proportion of true null hypotheses and capped at 1).
+
+    If `p_values` is a numpy array, an array is returned. Missing (nan)
+    p-values have nan q-values.
+
+    :param p_values: a list (or a numpy array) of p-values.
+    :param float pi0: proportion of true null hypotheses (default
+        estimated with :func:`estimate_pi0`).
+    :param lambdas: passed to :func:`estimate_pi0`.
+    :param m: number of hypotheses tested (default number of p-values).
+    :param ordered: prevent sorting of p-values if they are already sorted
+        (default False).
+    """
+    p = numpy.asarray(p_values, dtype=float).ravel()
+    valid = ~numpy.isnan(p)
+    if pi0 is None:
+        pi0 = estimate_pi0(p[valid], lambdas)
+
+    q = numpy.full(p.shape, numpy.nan)
+    q[valid] = numpy.minimum(
+        pi0 * FDR(p[valid], m=m, ordered=ordered), 1.0)
+    return _as_result(q, p_values)
@@ -132,9 +132,10 @@ def ncbi_info(taxid, genes, advance=None):
 
     schema = [schema_link, "Symbol", "Locus Tag", "Chromosome",
               "Description", "Synonyms", "Nomenclature"]
+    columns = ["gene_id", "symbol", "locus_tag", "chromosome", "description",
+               "synonyms", "symbol_from_nomenclature_authority"]
     ret = []
-    for gene_name in genes:
-        gi = info.get_info(gene_name)
+    for gene_name, gi in zip(genes, info.get_infos(genes, columns=columns)):
         if gi:
             ret.append([schema_link.format(gene_id=gi.gene_id, text=gi.gene_id),
                         gi.symbol + " (%s)" % gene_name if gene_name != gi.symbol else gi.symbol,
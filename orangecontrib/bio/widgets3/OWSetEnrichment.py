@@ -117,19 +117,6 @@ def withtraceback(func):
     return f
 
 
-def memoize(func):
-    cache = {}
-
-    def memoized(arg):
-        try:
-            return cache[arg]
-        except KeyError:
-            cache[arg] = value = func(arg)
-            return value
-
-    return memoized
-
-
 class OWSetEnrichment(widget.OWWidget):
     name = "Set Enrichment"
     description = ""
@@ -630,14 +617,12 @@ class OWSetEnrichment(widget.OWWidget):
 
         def namematcher():
             matcher = genematcher.result()
-            match = matcher.set_targets(ref_set.result())
-            match.umatch = memoize(match.umatch)
-            return match
+            return matcher.set_targets(ref_set.result())
 
         def map_unames():
             matcher = namematcher.result()
-            query = list(filter(None, map(matcher.umatch, querynames)))
-            reference = list(filter(None, map(matcher.umatch, ref_set.result())))
+            query = list(filter(None, matcher.umatch_many(querynames)))
+            reference = list(filter(None, matcher.umatch_many(ref_set.result())))
             return query, reference
 
         if self._nogenematching():
@@ -674,13 +659,11 @@ class OWSetEnrichment(widget.OWWidget):
             query, reference = map_unames()
             gscollections = collections.result()
 
-            results = []
+            targets = []
             info("Running enrichment")
             p = 0
             for i, gset in enumerate(gscollections):
-                genes = set(filter(None, map(match.umatch, gset.genes)))
-                enr = set_enrichment(genes, reference, query)
-                results.append((gset, enr))
+                targets.append(set(filter(None, match.umatch_many(gset.genes))))
 
                 if state.cancelled:
                     raise UserInteruptException
@@ -689,6 +672,8 @@ class OWSetEnrichment(widget.OWWidget):
                 if pnew != p:
                     progress(pnew)
                     p = pnew
+            results = list(zip(gscollections,
+                               set_enrichments(targets, reference, query)))
             progress(100)
             info("")
             return query, reference, results
@@ -939,16 +924,18 @@ class OWSetEnrichment(widget.OWWidget):
 
         axis = 1 if self.genesinrows else 0
         if axis == 1:
-            mapped = [attr for attr in self.data.domain.attributes
-                      if matcher.umatch(attr.name) in mapped]
+            attrs = self.data.domain.attributes
+            mapped = [attr for attr, name in
+                      zip(attrs, matcher.umatch_many(a.name for a in attrs))
+                      if name in mapped]
 
             newdomain = Orange.data.Domain(
                 mapped, self.data.domain.class_vars, self.data.domain.metas)
             data = self.data.from_table(newdomain, self.data)
         else:
             geneattr = self.geneAttrs[self.geneattr]
-            selected = [i for i, ex in enumerate(self.data)
-                        if matcher.umatch(str(ex[geneattr])) in mapped]
+            names = matcher.umatch_many(str(ex[geneattr]) for ex in self.data)
+            selected = [i for i, name in enumerate(names) if name in mapped]
             data = self.data[selected]
         self.send("Data subset", data)
 
@@ -975,28 +962,33 @@ enrichment_res = namedtuple(
 )
 
 
-def set_enrichment(target, reference, query,
-                   prob=utils.stats.Hypergeometric()):
+def set_enrichments(targets, reference, query,
+                    prob=utils.stats.Hypergeometric()):
     """
-    :param set query: query set
-    :param set target: target set
-    :param set reference: the reference set
+    Return a list of enrichment results (query and reference genes in
+    each target, the p-value and the enrichment score) for a list of
+    `targets`, with the p-values computed in a single vectorized call.
+
+    :param list targets: A list of target sets.
+    :param set reference: The reference set.
+    :param set query: The query set.
 
     """
     assert len(reference) > 0
-    query_mapped = target.intersection(query)
-    reference_mapped = target.intersection(reference)
-
-    query_p = len(query_mapped) / len(query) if query else np.nan
-    ref_p = len(reference_mapped) / len(reference) if reference else np.nan
-    enrichment = query_p / ref_p if ref_p else np.nan
-
-    return enrichment_res(
-        list(query_mapped), list(reference_mapped),
-        prob.p_value(len(query_mapped), len(reference),
-                     len(reference_mapped), len(query)),
-        enrichment
-    )
+    query_mapped = [target.intersection(query) for target in targets]
+    reference_mapped = [target.intersection(reference) for target in targets]
+    p_values = utils.stats.p_values(
+        prob, [len(q) for q in query_mapped], len(reference),
+        [len(r) for r in reference_mapped], len(query))
+
+    results = []
+    for q, r, p_value in zip(query_mapped, reference_mapped, p_values):
+        query_p = len(q) / len(query) if query else np.nan
+        ref_p = len(r) / len(reference) if reference else np.nan
+        enrichment = query_p / ref_p if ref_p else np.nan
+        results.append(enrichment_res(list(q), list(r), float(p_value),
+                                      enrichment))
+    return results
 
 
 if __name__ == "__main__":
@@ -0,0 +1,41 @@
+"""
+Build alias indices and joined aliases of gene matchers in advance.
+
+For each given organism (taxonomy id) the indices of NCBI, Ensembl,
+GO and KEGG gene aliases, and the joined aliases of all of them, are
+built in the gene matcher buffer folder, so that matchers of these
+organisms load without building anything.
+
+Usage::
+
+    python build_gene_matchers.py 9606 10090 ...
+
+"""
+from __future__ import print_function
+
+import sys
+
+from orangecontrib.bio import gene
+
+SOURCES = [("NCBI", gene.GMNCBI), ("Ensembl", gene.GMEnsembl),
+           ("GO", gene.GMGO), ("KEGG", gene.GMKEGG)]
+
+
+def build(taxid, ignore_case=True):
+    matchers = []
+    for name, source in SOURCES:
+        try:
+            mat = source(taxid, ignore_case=ignore_case)
+            mat.alias_index()
+        except Exception as ex:
+            print("%s: skipping %s aliases (%s)" % (taxid, name, ex))
+        else:
+            matchers.append(mat)
+    if len(matchers) > 1:
+        joined = gene.MatcherAliasesPickledJoined(matchers).build()
+        print("%s: %d joined groups of aliases" % (taxid, len(joined)))
+
+
+if __name__ == "__main__":
+    for taxid in sys.argv[1:]:
+        build(taxid)